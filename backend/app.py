@@ -1,22 +1,55 @@
 # app.py - FastAPI Backend API Server
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import os
+import asyncio
 import uuid
 import tempfile
 import json
+import time
 from pathlib import Path
 
 # Import our Python modules
-from misra_chat_client import init_vertex_ai, load_cpp_file, start_chat, send_file_intro, send_misra_violations
-from excel_utils import extract_violations_for_file
-from numbering import add_line_numbers
-from denumbering import remove_line_numbers
-from replace import merge_fixed_snippets_into_file
-from fixed_response_code_snippet import extract_snippets_from_response, save_snippets_to_json
+from misra_chat_client import (
+    prewarm_models, model_registry_stats, load_cpp_file, start_chat, send_file_intro,
+    stream_message, stream_misra_violations, send_chat_message
+)
+from continuation import (
+    DEFAULT_MAX_TURNS, DEFAULT_TOKEN_BUDGET, merge_snippets,
+    send_with_continuations, stream_with_continuations
+)
+from scope_index import CONTEXT_MODES, ScopeIndex
+from jobs import JobScheduler, JobCancelled
+from batch_project import BatchProject, DEFAULT_BATCH_WORKERS
+from fix_cache import open_fix_cache, plan_cached_fixes, store_fixes
+from fanout import (
+    FANOUT_MODES, DEFAULT_FANOUT_GROUPS, DEFAULT_FANOUT_WIDTH, partition_violations,
+    merge_group_snippets, fix_violation_group, violation_line
+)
+from excel_utils import extract_violations_for_file, list_report_files
+from numbered_document import NumberedDocument, DocumentCache, DEFAULT_CACHED_DOCUMENTS
+from patch_history import PatchHistory
+from token_budget import TokenEstimator, plan_violation_batches, send_batched
+from token_usage import MeteredChat, add_usage
+from unified_diff import PatchError, iter_hunks, iter_unified_diff, format_hunk, patch_to_snippets, blanked_lines
+from fixed_response_code_snippet import save_snippets_to_json, SnippetStreamParser
+from llm_executor import LLMExecutor
+from session_store import (
+    ProjectSessions, ChatRegistry, ProjectLeases, open_session_backend, DEFAULT_LOCAL_CHATS, DEFAULT_LEASE_SECONDS
+)
+from resilience import ResiliencePolicy, LatencyTracker, ResilientChat, abandoned_attempts
+from instrumentation import metrics, span, get_logger, set_verbose, is_verbose
+from upload_store import BlobStore, UploadTooLarge, upload_limit
+from violation_clustering import dedupe_violations, format_violations_prompt, violation_stats, map_results
+from snippet_validator import SnippetValidator, merge_reports
+from report_diff import diff_violations, DIFF_STATUSES
+from resource_manager import ResourcePolicy, ResourceManager, remove_folder
+from report_index import discard_report_index
+
+logger = get_logger("api")
 
 app = FastAPI(
     title="MISRA Fix Copilot API",
@@ -33,9 +66,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global storage for sessions
-sessions = {}
-chat_sessions = {}
+# Multi-file batch projects and their background tasks; their progress is published
+# to the session store (namespace "batch") so any worker can report or cancel them
+batch_projects = {}
+batch_tasks = {}
+batch_published = {}
+BATCH_NAMESPACE = "batch"
+# Progress is published at most this often while files are running
+BATCH_PUBLISH_SECONDS = float(os.environ.get('BATCH_PUBLISH_SECONDS', '1'))
 
 # Default model settings
 default_model_settings = {
@@ -49,6 +87,29 @@ default_model_settings = {
 # Global model settings storage
 model_settings = default_model_settings.copy()
 
+# Blocking Gemini calls run on this pool, bounded globally and serialized per project
+LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', '8'))
+llm_executor = LLMExecutor(max_in_flight=LLM_MAX_IN_FLIGHT)
+
+# Long-running operations submitted as background jobs
+JOB_MAX_CONCURRENT = int(os.environ.get('JOB_MAX_CONCURRENT', '4'))
+job_scheduler = JobScheduler(max_concurrent=JOB_MAX_CONCURRENT)
+
+# Output size estimates, recalibrated from the token counts Gemini reports
+token_estimator = TokenEstimator()
+
+# Deadlines, retries, hedging and model fallback for every Gemini call (LLM_* env variables)
+resilience_policy = ResiliencePolicy.from_env()
+latency_tracker = LatencyTracker()
+
+def new_chat(settings: Dict[str, Any], history: list = None) -> ResilientChat:
+    return ResilientChat(
+        settings, history,
+        chat_factory=lambda settings, history: start_chat(**settings, history=history),
+        policy=resilience_policy,
+        tracker=latency_tracker
+    )
+
 # Configure upload settings
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'cpp', 'c', 'xlsx', 'xls'}
@@ -56,19 +117,241 @@ ALLOWED_EXTENSIONS = {'cpp', 'c', 'xlsx', 'xls'}
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Project sessions and chat histories live in a store shared by every worker
+# (SESSION_STORE=sqlite|memory); chats are rebuilt from their stored history
+session_backend = open_session_backend(UPLOAD_FOLDER)
+sessions = ProjectSessions(session_backend)
+chat_sessions = ChatRegistry(
+    session_backend,
+    factory=new_chat,
+    export=lambda chat: chat.export_history(),
+    max_local=int(os.environ.get('CHAT_CACHE_SIZE', DEFAULT_LOCAL_CHATS))
+)
+# Job state is published to the store, so a poll may land on any worker
+job_scheduler.store = session_backend
+# A project's LLM calls are serialized across workers, not only within this one
+llm_executor.leases = ProjectLeases(
+    session_backend, ttl=float(os.environ.get('PROJECT_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+)
+
+# Fixes already produced for identical code context, rule and model settings
+fix_cache = open_fix_cache(UPLOAD_FOLDER)
+
+# Line tables of the uploaded sources; fixes are applied and rendered in memory
+documents = DocumentCache(int(os.environ.get('DOCUMENT_CACHE_SIZE', DEFAULT_CACHED_DOCUMENTS)))
+
+# Per-project patch layer stacks, kept in sync with the 'patch_history' stored in the session
+patch_histories = {}
+
+# Queue depths, read when /metrics is scraped
+metrics.gauge("misra_llm_in_flight", lambda: llm_executor.stats()['inFlight'], "LLM calls running")
+metrics.gauge("misra_llm_queued", lambda: llm_executor.stats()['queued'], "LLM calls waiting for a slot")
+metrics.gauge("misra_llm_abandoned_attempts", lambda: abandoned_attempts.stats()['running'],
+              "Timed-out or losing LLM attempts still running")
+metrics.gauge("misra_job_queue_depth", lambda: job_scheduler.stats()['queueDepth'], "Jobs waiting to start")
+metrics.gauge("misra_jobs", lambda: job_scheduler.stats()['jobs'], "Jobs by state", label="state")
+metrics.gauge("misra_token_output_ratio", lambda: token_estimator.stats()['outputRatio'],
+              "Observed/estimated output token ratio")
+
+# Uploads are stored once per content hash; projects point at the shared blob
+blob_store = BlobStore(os.path.join(UPLOAD_FOLDER, 'blobs'))
+
+# Project TTL, memory/disk budgets and the background sweeper (PROJECT_TTL_SECONDS, *_BUDGET_BYTES, ...)
+resource_manager = ResourceManager(
+    ResourcePolicy.from_env(), sessions, chat_sessions, documents, patch_histories, blob_store, UPLOAD_FOLDER,
+    is_busy=llm_executor.is_busy,
+    references=lambda: batch_references(),
+    on_blob_removed=discard_report_index
+)
+
+def expire_batches(ttl: float) -> List[Dict[str, Any]]:
+    """Drop batch projects finished more than `ttl` seconds ago, with their folders"""
+    evicted = []
+    if ttl <= 0:
+        return evicted
+    now = time.monotonic()
+    for batch_id, batch in list(batch_projects.items()):
+        if batch.finished_at is None or now - batch.finished_at < ttl:
+            continue
+        freed = remove_folder(batch.folder)
+        batch_projects.pop(batch_id, None)
+        batch_tasks.pop(batch_id, None)
+        batch_published.pop(batch_id, None)
+        session_backend.delete(BATCH_NAMESPACE, batch_id)
+        evicted.append(resource_manager.record_eviction(batch_id, "ttl", freed, kind="batch"))
+    return evicted
+
+resource_manager.collectors.append(expire_batches)
+metrics.gauge("misra_resident_projects", lambda: len(sessions.local_items()), "Projects held in this process")
+metrics.gauge("misra_upload_bytes", lambda: resource_manager.disk_bytes, "Upload folder size at the last sweep")
+
+async def store_upload(file: UploadFile, kind: str) -> Dict[str, Any]:
+    """Stream an upload into the blob store, hashing it on the way; 413 above the `kind` size limit"""
+    try:
+        with span("upload", kind=kind):
+            return await blob_store.save(file, file.filename, upload_limit(kind))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_snippets(project_id: str, code_snippets: Dict[str, str], **fields):
+    """Save snippets (and any other session `fields`) to the project session and its snippet JSON file"""
+    if project_id not in sessions:
+        return None
+    snippet_file = os.path.join(UPLOAD_FOLDER, f"{project_id}_snippets.json")
+    save_snippets_to_json(code_snippets, snippet_file)
+    sessions[project_id].update(fixed_snippets=code_snippets, snippet_file=snippet_file, **fields)
+    return snippet_file
+
+def get_history(project_id: str) -> PatchHistory:
+    session = sessions[project_id]
+    stored = session.get('patch_history')
+    cached = patch_histories.get(project_id)
+    if stored is None:
+        # Snippets saved before the project had layers
+        history = PatchHistory.from_snippets(session.get('fixed_snippets') or {})
+    elif cached is not None and cached.revision == stored['revision']:
+        return cached
+    else:
+        history = PatchHistory.from_dict(stored)
+    patch_histories[project_id] = history
+    return history
+
+def save_history(project_id: str, history: PatchHistory, changes: Dict[str, Optional[str]]):
+    """Persist a history change and patch only the changed keys of the cached document"""
+    patch_histories[project_id] = history
+    document = documents.peek(project_id)
+    if document is not None and document.revision == history.revision - 1:
+        # Every history change bumps the revision by one
+        with span("merge"):
+            document.update(changes)
+        document.revision = history.revision
+    return store_snippets(project_id, history.effective(), patch_history=history.to_dict())
+
+def record_layer(project_id: str, source: str, snippets: Dict[str, str], layer_id: Optional[int] = None):
+    """Push the snippets of one LLM exchange as a new layer, or refresh layer `layer_id`"""
+    if project_id not in sessions or (layer_id is None and not snippets):
+        return layer_id
+    history = get_history(project_id)
+    if layer_id is None:
+        layer, changes = history.push(source, snippets)
+        layer_id = layer['id']
+    else:
+        changes = history.replace_snippets(layer_id, snippets)
+    save_history(project_id, history, changes)
+    return layer_id
+
+def load_model_settings() -> Dict[str, Any]:
+    """Pick up settings saved by any worker"""
+    global model_settings
+    record = session_backend.get("settings", "model")
+    if record is not None:
+        model_settings = record[0]
+    return model_settings
+
+# Build the model objects of the current settings in the background (MODEL_PREWARM=0 to skip)
+MODEL_PREWARM = os.environ.get('MODEL_PREWARM', '1') != '0'
+
+def model_profiles(settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The settings profile and its fallback models, as the resilient chat will use them"""
+    names = [settings['model_name']] + [name for name in resilience_policy.fallback_models if name != settings['model_name']]
+    return [dict(settings, model_name=name) for name in names]
+
+def warm_models(settings: Dict[str, Any]):
+    try:
+        with span("model_prewarm"):
+            prewarm_models(model_profiles(settings))
+    except Exception as e:
+        logger.warning("Model prewarm failed: %s", e)
+
+def run_with_history(project_id: str, fn, *args, **kwargs):
+    """Run a chat call and store the chat's new history before the project is released"""
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        chat_sessions.persist(project_id)
+
+def stream_with_history(project_id: str, fn, *args, **kwargs):
+    """Generator form of run_with_history: the history is stored when the stream ends, still under the project lock"""
+    try:
+        yield from fn(*args, **kwargs)
+    finally:
+        chat_sessions.persist(project_id)
+
+def get_document(project_id: str) -> NumberedDocument:
+    """The project's line table with its snippets applied, rebuilt from the upload on a cache miss"""
+    history = get_history(project_id)
+    def load():
+        return NumberedDocument.from_file(sessions[project_id]['cpp_file'])
+    document = documents.get(project_id, load)
+    if document.revision != history.revision:
+        # New, or changed by another worker: lay the whole effective overlay once
+        with span("merge"):
+            document.set_overlay(history.effective())
+        document.revision = history.revision
+    return document
+
+def write_text(path: str, text: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def record_token_usage(project_id: str, usage: Optional[Dict[str, int]]):
+    """Add one call's token counts to the project's running totals"""
+    if not usage or project_id not in sessions:
+        return
+    sessions[project_id]['token_usage'] = add_usage(sessions[project_id].get('token_usage'), usage)
+
+def output_token_limit(request) -> int:
+    return request.maxOutputTokens or load_model_settings()['max_tokens']
+
+def check_context_mode(context_mode: str):
+    if context_mode not in CONTEXT_MODES:
+        raise HTTPException(status_code=400, detail=f"contextMode must be one of {', '.join(CONTEXT_MODES)}")
+
+def violation_line_numbers(violations: List[Dict[str, Any]]) -> List[int]:
+    return [line for line in (violation_line(v) for v in violations) if line is not None]
+
+def continuation_limits(request) -> Dict[str, int]:
+    """Turn and token limits for the automatic "--- CONTINUED ---" loop"""
+    return {
+        'max_turns': (request.maxTurns or DEFAULT_MAX_TURNS) if request.autoContinue else 1,
+        'token_budget': request.tokenBudget or DEFAULT_TOKEN_BUDGET
+    }
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # Pydantic models for request/response validation
 class LineNumbersRequest(BaseModel):
     projectId: str
 
 class FirstPromptRequest(BaseModel):
     projectId: str
+    contextMode: str = "full"
+    violations: Optional[List[Dict[str, Any]]] = None
 
 class FixViolationsRequest(BaseModel):
     projectId: str
     violations: List[Dict[str, Any]] = []
+    autoContinue: bool = True
+    maxTurns: Optional[int] = None
+    tokenBudget: Optional[int] = None
+    fanOut: bool = False
+    fanOutMode: str = "rule"
+    fanOutWidth: Optional[int] = None
+    fanOutGroups: Optional[int] = None
+    contextMode: str = "full"
+    useCache: bool = True
+    adaptiveBatching: bool = True
+    maxOutputTokens: Optional[int] = None
+    validateSnippets: bool = True
+
+class TokenPlanRequest(BaseModel):
+    projectId: str
+    violations: List[Dict[str, Any]] = []
+    maxOutputTokens: Optional[int] = None
 
 class ApplyFixesRequest(BaseModel):
     projectId: str
@@ -76,6 +359,9 @@ class ApplyFixesRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     projectId: str
+    autoContinue: bool = True
+    maxTurns: Optional[int] = None
+    tokenBudget: Optional[int] = None
 
 class ModelSettings(BaseModel):
     model_name: str
@@ -87,37 +373,89 @@ class ModelSettings(BaseModel):
 class UploadResponse(BaseModel):
     filePath: str
     fileName: str
+    contentHash: Optional[str] = None
+    size: Optional[int] = None
+    deduplicated: bool = False
 
 class ProcessResponse(BaseModel):
     numberedFilePath: str
 
 class GeminiResponse(BaseModel):
     response: str
+    contextLines: Optional[int] = None
+    totalLines: Optional[int] = None
 
 class FixViolationsResponse(BaseModel):
     response: str
     codeSnippets: List[Dict[str, Any]]
+    turns: int = 1
+    complete: bool = True
+    stopReason: Optional[str] = None
+    groups: Optional[List[Dict[str, Any]]] = None
+    conflicts: Optional[List[Dict[str, Any]]] = None
+    cacheStats: Optional[Dict[str, Any]] = None
+    layerId: Optional[int] = None
+    batches: Optional[List[Dict[str, Any]]] = None
+    tokenUsage: Optional[Dict[str, Any]] = None
+    violationStats: Optional[Dict[str, Any]] = None
+    violationResults: Optional[List[Dict[str, Any]]] = None
+    validation: Optional[Dict[str, Any]] = None
 
 class ApplyFixesResponse(BaseModel):
     fixedFilePath: str
 
 class ChatResponse(BaseModel):
     response: str
+    turns: int = 1
+    complete: bool = True
+    stopReason: Optional[str] = None
+    layerId: Optional[int] = None
 
 class SettingsResponse(BaseModel):
     success: bool
     message: str
 
-# Initialize Vertex AI on startup
+class PatchLayerRequest(BaseModel):
+    projectId: str
+    layerId: int
+    accepted: bool
+
+class ProjectRequest(BaseModel):
+    projectId: str
+
+class PinRequest(BaseModel):
+    projectId: str
+    pinned: bool = True
+
+class ApplyPatchRequest(BaseModel):
+    projectId: str
+    patch: str
+    replaceLayers: bool = True
+
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+    priority: int = 0
+
+# The LLM provider is set up in the background, so the server answers as soon as it starts
 @app.on_event("startup")
 async def startup_event():
-    init_vertex_ai()
+    if MODEL_PREWARM:
+        asyncio.get_running_loop().run_in_executor(None, warm_models, load_model_settings())
+    job_scheduler.start()
+    resource_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await resource_manager.stop()
+    await job_scheduler.shutdown()
+    llm_executor.shutdown()
 
 # Settings endpoints
 @app.get("/api/settings", response_model=ModelSettings)
 async def get_settings():
     """Get current model settings"""
-    return ModelSettings(**model_settings)
+    return ModelSettings(**load_model_settings())
 
 @app.post("/api/settings", response_model=SettingsResponse)
 async def save_settings(settings: ModelSettings):
@@ -130,6 +468,9 @@ async def save_settings(settings: ModelSettings):
         settings_file = os.path.join(UPLOAD_FOLDER, 'model_settings.json')
         with open(settings_file, 'w') as f:
             json.dump(model_settings, f, indent=2)
+        session_backend.put("settings", "model", model_settings)
+        if MODEL_PREWARM:
+            asyncio.get_running_loop().run_in_executor(None, warm_models, dict(model_settings))
         
         return SettingsResponse(
             success=True,
@@ -150,25 +491,27 @@ async def upload_cpp_file(
         if not allowed_file(file.filename):
             raise HTTPException(status_code=400, detail="Invalid file type")
         
-        # Save uploaded file
+        # Save uploaded file (identical sources share one blob)
         filename = file.filename
-        file_path = os.path.join(UPLOAD_FOLDER, f"{projectId}_{filename}")
-        
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        stored = await store_upload(file, 'source')
         
         # Initialize session
         sessions[projectId] = {
-            'cpp_file': file_path,
+            'cpp_file': stored['path'],
+            'cpp_hash': stored['hash'],
             'original_filename': filename
         }
         
         return UploadResponse(
-            filePath=file_path,
-            fileName=filename
+            filePath=stored['path'],
+            fileName=filename,
+            contentHash=stored['hash'],
+            size=stored['size'],
+            deduplicated=stored['deduplicated']
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -176,30 +519,75 @@ async def upload_cpp_file(
 async def upload_misra_report(
     file: UploadFile = File(...),
     projectId: str = Form(...),
-    targetFile: str = Form(...)
+    targetFile: str = Form(...),
+    incremental: bool = Form(False)
 ):
+    """
+    Store the report and return the file's violations. With `incremental`, the
+    report is taken to be a re-run on the fixed file: it is diffed against the
+    previous report and only new and persisting violations are returned and queued.
+    """
     try:
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file selected")
         
-        # Save Excel file
-        filename = file.filename
-        excel_path = os.path.join(UPLOAD_FOLDER, f"{projectId}_report_{filename}")
+        # Save report file (xlsx, csv, json or jsonl); the same report is stored once for all projects
+        stored = await store_upload(file, 'report')
+        excel_path = stored['path']
         
-        with open(excel_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Extract violations (the parsed report is cached by the hash computed while uploading)
+        violations = await asyncio.to_thread(extract_violations_for_file, excel_path, targetFile, stored['hash'])
         
-        # Extract violations
-        violations = extract_violations_for_file(excel_path, targetFile)
+        session = sessions[projectId] if projectId in sessions else None
+        if incremental and session is not None and session.get('violations') is not None and 'cpp_file' in session:
+            # Old lines are in the document's numbering, new ones in the fixed file's
+            previous = session.get('report_violations') or session['violations']
+            document = await asyncio.to_thread(get_document, projectId)
+            diff = await asyncio.to_thread(diff_violations, previous, violations, document)
+            session.update(
+                excel_file=excel_path, excel_hash=stored['hash'],
+                violations=diff['queue'],
+                report_violations=diff['current'],
+                report_diff={
+                    'reportHash': stored['hash'],
+                    'previousReportHash': session.get('excel_hash'),
+                    'counts': diff['counts'],
+                    **{status: diff[status] for status in DIFF_STATUSES}
+                }
+            )
+            return diff['queue']
         
         # Store in session
-        if projectId in sessions:
-            sessions[projectId]['excel_file'] = excel_path
-            sessions[projectId]['violations'] = violations
+        if session is not None:
+            session.update(excel_file=excel_path, excel_hash=stored['hash'], violations=violations,
+                           report_violations=None, report_diff=None)
         
         return violations
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/report/diff")
+async def get_report_diff(projectId: str = Query(...)):
+    """Resolved, persisting, new and moved violations of the last incremental report upload"""
+    if projectId not in sessions or not sessions[projectId].get('report_diff'):
+        raise HTTPException(status_code=404, detail="No incremental report for this project")
+    return sessions[projectId]['report_diff']
+
+@app.get("/api/report/files")
+async def get_report_files(projectId: str = Query(...)):
+    """Files covered by the project's MISRA report, with violation counts"""
+    try:
+        if projectId not in sessions or 'excel_file' not in sessions[projectId]:
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        session = sessions[projectId]
+        return await asyncio.to_thread(list_report_files, session['excel_file'], session.get('excel_hash'))
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -219,7 +607,11 @@ async def process_add_line_numbers(request: LineNumbersRequest):
         numbered_filename = f"numbered_{original_name}.txt"
         numbered_path = os.path.join(UPLOAD_FOLDER, f"{project_id}_{numbered_filename}")
         
-        add_line_numbers(input_file, numbered_path)
+        # Parse the upload once; the numbered file is only the prompt input
+        with span("numbering"):
+            document = await asyncio.to_thread(NumberedDocument.from_file, input_file)
+            await asyncio.to_thread(write_text, numbered_path, document.render_numbered())
+        documents.put(project_id, document)
         
         # Update session
         sessions[project_id]['numbered_file'] = numbered_path
@@ -237,23 +629,32 @@ async def gemini_first_prompt(request: FirstPromptRequest):
         if project_id not in sessions:
             raise HTTPException(status_code=404, detail="Project not found")
         
+        check_context_mode(request.contextMode)
+        
         session = sessions[project_id]
         numbered_file = session['numbered_file']
         
         # Load numbered file content
         numbered_content = load_cpp_file(numbered_file)
+        total_lines = len(numbered_content.splitlines())
+        
+        # In "scopes" mode only the global declarations and the scopes holding violations are sent
+        partial = request.contextMode == "scopes"
+        if partial:
+            violations = request.violations if request.violations is not None else session.get('violations')
+            if not violations:
+                raise HTTPException(status_code=400, detail="contextMode 'scopes' needs the violations to fix")
+            scope_index = ScopeIndex.from_numbered_text(numbered_content)
+            numbered_content = scope_index.slice_for_lines(violation_line_numbers(violations))
         
         # Start chat session with current model settings
-        chat = start_chat(
-            model_name=model_settings['model_name'],
-            temperature=model_settings['temperature'],
-            top_p=model_settings['top_p'],
-            max_tokens=model_settings['max_tokens'],
-            safety_settings=model_settings['safety_settings']
-        )
+        settings = dict(load_model_settings())
+        chat = new_chat(settings)
         
         # Send first prompt
-        response = send_file_intro(chat, numbered_content)
+        metered = MeteredChat(chat)
+        response = await llm_executor.run(project_id, send_file_intro, metered, numbered_content, partial)
+        record_token_usage(project_id, metered.usage)
         
         # Check if response is None (blocked by safety filters)
         if response is None:
@@ -262,85 +663,196 @@ async def gemini_first_prompt(request: FirstPromptRequest):
                 detail="Response was blocked by safety filters. Please try with different content or contact support."
             )
         
-        # Store chat session
-        chat_sessions[project_id] = chat
+        # Store chat session (and its history, so any worker can resume it)
+        chat_sessions.put(project_id, chat, settings)
+        sessions[project_id]['context_mode'] = request.contextMode
         
-        return GeminiResponse(response=response)
+        return GeminiResponse(
+            response=response,
+            contextLines=len(numbered_content.splitlines()),
+            totalLines=total_lines
+        )
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-import logging
-import traceback
+async def fan_out_fix_violations(project_id: str, request: FixViolationsRequest,
+                                  violations: List[Dict[str, Any]], on_batch=None,
+                                  validator: Optional[SnippetValidator] = None) -> Dict[str, Any]:
+    """
+    Partition the violations and fix each group on its own chat session,
+    at most `fanOutWidth` groups at a time, then merge the snippet dicts.
+    """
+    numbered_content = load_cpp_file(sessions[project_id]['numbered_file'])
+    scope_index = ScopeIndex.from_numbered_text(numbered_content) if request.contextMode == "scopes" else None
+    groups = partition_violations(
+        violations,
+        mode=request.fanOutMode,
+        max_groups=request.fanOutGroups or DEFAULT_FANOUT_GROUPS
+    )
+    width = asyncio.Semaphore(request.fanOutWidth or DEFAULT_FANOUT_WIDTH)
+    settings = dict(load_model_settings())
+    limits = continuation_limits(request)
+    limits['on_batch'] = on_batch
+    limits['make_chat'] = new_chat
+    limits['validator'] = validator
+    
+    async def run_group(index: int, group: List[Dict[str, Any]]):
+        # Each group only needs the scopes of its own violations
+        content = numbered_content
+        if scope_index is not None:
+            content = scope_index.slice_for_lines(violation_line_numbers(group))
+        async with width:
+            return await llm_executor.run(
+                f"{project_id}#fanout{index}", fix_violation_group,
+                settings, content, format_violations_prompt(group),
+                partial=scope_index is not None, violation_lines=violation_line_numbers(group), **limits
+            )
+    
+    # Groups run under sub-keys; the project itself stays busy until the last one ends
+    with llm_executor.hold(project_id):
+        results = await asyncio.gather(*(run_group(i, g) for i, g in enumerate(groups)))
+    snippets, conflicts = merge_group_snippets(groups, [r['snippets'] for r in results])
+    
+    incomplete = [r['stopReason'] for r in results if not r['complete']]
+    return {
+        'responses': [text for r in results for text in r['responses']],
+        'snippets': snippets,
+        'turns': sum(r['turns'] for r in results),
+        'complete': not incomplete,
+        'stopReason': incomplete[0] if incomplete else "complete",
+        'groups': [
+            {
+                'index': i,
+                'violations': len(group),
+                'turns': r['turns'],
+                'snippets': len(r['snippets']),
+                'stopReason': r['stopReason']
+            }
+            for i, (group, r) in enumerate(zip(groups, results))
+        ],
+        'conflicts': conflicts,
+        'usage': sum_usage(r.get('usage') for r in results),
+        'validation': merge_reports(r.get('validation') for r in results) if validator is not None else None
+    }
+
+def sum_usage(usages) -> Dict[str, int]:
+    total = {}
+    for usage in usages:
+        total = add_usage(total, usage)
+    return total
 
 @app.post("/api/gemini/fix-violations", response_model=FixViolationsResponse)
 async def gemini_fix_violations(request: FixViolationsRequest):
+    return await run_fix_violations(request)
+
+async def run_fix_violations(request: FixViolationsRequest, on_batch=None) -> FixViolationsResponse:
+    """
+    Body of /api/gemini/fix-violations, shared with background jobs.
+    `on_batch(turn, snippets)` is called after every Gemini batch.
+    """
     try:
         project_id = request.projectId
-        violations = request.violations
         
-        print(f"Processing project_id: {project_id}")  # Debug
-        print(f"Number of violations: {len(violations)}")  # Debug
+        # Reports often list one violation several times; each is fixed (and cached) once
+        violations, positions = dedupe_violations(request.violations)
+        stats = violation_stats(request.violations, violations)
         
-        if project_id not in chat_sessions:
+        logger.debug("Processing project_id: %s", project_id)
+        logger.debug("Violations: %s", stats)
+        
+        if request.fanOut:
+            if project_id not in sessions or 'numbered_file' not in sessions[project_id]:
+                raise HTTPException(status_code=404, detail="Project not found")
+            check_context_mode(request.contextMode)
+            if request.fanOutMode not in FANOUT_MODES:
+                raise HTTPException(status_code=400, detail=f"fanOutMode must be one of {', '.join(FANOUT_MODES)}")
+        elif project_id not in chat_sessions:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
-        chat = chat_sessions[project_id]
-        
-        # Format violations for Gemini
-        violations_text = []
-        for v in violations:
-            violations_text.append(
-                f"File: {v['file']}\n"
-                f"Path: {v['path']}\n"
-                f"Line: {v['line']}\n"
-                f"Rule: {v['misra']}\n"
-                f"Message: {v['warning']}\n"
+        # Serve violations whose code context, rule and settings were fixed before from the cache
+        cache_plan = None
+        numbered_file = sessions.get(project_id, {}).get('numbered_file')
+        numbered_content = load_cpp_file(numbered_file) if numbered_file else ""
+        if request.useCache and numbered_file and violations:
+            cache_plan = await asyncio.to_thread(
+                plan_cached_fixes, fix_cache, numbered_content, violations, dict(load_model_settings())
             )
+            violations = cache_plan['misses']
+            logger.debug("Fix cache: %s", cache_plan['stats'])
         
-        violations_str = "\n".join(violations_text)
-        print(f"Formatted violations length: {len(violations_str)}")  # Debug
+        # Model snippets are checked against the document's line keys before they are merged
+        validator = None
+        if request.validateSnippets and 'cpp_file' in sessions.get(project_id, {}):
+            document = await asyncio.to_thread(get_document, project_id)
+            validator = SnippetValidator(len(document), document)
         
-        # Send to Gemini
-        print("Sending to Gemini...")  # Debug
-        response = send_misra_violations(chat, violations_str)
-        print(f"Gemini response received: {response is not None}")  # Debug
+        if not violations and cache_plan is not None:
+            result = {'responses': [], 'snippets': {}, 'turns': 0, 'complete': True, 'stopReason': "cached"}
+        elif request.fanOut:
+            # Independent groups on their own chat sessions, run in parallel
+            logger.debug("Fanning out to parallel Gemini sessions...")
+            result = await fan_out_fix_violations(project_id, request, violations, on_batch=on_batch, validator=validator)
+        else:
+            chat = chat_sessions[project_id]
+            
+            # Split the violations into batches whose answers fit the output limit
+            limit = output_token_limit(request) if request.adaptiveBatching else None
+            batches = plan_violation_batches(token_estimator, numbered_content, violations, limit)
+            logger.debug("Planned %d batches for %d violations", len(batches), len(violations))
+            
+            # Send to Gemini, answering "--- CONTINUED ---" with "next" until all batches are in
+            result = await llm_executor.run(
+                project_id, run_with_history, project_id,
+                send_batched, chat, token_estimator, batches,
+                on_batch=on_batch, validator=validator, **continuation_limits(request)
+            )
+        record_token_usage(project_id, result.get('usage'))
+        logger.debug("Gemini responses received: %d (%s)", result['turns'], result['stopReason'])
         
         # Check if response is None (blocked by safety filters)
-        if response is None:
+        if not result['responses'] and result['stopReason'] != "cached":
             raise HTTPException(
                 status_code=422, 
                 detail="Response was blocked by safety filters. Please try with different content or contact support."
             )
         
-        # Extract code snippets
-        print("Extracting snippets...")  # Debug
-        code_snippets = extract_snippets_from_response(response)
-        print(f"Extracted {len(code_snippets)} snippets")  # Debug
+        response = "\n\n".join(result['responses'])
+        
+        # Snippets of every batch, merged, on top of the cached fixes
+        code_snippets = result['snippets']
+        if cache_plan is not None:
+            await asyncio.to_thread(store_fixes, fix_cache, cache_plan, code_snippets)
+            code_snippets = merge_snippets(cache_plan['snippets'], code_snippets)
+        logger.debug("Extracted %d snippets", len(code_snippets))
         
-        # Save snippets to session
-        if project_id in sessions:
-            print("Saving snippets to session...")  # Debug
-            sessions[project_id]['fixed_snippets'] = code_snippets
-            snippet_file = os.path.join(UPLOAD_FOLDER, f"{project_id}_snippets.json")
-            save_snippets_to_json(code_snippets, snippet_file)
-            sessions[project_id]['snippet_file'] = snippet_file
-            print(f"Snippets saved to: {snippet_file}")  # Debug
+        # Save snippets to session as a new patch layer
+        layer_id = record_layer(project_id, "fix-violations", code_snippets)
+        logger.debug("Snippets saved as layer: %s", layer_id)
         
         return FixViolationsResponse(
             response=response,
-            codeSnippets=[{"code": snippet} for snippet in code_snippets.values()]
+            codeSnippets=[{"code": snippet} for snippet in code_snippets.values()],
+            turns=result['turns'],
+            complete=result['complete'],
+            stopReason=result['stopReason'],
+            groups=result.get('groups'),
+            conflicts=result.get('conflicts'),
+            cacheStats=cache_plan['stats'] if cache_plan is not None else None,
+            layerId=layer_id,
+            batches=result.get('batches'),
+            tokenUsage=result.get('usage'),
+            violationStats=stats,
+            violationResults=map_results(request.violations, positions, code_snippets),
+            validation=result.get('validation')
         )
         
-    except HTTPException:
+    except (HTTPException, JobCancelled):
         raise
     except Exception as e:
-        # Add detailed error logging
-        print(f"Error in gemini_fix_violations: {str(e)}")
-        print(f"Error type: {type(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Error in gemini_fix_violations: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
 @app.post("/api/process/apply-fixes", response_model=ApplyFixesResponse)
@@ -352,18 +864,12 @@ async def process_apply_fixes(request: ApplyFixesRequest):
             raise HTTPException(status_code=404, detail="Project not found")
         
         session = sessions[project_id]
-        numbered_file = session['numbered_file']
-        fixed_snippets = session.get('fixed_snippets', {})
-        
-        # Apply fixes
-        fixed_filename = f"fixed_{session['original_filename']}"
-        fixed_numbered_path = os.path.join(UPLOAD_FOLDER, f"{project_id}_fixed_numbered_{session['original_filename']}")
         
-        merge_fixed_snippets_into_file(numbered_file, fixed_snippets, fixed_numbered_path)
+        # The in-memory document already carries the accepted patch layers; the file is written on download
+        await asyncio.to_thread(get_document, project_id)
         
-        # Remove line numbers for final file
+        fixed_filename = f"fixed_{session['original_filename']}"
         final_fixed_path = os.path.join(UPLOAD_FOLDER, f"{project_id}_{fixed_filename}")
-        remove_line_numbers(fixed_numbered_path, final_fixed_path)
         
         # Update session
         sessions[project_id]['fixed_file'] = final_fixed_path
@@ -382,9 +888,13 @@ async def download_fixed_file(projectId: str = Query(...)):
         session = sessions[projectId]
         fixed_file = session.get('fixed_file')
         
-        if not fixed_file or not os.path.exists(fixed_file):
+        if not fixed_file:
             raise HTTPException(status_code=404, detail="Fixed file not found")
         
+        document = await asyncio.to_thread(get_document, projectId)
+        with span("denumbering"):
+            await asyncio.to_thread(write_text, fixed_file, document.render_clean())
+        
         return FileResponse(
             path=fixed_file,
             filename=f"fixed_{session['original_filename']}",
@@ -405,31 +915,557 @@ async def chat(request: ChatRequest):
         
         chat_session = chat_sessions[project_id]
         
-        # Send message to Gemini
-        response = chat_session.send_message(message)
+        # Send message to Gemini, continuing automatically if it stops at "--- CONTINUED ---"
+        metered = MeteredChat(chat_session)
+        result = await llm_executor.run(
+            project_id, run_with_history, project_id,
+            send_with_continuations, metered, send_chat_message, message,
+            **continuation_limits(request)
+        )
+        record_token_usage(project_id, metered.usage)
         
         # Check if response is None or blocked
-        if response is None or response.text is None:
+        if not result['responses']:
             raise HTTPException(
                 status_code=422, 
                 detail="Response was blocked by safety filters. Please try rephrasing your message."
             )
         
-        # Extract code snippets from response and save to session
-        if project_id in sessions:
-            print("Extracting snippets from chat response...")  # Debug
-            code_snippets = extract_snippets_from_response(response.text)
-            print(f"Extracted {len(code_snippets)} snippets from chat")  # Debug
-            
-            # Save snippets to session (same as fix-violations endpoint)
-            sessions[project_id]['fixed_snippets'] = code_snippets
-            snippet_file = os.path.join(UPLOAD_FOLDER, f"{project_id}_snippets.json")
-            save_snippets_to_json(code_snippets, snippet_file)
-            sessions[project_id]['snippet_file'] = snippet_file
-            print(f"Chat snippets saved to: {snippet_file}")  # Debug
+        # Code snippets from the response go on top of the earlier ones as a new layer
+        code_snippets = result['snippets']
+        logger.debug("Extracted %d snippets from chat", len(code_snippets))
+        layer_id = record_layer(project_id, "chat", code_snippets)
+        logger.debug("Chat snippets saved as layer: %s", layer_id)
+        
+        return ChatResponse(
+            response="\n\n".join(result['responses']),
+            turns=result['turns'],
+            complete=result['complete'],
+            stopReason=result['stopReason'],
+            layerId=layer_id
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def stream_snippet_events(project_id: str, source: str, metered: MeteredChat, stream_fn, *args, **kwargs):
+    """
+    Forward Gemini tokens as server-sent events, emitting each completed
+    numbered snippet line as soon as it arrives and saving the snippets
+    every time a code block closes, as one patch layer for the whole exchange.
+    """
+    layer_id = None
+    parser = SnippetStreamParser()
+    blocks_saved = 0
+    chunks = []
+    try:
+        async for chunk in llm_executor.stream(project_id, stream_with_history, project_id, stream_fn, *args, **kwargs):
+            chunks.append(chunk)
+            yield sse_event("token", {"text": chunk})
+            for lineno, code in parser.feed(chunk):
+                yield sse_event("snippet", {"line": lineno, "code": code})
+            if parser.blocks_closed > blocks_saved:
+                blocks_saved = parser.blocks_closed
+                layer_id = record_layer(project_id, source, parser.snippets, layer_id)
+        for lineno, code in parser.close():
+            yield sse_event("snippet", {"line": lineno, "code": code})
+        layer_id = record_layer(project_id, source, parser.snippets, layer_id)
+        yield sse_event("done", {
+            "response": "".join(chunks),
+            "snippetCount": len(parser.snippets),
+            "layerId": layer_id
+        })
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        record_token_usage(project_id, metered.usage)
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/gemini/fix-violations/stream")
+async def gemini_fix_violations_stream(request: FixViolationsRequest):
+    """Streaming variant of /api/gemini/fix-violations (server-sent events)"""
+    project_id = request.projectId
+    
+    if project_id not in chat_sessions:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    chat = MeteredChat(chat_sessions[project_id])
+    violations_str = format_violations_prompt(request.violations)
+    
+    first_stream = stream_misra_violations(chat, violations_str)
+    
+    return sse_response(stream_snippet_events(
+        project_id, "fix-violations", chat, stream_with_continuations, chat, first_stream, **continuation_limits(request)
+    ))
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming variant of /api/chat (server-sent events)"""
+    project_id = request.projectId
+    
+    if project_id not in chat_sessions:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    chat_session = MeteredChat(chat_sessions[project_id])
+    first_stream = stream_message(chat_session, request.message)
+    
+    return sse_response(stream_snippet_events(
+        project_id, "chat", chat_session, stream_with_continuations, chat_session, first_stream, **continuation_limits(request)
+    ))
+
+@app.post("/api/batch/projects")
+async def create_batch_project(
+    archive: UploadFile = File(...),
+    report: UploadFile = File(...),
+    workers: int = Form(DEFAULT_BATCH_WORKERS),
+    contextMode: str = Form("full")
+):
+    """Upload a source archive and one report, then process every file in the background"""
+    try:
+        if not archive.filename or not report.filename:
+            raise HTTPException(status_code=400, detail="No file selected")
+        check_context_mode(contextMode)
+        
+        stored_archive = await store_upload(archive, 'archive')
+        stored_report = await store_upload(report, 'report')
         
-        return ChatResponse(response=response.text)
+        batch_id = uuid.uuid4().hex
+        folder = os.path.join(UPLOAD_FOLDER, f"batch_{batch_id}")
+        os.makedirs(folder)
+        try:
+            batch = BatchProject(
+                batch_id, folder, stored_archive['path'], stored_report['path'],
+                report_hash=stored_report['hash'],
+                settings=load_model_settings(),
+                workers=workers,
+                context_mode=contextMode,
+                limits={'max_turns': DEFAULT_MAX_TURNS, 'token_budget': DEFAULT_TOKEN_BUDGET, 'make_chat': new_chat}
+            )
+            await asyncio.to_thread(batch.prepare)
+        except BaseException as e:
+            # Not registered yet, so neither expire_batches nor the sweeper would ever remove it
+            remove_folder(folder)
+            if isinstance(e, ValueError):
+                raise HTTPException(status_code=400, detail=str(e))
+            raise
         
+        batch_projects[batch_id] = batch
+        session_backend.put(BATCH_NAMESPACE, batch_id, batch_state(batch))
+        batch.on_change = publish_batch
+        batch_tasks[batch_id] = asyncio.create_task(batch.run(llm_executor))
+        
+        return batch.progress()
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def batch_state(batch: BatchProject) -> Dict[str, Any]:
+    return dict(batch.progress(), outputArchive=batch.output_archive,
+                archivePath=batch.archive_path, reportPath=batch.report_path)
+
+def batch_references() -> List[str]:
+    """Upload blobs used by the batches of every worker"""
+    paths = []
+    for batch_id in session_backend.keys(BATCH_NAMESPACE):
+        record = session_backend.get(BATCH_NAMESPACE, batch_id)
+        if record is not None:
+            paths += [record[0].get('archivePath'), record[0].get('reportPath')]
+    return paths
+
+def publish_batch(batch: BatchProject, final: bool = False):
+    """Store the batch's progress and pick up a cancel requested through another worker"""
+    now = time.monotonic()
+    if not final and now - batch_published.get(batch.batch_id, 0.0) < BATCH_PUBLISH_SECONDS:
+        return
+    batch_published[batch.batch_id] = now
+    merged = session_backend.merge(BATCH_NAMESPACE, batch.batch_id, batch_state(batch))
+    if not final and merged is not None and merged[0].get('cancelRequested'):
+        task = batch_tasks.get(batch.batch_id)
+        if task is not None and not task.done():
+            task.cancel()
+
+def stored_batch(batch_id: str) -> Dict[str, Any]:
+    """The batch's state on this worker, or as last published by the worker running it"""
+    if batch_id in batch_projects:
+        return batch_state(batch_projects[batch_id])
+    record = session_backend.get(BATCH_NAMESPACE, batch_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return record[0]
+
+@app.get("/api/batch/status")
+async def get_batch_status(batchId: str = Query(...)):
+    """Aggregate progress and throughput of a batch project"""
+    state = stored_batch(batchId)
+    for key in ('outputArchive', 'archivePath', 'reportPath', 'cancelRequested'):
+        state.pop(key, None)
+    return state
+
+@app.post("/api/batch/cancel")
+async def cancel_batch(batchId: str = Query(...)):
+    """Cancel a batch; one running on another worker stops when its next file starts or ends"""
+    if batchId in batch_projects:
+        task = batch_tasks.get(batchId)
+        if task is not None and not task.done():
+            task.cancel()
+        return {"success": True}
+    stored_batch(batchId)
+    session_backend.merge(BATCH_NAMESPACE, batchId, {'cancelRequested': True})
+    return {"success": True}
+
+@app.get("/api/batch/download")
+async def download_batch(batchId: str = Query(...)):
+    """Single zip archive with every fixed file of the batch"""
+    output_archive = stored_batch(batchId).get('outputArchive')
+    if not output_archive or not os.path.exists(output_archive):
+        raise HTTPException(status_code=409, detail="Batch is not finished yet")
+    
+    return FileResponse(
+        path=output_archive,
+        filename=f"fixed_{batchId}.zip",
+        media_type='application/zip'
+    )
+
+# Background jobs: every /api/process/* and /api/gemini/* step, plus the whole workflow
+def job_progress(job):
+    """on_batch callback that publishes partial snippets and stops cancelled jobs between turns"""
+    def on_batch(turn: int, snippets: Dict[str, str]):
+        job.check_cancelled()
+        job.add_partial(snippets)
+    return on_batch
+
+async def run_add_line_numbers_job(job):
+    with job.stage("add-line-numbers"):
+        return (await process_add_line_numbers(LineNumbersRequest(**job.params))).dict()
+
+async def run_first_prompt_job(job):
+    with job.stage("first-prompt"):
+        return (await gemini_first_prompt(FirstPromptRequest(**job.params))).dict()
+
+async def run_fix_violations_job(job):
+    with job.stage("fix-violations"):
+        return (await run_fix_violations(FixViolationsRequest(**job.params), on_batch=job_progress(job))).dict()
+
+async def run_apply_fixes_job(job):
+    with job.stage("apply-fixes"):
+        return (await process_apply_fixes(ApplyFixesRequest(**job.params))).dict()
+
+async def run_workflow_job(job):
+    """add-line-numbers -> first-prompt -> fix-violations -> apply-fixes for one project"""
+    request = FixViolationsRequest(**job.params)
+    project_id = request.projectId
+    if project_id not in sessions:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not request.violations:
+        request.violations = sessions[project_id].get('violations', [])
+    
+    result = {}
+    with job.stage("add-line-numbers"):
+        result['addLineNumbers'] = (await process_add_line_numbers(LineNumbersRequest(projectId=project_id))).dict()
+    job.check_cancelled()
+    if not request.fanOut:
+        with job.stage("first-prompt"):
+            result['firstPrompt'] = (await gemini_first_prompt(FirstPromptRequest(
+                projectId=project_id,
+                contextMode=request.contextMode,
+                violations=request.violations
+            ))).dict()
+        job.check_cancelled()
+    with job.stage("fix-violations"):
+        result['fixViolations'] = (await run_fix_violations(request, on_batch=job_progress(job))).dict()
+    job.check_cancelled()
+    with job.stage("apply-fixes"):
+        result['applyFixes'] = (await process_apply_fixes(ApplyFixesRequest(projectId=project_id))).dict()
+    return result
+
+JOB_HANDLERS = {
+    'add-line-numbers': (LineNumbersRequest, run_add_line_numbers_job),
+    'first-prompt': (FirstPromptRequest, run_first_prompt_job),
+    'fix-violations': (FixViolationsRequest, run_fix_violations_job),
+    'apply-fixes': (ApplyFixesRequest, run_apply_fixes_job),
+    'workflow': (FixViolationsRequest, run_workflow_job),
+}
+
+for job_kind, (_, job_handler) in JOB_HANDLERS.items():
+    job_scheduler.register(job_kind, job_handler)
+
+@app.post("/api/jobs")
+async def submit_job(request: JobRequest):
+    """Submit a step (or the whole workflow) as a background job and return its ID"""
+    if request.kind not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(JOB_HANDLERS)}")
+    
+    # Validate the parameters now rather than when the job starts
+    request_model, _ = JOB_HANDLERS[request.kind]
+    try:
+        request_model(**request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    job = job_scheduler.submit(request.kind, request.params, priority=request.priority)
+    return job.to_dict()
+
+@app.get("/api/jobs")
+async def list_jobs(projectId: Optional[str] = Query(None)):
+    jobs = await asyncio.to_thread(job_scheduler.list, projectId)
+    return {"jobs": jobs, "stats": job_scheduler.stats()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, stage timings and partial or final results of a job"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Patch layers: one per LLM exchange, individually accepted/rejected, with undo/redo
+def history_response(project_id: str, history: PatchHistory) -> Dict[str, Any]:
+    return {"projectId": project_id, **history.summary()}
+
+def check_project(project_id: str):
+    if project_id not in sessions:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+@app.get("/api/patches")
+async def get_patches(projectId: str = Query(...)):
+    check_project(projectId)
+    return history_response(projectId, get_history(projectId))
+
+@app.post("/api/patches/layer")
+async def set_patch_layer(request: PatchLayerRequest):
+    """Accept or reject one layer; only its line keys are re-applied"""
+    check_project(request.projectId)
+    history = get_history(request.projectId)
+    try:
+        changes = history.set_accepted(request.layerId, request.accepted)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Patch layer not found")
+    save_history(request.projectId, history, changes)
+    return history_response(request.projectId, history)
+
+@app.post("/api/patches/undo")
+async def undo_patch_layer(request: ProjectRequest):
+    check_project(request.projectId)
+    history = get_history(request.projectId)
+    save_history(request.projectId, history, history.undo())
+    return history_response(request.projectId, history)
+
+@app.post("/api/patches/redo")
+async def redo_patch_layer(request: ProjectRequest):
+    check_project(request.projectId)
+    history = get_history(request.projectId)
+    save_history(request.projectId, history, history.redo())
+    return history_response(request.projectId, history)
+
+@app.get("/api/patches/snapshot")
+async def get_patch_snapshot(projectId: str = Query(...), layerId: int = Query(...)):
+    """
+    The fixed source as of a layer: the accepted layers up to and including it.
+    `layerApplied` is false when the layer itself was rejected and so left out.
+    """
+    check_project(projectId)
+    history = get_history(projectId)
+    try:
+        overlay = history.snapshot(layerId)
+        accepted = history.layer(layerId)['accepted']
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Patch layer not found")
+    document = await asyncio.to_thread(get_document, projectId)
+    code = await asyncio.to_thread(lambda: document.with_overlay(overlay).render_clean())
+    return {"projectId": projectId, "layerId": layerId, "layerApplied": accepted, "code": code}
+
+# Diffs between the original upload and the fixed state, and externally edited patches
+async def diff_document(project_id: str, layer_id: Optional[int]) -> NumberedDocument:
+    """The current fixed document, or its state as of `layer_id`"""
+    check_project(project_id)
+    document = await asyncio.to_thread(get_document, project_id)
+    if layer_id is None:
+        return document
+    try:
+        return document.with_overlay(get_history(project_id).snapshot(layer_id))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Patch layer not found")
+
+@app.get("/api/diff")
+async def get_diff(projectId: str = Query(...), context: int = Query(3, ge=0), layerId: Optional[int] = Query(None)):
+    """Unified diff from the original upload to the fixed file, streamed hunk by hunk"""
+    document = await diff_document(projectId, layerId)
+    filename = sessions[projectId]['original_filename']
+    return StreamingResponse(
+        iter_unified_diff(document, f"a/{filename}", f"b/{filename}", context),
+        media_type="text/x-diff",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.diff"'}
+    )
+
+@app.get("/api/diff/snippets")
+async def get_diff_snippets(projectId: str = Query(...), context: int = Query(3, ge=0), layerId: Optional[int] = Query(None)):
+    """The same diff split into hunks, each with the numbered line keys it changes"""
+    document = await diff_document(projectId, layerId)
+    hunks = await asyncio.to_thread(lambda: list(iter_hunks(document, context)))
+    return {
+        "projectId": projectId,
+        "hunks": [
+            {
+                "oldStart": hunk['oldStart'],
+                "oldLines": hunk['oldLines'],
+                "newStart": hunk['newStart'],
+                "newLines": hunk['newLines'],
+                "lineKeys": hunk['keys'],
+                "diff": format_hunk(hunk)
+            }
+            for hunk in hunks
+        ]
+    }
+
+@app.post("/api/patches/apply")
+async def apply_patch(request: ApplyPatchRequest):
+    """
+    Apply a unified diff against the original upload as a new patch layer.
+    With replaceLayers the earlier layers are rejected, so the fixed file
+    becomes the original plus this patch, except that removed lines stay as
+    empty lines (the numbered format cannot drop a line); `warnings` lists them.
+    """
+    check_project(request.projectId)
+    document = await asyncio.to_thread(get_document, request.projectId)
+    try:
+        snippets = patch_to_snippets(document, request.patch)
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    history = get_history(request.projectId)
+    # One session write for the whole change, however many layers it touches
+    with sessions[request.projectId].batch():
+        if request.replaceLayers:
+            for layer in history.layers:
+                save_history(request.projectId, history, history.set_accepted(layer['id'], False))
+        layer, changes = history.push("patch", snippets)
+        save_history(request.projectId, history, changes)
+    blanked = blanked_lines(snippets)
+    warnings = [
+        f"Removed lines kept as empty lines: {', '.join(blanked)}"
+    ] if blanked else []
+    return {"layerId": layer['id'], "warnings": warnings, **history_response(request.projectId, history)}
+
+# Token accounting
+@app.get("/api/tokens/usage")
+async def get_token_usage(projectId: str = Query(...)):
+    """Cumulative prompt/output tokens of a project and the estimator's calibration"""
+    check_project(projectId)
+    return {
+        "projectId": projectId,
+        "usage": add_usage({}, sessions[projectId].get('token_usage')),
+        "calibration": token_estimator.stats()
+    }
+
+@app.post("/api/tokens/plan")
+async def plan_token_batches(request: TokenPlanRequest):
+    """Preview how fix-violations would batch these violations"""
+    check_project(request.projectId)
+    numbered_file = sessions[request.projectId].get('numbered_file')
+    if not numbered_file:
+        raise HTTPException(status_code=400, detail="Add line numbers first")
+    violations, _ = dedupe_violations(request.violations or sessions[request.projectId].get('violations', []))
+    numbered_content = await asyncio.to_thread(load_cpp_file, numbered_file)
+    limit = output_token_limit(request)
+    batches = plan_violation_batches(token_estimator, numbered_content, violations, limit)
+    return {
+        "projectId": request.projectId,
+        "outputTokenLimit": limit,
+        "batches": [
+            {
+                "violations": len(batch['violations']),
+                "lines": violation_line_numbers(batch['violations']),
+                "estimatedOutputTokens": batch['estimatedOutputTokens'],
+                "estimatedPromptTokens": batch['estimatedPromptTokens']
+            }
+            for batch in batches
+        ]
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Stage latency histograms, token counters and queue depths in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class LoggingRequest(BaseModel):
+    verbose: bool
+
+@app.get("/api/logging")
+async def get_logging():
+    return {"verbose": is_verbose()}
+
+@app.post("/api/logging")
+async def update_logging(request: LoggingRequest):
+    """Switch debug logging (full responses, skipped lines, per-stage timings) on or off"""
+    set_verbose(request.verbose)
+    return {"verbose": is_verbose()}
+
+@app.get("/api/llm/models")
+async def get_llm_models():
+    """Model objects built so far, per settings profile, with registry hit counts"""
+    return model_registry_stats()
+
+@app.get("/api/llm/latency")
+async def get_llm_latency():
+    """Per-model p95 latency and retry/hedge/fallback counts, with the policy in force"""
+    return {
+        "policy": resilience_policy.to_dict(),
+        "models": latency_tracker.stats(),
+        "abandonedAttempts": abandoned_attempts.stats()
+    }
+
+@app.get("/api/resources")
+async def get_resources():
+    """Memory/disk use against the budgets, the last sweep and recent evictions"""
+    return await asyncio.to_thread(resource_manager.stats)
+
+@app.post("/api/resources/sweep")
+async def sweep_resources():
+    """Run a sweep now; returns what it evicted and released"""
+    try:
+        return await asyncio.to_thread(resource_manager.sweep)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/resources/evict")
+async def evict_project(request: ProjectRequest):
+    """Delete a project and its files now"""
+    try:
+        if request.projectId not in sessions:
+            raise HTTPException(status_code=404, detail="Project not found")
+        if llm_executor.is_busy(request.projectId):
+            raise HTTPException(status_code=409, detail="Project has an LLM call in progress")
+        return await asyncio.to_thread(resource_manager.evict, request.projectId)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/resources/pin")
+async def pin_project(request: PinRequest):
+    """Pinned projects are never evicted or released"""
+    try:
+        if request.projectId not in sessions:
+            raise HTTPException(status_code=404, detail="Project not found")
+        resource_manager.pin(request.projectId, request.pinned)
+        return {"projectId": request.projectId, "pinned": request.pinned}
     except HTTPException:
         raise
     except Exception as e:
@@ -445,6 +1481,21 @@ async def save_session_state():
     # For now, just return success
     return {"success": True}
 
+@app.get("/api/cache/fixes")
+async def get_fix_cache_stats():
+    """Size and lifetime hit rate of the fix cache"""
+    return fix_cache.stats()
+
+@app.delete("/api/cache/fixes")
+async def clear_fix_cache():
+    fix_cache.clear()
+    return {"success": True}
+
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """Queue depth and call counters for the Gemini execution pool"""
+    return llm_executor.stats()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
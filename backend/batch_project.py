@@ -0,0 +1,273 @@
+# batch_project.py
+import asyncio
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+from numbered_document import NumberedDocument
+from excel_utils import group_violations_by_file
+from scope_index import ScopeIndex
+from fanout import fix_violation_group, violation_line
+from violation_clustering import format_violations_prompt
+from snippet_validator import SnippetValidator
+from instrumentation import span
+
+SOURCE_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx')
+DEFAULT_BATCH_WORKERS = 4
+
+
+def extract_sources(archive_path: str, destination: str) -> list:
+    """
+    Safely unpack the C/C++ sources of a zip or tar archive into `destination`.
+    Returns their paths relative to `destination`, using forward slashes.
+    """
+    root = os.path.realpath(destination)
+    os.makedirs(root, exist_ok=True)
+    extracted = []
+
+    def target_for(name: str):
+        if not name.lower().endswith(SOURCE_EXTENSIONS):
+            return None
+        target = os.path.realpath(os.path.join(root, name))
+        # Reject absolute paths and ../ entries that would escape the batch folder
+        if not target.startswith(root + os.sep):
+            return None
+        return target
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                target = target_for(info.filename)
+                if info.is_dir() or target is None:
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(info) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                extracted.append(os.path.relpath(target, root).replace(os.sep, '/'))
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                target = target_for(member.name)
+                if not member.isfile() or target is None:
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.extractfile(member) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                extracted.append(os.path.relpath(target, root).replace(os.sep, '/'))
+    else:
+        raise ValueError("Unsupported archive format; upload a .zip or .tar(.gz) file")
+
+    return sorted(extracted)
+
+
+def match_violations_to_sources(sources: list, grouped: dict) -> dict:
+    """
+    Map each relative source path to its violations. Report rows name files by
+    basename; when several sources share a basename the row's `Path` decides.
+    """
+    by_basename = {}
+    for rel_path in sources:
+        by_basename.setdefault(os.path.basename(rel_path), []).append(rel_path)
+
+    matched = {rel_path: [] for rel_path in sources}
+    for file_name, violations in grouped.items():
+        candidates = by_basename.get(os.path.basename(str(file_name)), [])
+        if len(candidates) == 1:
+            matched[candidates[0]].extend(violations)
+            continue
+        for v in violations:
+            report_path = str(v.get('path') or '').replace('\\', '/')
+            owner = next((c for c in candidates if report_path.endswith(c)), None)
+            if owner is not None:
+                matched[owner].append(v)
+    return matched
+
+
+class BatchProject:
+    """
+    A source tree plus one MISRA report, processed file by file:
+    line table -> intro -> fix -> continuation -> overlay -> render,
+    with at most `workers` files in flight.
+    """
+
+    def __init__(self, batch_id: str, folder: str, archive_path: str, report_path: str,
+                 settings: dict, workers: int = DEFAULT_BATCH_WORKERS, context_mode: str = "full",
+                 limits: dict = None, report_hash: str = None):
+        self.batch_id = batch_id
+        self.folder = folder
+        self.archive_path = archive_path
+        self.report_path = report_path
+        self.report_hash = report_hash
+        self.settings = dict(settings)
+        self.workers = max(1, workers)
+        self.context_mode = context_mode
+        self.limits = limits or {}
+        self.source_dir = os.path.join(folder, 'src')
+        self.output_dir = os.path.join(folder, 'fixed')
+        self.output_archive = None
+        self.status = "pending"
+        self.error = None
+        self.files = {}
+        self.started_at = None
+        self.finished_at = None
+        # Called on the event loop whenever the status of the batch or of a file changes
+        self.on_change = None
+
+    def _changed(self, final: bool = False):
+        if self.on_change is not None:
+            self.on_change(self, final)
+
+    def prepare(self):
+        """Unpack the sources and split the report by file. Blocking."""
+        sources = extract_sources(self.archive_path, self.source_dir)
+        if not sources:
+            raise ValueError("The archive does not contain any C/C++ source files")
+        matched = match_violations_to_sources(sources, group_violations_by_file(self.report_path, self.report_hash))
+        self.files = {
+            rel_path: {
+                'status': "queued",
+                'violations': violations,
+                'snippets': 0,
+                'turns': 0,
+                'seconds': None,
+                'error': None
+            }
+            for rel_path, violations in matched.items()
+        }
+
+    async def run(self, llm_executor):
+        self.status = "running"
+        self.started_at = time.monotonic()
+        self._changed()
+        slots = asyncio.Semaphore(self.workers)
+
+        async def worker(rel_path: str):
+            async with slots:
+                await self._process_file(llm_executor, rel_path)
+
+        try:
+            await asyncio.gather(*(worker(rel_path) for rel_path in self.files))
+            self.output_archive = await asyncio.to_thread(self._build_archive)
+            failed = any(entry['status'] == "failed" for entry in self.files.values())
+            self.status = "completed_with_errors" if failed else "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.monotonic()
+            self._changed(final=True)
+
+    async def _process_file(self, llm_executor, rel_path: str):
+        entry = self.files[rel_path]
+        entry['status'] = "running"
+        self._changed()
+        started = time.monotonic()
+        source = os.path.join(self.source_dir, rel_path)
+        output = os.path.join(self.output_dir, rel_path)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        try:
+            violations = entry['violations']
+            if not violations:
+                # Nothing to fix; ship the file unchanged
+                await asyncio.to_thread(shutil.copyfile, source, output)
+                entry['status'] = "skipped"
+                return
+
+            with span("numbering"):
+                document = await asyncio.to_thread(NumberedDocument.from_file, source)
+                content = document.render_numbered()
+            partial = self.context_mode == "scopes"
+            lines = [line for line in (violation_line(v) for v in violations) if line is not None]
+            if partial:
+                content = ScopeIndex.from_numbered_text(content).slice_for_lines(lines)
+
+            result = await llm_executor.run(
+                f"batch:{self.batch_id}:{rel_path}", fix_violation_group,
+                self.settings, content, format_violations_prompt(violations),
+                partial=partial, validator=SnippetValidator(len(document), document), violation_lines=lines,
+                **self.limits
+            )
+            if result['stopReason'] == "blocked" and not result['responses']:
+                raise RuntimeError("Response was blocked by safety filters")
+
+            with span("merge"):
+                document.apply(result['snippets'])
+            with span("denumbering"):
+                await asyncio.to_thread(self._write_output, output, document.render_clean())
+
+            entry['snippets'] = len(result['snippets'])
+            entry['turns'] = result['turns']
+            entry['status'] = "completed" if result['complete'] else "partial"
+        except asyncio.CancelledError:
+            entry['status'] = "cancelled"
+            raise
+        except Exception as e:
+            entry['status'] = "failed"
+            entry['error'] = str(e)
+            # Keep the tree complete: fall back to the original file
+            if os.path.exists(source):
+                shutil.copyfile(source, output)
+        finally:
+            entry['seconds'] = time.monotonic() - started
+            self._changed()
+
+    @staticmethod
+    def _write_output(path: str, text: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def _build_archive(self) -> str:
+        archive_path = os.path.join(self.folder, f"fixed_{self.batch_id}.zip")
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for rel_path in sorted(self.files):
+                output = os.path.join(self.output_dir, rel_path)
+                if os.path.exists(output):
+                    archive.write(output, rel_path)
+        return archive_path
+
+    def progress(self) -> dict:
+        entries = self.files.values()
+        counts = {}
+        for entry in entries:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        finished = [e for e in entries if e['status'] in ("completed", "partial", "skipped", "failed")]
+        violations_total = sum(len(e['violations']) for e in entries)
+        violations_done = sum(len(e['violations']) for e in finished)
+
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+
+        return {
+            'batchId': self.batch_id,
+            'status': self.status,
+            'error': self.error,
+            'workers': self.workers,
+            'filesTotal': len(self.files),
+            'filesDone': len(finished),
+            'filesByStatus': counts,
+            'violationsTotal': violations_total,
+            'violationsDone': violations_done,
+            'elapsedSeconds': elapsed,
+            'filesPerMinute': len(finished) * 60.0 / elapsed if elapsed else 0.0,
+            'violationsPerMinute': violations_done * 60.0 / elapsed if elapsed else 0.0,
+            'downloadReady': self.output_archive is not None,
+            'files': [
+                {
+                    'path': rel_path,
+                    'status': entry['status'],
+                    'violations': len(entry['violations']),
+                    'snippets': entry['snippets'],
+                    'turns': entry['turns'],
+                    'seconds': entry['seconds'],
+                    'error': entry['error']
+                }
+                for rel_path, entry in sorted(self.files.items())
+            ]
+        }
@@ -0,0 +1 @@
+# benchmarks package: synthetic inputs and the pipeline benchmark CLI (python -m benchmarks.run)
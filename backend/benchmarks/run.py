@@ -0,0 +1,328 @@
+# run.py
+"""
+Pipeline benchmarks on synthetic sources and reports.
+
+Run from backend/:
+    python -m benchmarks.run --lines 1000,20000,200000 --rows 1000,100000,500000 --output bench.json
+    python -m benchmarks.run --compare bench.json      # and flag stages that got slower
+
+Every stage is timed `--repeat` times; results go to a JSON file keyed by
+stage and parameters. API round-trips run in-process against the offline
+fake provider, or against a running server with --url (start it with
+MISRA_LLM_PROVIDER=fake).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.synthetic import (
+    write_cpp_file, generate_report_rows, write_xlsx_report, write_csv_report,
+    pick_violations, fix_response_text
+)
+
+# A stage is reported as a regression when its median grows by more than this
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+
+def summarize(samples: list) -> dict:
+    return {
+        'repeat': len(samples),
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'max': max(samples),
+        'samples': samples,
+    }
+
+
+def time_stage(results: list, stage: str, params: dict, fn, repeat: int):
+    """Time fn(run_index) `repeat` times; the pipeline's own prints are swallowed"""
+    samples = []
+    for run in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            fn(run)
+            samples.append(time.perf_counter() - started)
+    entry = {'stage': stage, 'params': params, **summarize(samples)}
+    results.append(entry)
+    print(f"{stage:<36} {json.dumps(params):<44} median {entry['median'] * 1000:10.2f} ms")
+    return entry
+
+
+def bench_file_stages(results: list, workdir: str, line_count: int, density: float, repeat: int):
+    from numbering import add_line_numbers
+    from fixed_response_code_snippet import extract_snippets_from_response
+    from replace import merge_fixed_snippets_into_file
+    from denumbering import remove_line_numbers
+    from numbered_document import NumberedDocument
+
+    source = os.path.join(workdir, f"synthetic_{line_count}.cpp")
+    numbered = os.path.join(workdir, f"numbered_{line_count}.txt")
+    merged = os.path.join(workdir, f"merged_{line_count}.txt")
+    fixed = os.path.join(workdir, f"fixed_{line_count}.cpp")
+
+    lines = write_cpp_file(source, line_count)
+    violations = pick_violations(lines, max(1, int(line_count * density / 1000)))
+    response = fix_response_text(lines, violations)
+    params = {'lines': line_count, 'violations': len(violations)}
+
+    time_stage(results, "add_line_numbers", params, lambda run: add_line_numbers(source, numbered), repeat)
+    snippets = extract_snippets_from_response(response)
+    time_stage(results, "extract_snippets_from_response", dict(params, responseChars=len(response)),
+               lambda run: extract_snippets_from_response(response), repeat)
+    time_stage(results, "merge_fixed_snippets_into_file", dict(params, snippets=len(snippets)),
+               lambda run: merge_fixed_snippets_into_file(numbered, snippets, merged), repeat)
+    time_stage(results, "remove_line_numbers", params, lambda run: remove_line_numbers(merged, fixed), repeat)
+
+    def document_round_trip(run):
+        # The in-memory path the API takes: parse, lay the snippets over, render both forms
+        document = NumberedDocument.from_file(source)
+        document.apply(snippets)
+        document.render_numbered()
+        document.render_clean()
+
+    time_stage(results, "numbered_document_round_trip", dict(params, snippets=len(snippets)),
+               document_round_trip, repeat)
+
+
+def bench_report_stages(results: list, workdir: str, row_count: int, target_lines: int, repeat: int):
+    from excel_utils import extract_violations_for_file
+
+    target = "synthetic.cpp"
+    xlsx_path = os.path.join(workdir, f"report_{row_count}.xlsx")
+    csv_path = os.path.join(workdir, f"report_{row_count}.csv")
+    started = time.perf_counter()
+    write_xlsx_report(xlsx_path, generate_report_rows(target, target_lines, row_count))
+    write_csv_report(csv_path, generate_report_rows(target, target_lines, row_count))
+    print(f"  generated {row_count} report rows in {time.perf_counter() - started:.1f}s")
+    params = {'rows': row_count}
+
+    # A content hash nobody has seen forces a full parse (and the index pickle write)
+    time_stage(results, "extract_violations_for_file.xlsx_cold", params,
+               lambda run: extract_violations_for_file(xlsx_path, target, content_hash=f"bench-{row_count}-{run}-{time.time_ns()}"),
+               repeat)
+    warm_hash = f"bench-{row_count}-warm"
+    extract_violations_for_file(xlsx_path, target, content_hash=warm_hash)
+    time_stage(results, "extract_violations_for_file.xlsx_warm", params,
+               lambda run: extract_violations_for_file(xlsx_path, target, content_hash=warm_hash), repeat)
+    time_stage(results, "extract_violations_for_file.csv_stream", params,
+               lambda run: extract_violations_for_file(csv_path, target), repeat)
+
+
+API_STEPS = ("upload_cpp", "upload_report", "add_line_numbers", "first_prompt", "fix_violations",
+             "apply_fixes", "download")
+
+
+async def _project_round_trip(client, index: int, source_text: str, report_bytes: bytes, limit):
+    project_id = f"bench{index}_{time.time_ns()}"
+    timings = {}
+
+    async def step(name, request):
+        started = time.perf_counter()
+        response = await request
+        timings[name] = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"{name} failed with {response.status_code}: {response.text[:200]}")
+        return response
+
+    async with limit:
+        started = time.perf_counter()
+        await step("upload_cpp", client.post(
+            "/api/upload/cpp-file", data={'projectId': project_id},
+            files={'file': ("synthetic.cpp", source_text.encode('utf-8'))}))
+        violations = (await step("upload_report", client.post(
+            "/api/upload/misra-report", data={'projectId': project_id, 'targetFile': "synthetic.cpp"},
+            files={'file': ("report.xlsx", report_bytes)}))).json()
+        await step("add_line_numbers", client.post("/api/process/add-line-numbers", json={'projectId': project_id}))
+        await step("first_prompt", client.post("/api/gemini/first-prompt", json={'projectId': project_id}))
+        fixes = (await step("fix_violations", client.post(
+            "/api/gemini/fix-violations",
+            json={'projectId': project_id, 'violations': violations, 'useCache': False}))).json()
+        await step("apply_fixes", client.post("/api/process/apply-fixes", json={'projectId': project_id}))
+        await step("download", client.get("/api/download/fixed-file", params={'projectId': project_id}))
+        timings['total'] = time.perf_counter() - started
+    return timings, len(violations), len(fixes.get('codeSnippets') or {})
+
+
+async def _api_round_trips(args, source_text: str, report_bytes: bytes) -> dict:
+    import httpx
+
+    backend = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=None)
+    else:
+        from llm_providers import FakeProvider, set_provider
+        set_provider(FakeProvider(latency=args.fake_latency, token_latency=args.fake_token_latency))
+        import app as backend
+        await backend.startup_event()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://bench",
+                                   timeout=None)
+
+    try:
+        limit = asyncio.Semaphore(args.api_concurrency)
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*[
+            _project_round_trip(client, index, source_text, report_bytes, limit)
+            for index in range(args.api_projects)
+        ])
+        wall = time.perf_counter() - started
+    finally:
+        await client.aclose()
+        if backend is not None:
+            await backend.shutdown_event()
+
+    steps = {name: summarize([timings[name] for timings, _, _ in outcomes]) for name in API_STEPS + ('total',)}
+    return {
+        'wallSeconds': wall,
+        'projectsPerMinute': 60.0 * len(outcomes) / wall if wall else None,
+        'violations': outcomes[0][1],
+        'snippets': outcomes[0][2],
+        'steps': steps,
+    }
+
+
+def bench_api(results: list, workdir: str, args):
+    source_path = os.path.join(workdir, "api_synthetic.cpp")
+    lines = write_cpp_file(source_path, args.api_lines)
+    violation_count = max(1, int(args.api_lines * args.violations_per_kloc / 1000))
+    report_path = os.path.join(workdir, "api_report.xlsx")
+    write_xlsx_report(report_path, generate_report_rows(
+        "synthetic.cpp", len(lines), violation_count, target_share=1.0, seed=args.api_lines))
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source_text = f.read()
+    with open(report_path, 'rb') as f:
+        report_bytes = f.read()
+
+    params = {
+        'lines': args.api_lines,
+        'projects': args.api_projects,
+        'concurrency': args.api_concurrency,
+        'target': args.url or "in-process",
+        'fakeLatency': None if args.url else args.fake_latency,
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = asyncio.run(_api_round_trips(args, source_text, report_bytes))
+    for name, stats in outcome.pop('steps').items():
+        results.append({'stage': f"api.{name}", 'params': params, **stats})
+        print(f"{'api.' + name:<36} {json.dumps(params)[:44]:<44} median {stats['median'] * 1000:10.2f} ms")
+    results.append({'stage': "api.throughput", 'params': params, **outcome})
+    print(f"{'api.throughput':<36} {outcome['projectsPerMinute']:.1f} projects/min")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _result_key(entry: dict) -> str:
+    return f"{entry['stage']} {json.dumps(entry['params'], sort_keys=True)}"
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list:
+    """Stages whose median changed, slowest-growing first"""
+    before = {_result_key(entry): entry for entry in previous.get('results', []) if 'median' in entry}
+    changes = []
+    for entry in current['results']:
+        old = before.get(_result_key(entry))
+        if old is None or 'median' not in entry or not old['median']:
+            continue
+        ratio = entry['median'] / old['median']
+        changes.append({
+            'stage': entry['stage'],
+            'params': entry['params'],
+            'previousMedian': old['median'],
+            'median': entry['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+    return sorted(changes, key=lambda change: change['ratio'], reverse=True)
+
+
+def _int_list(text: str) -> list:
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=_int_list, default=[1000, 20000],
+                        help="Synthetic source sizes in lines (1k to 200k)")
+    parser.add_argument("--rows", type=_int_list, default=[1000, 20000],
+                        help="Synthetic report sizes in rows (1k to 500k)")
+    parser.add_argument("--violations-per-kloc", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-api", action="store_true", help="Only time the file and report stages")
+    parser.add_argument("--api-lines", type=int, default=2000)
+    parser.add_argument("--api-projects", type=int, default=8)
+    parser.add_argument("--api-concurrency", type=int, default=4)
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="Seconds per fake model call")
+    parser.add_argument("--fake-token-latency", type=float, default=0.0, help="Seconds per fake output token")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output)
+    previous_path = os.path.abspath(args.compare) if args.compare else None
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="misra-bench-") as workdir:
+        # The app keeps its uploads, sessions and report index under the working directory
+        os.environ.setdefault('SESSION_STORE', 'memory')
+        os.environ['REPORT_INDEX_DIR'] = os.path.join(workdir, 'report_index')
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for line_count in args.lines:
+                bench_file_stages(results, workdir, line_count, args.violations_per_kloc, args.repeat)
+            for row_count in args.rows:
+                bench_report_stages(results, workdir, row_count, max(args.lines), args.repeat)
+            if not args.skip_api:
+                bench_api(results, workdir, args)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        'meta': {
+            'createdAt': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+    exit_code = 0
+    if previous_path:
+        with open(previous_path, 'r', encoding='utf-8') as f:
+            changes = compare(json.load(f), report, args.threshold)
+        report['comparison'] = {'against': previous_path, 'threshold': args.threshold, 'changes': changes}
+        regressions = [change for change in changes if change['regression']]
+        for change in regressions:
+            print(f"REGRESSION {change['stage']} {json.dumps(change['params'])}: x{change['ratio']:.2f}")
+        exit_code = 1 if regressions else 0
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
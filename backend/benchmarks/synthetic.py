@@ -0,0 +1,161 @@
+# synthetic.py
+import csv
+import random
+
+REPORT_COLUMNS = ('File', 'Path', 'Line and Warning', 'Level', 'Misra', 'Status')
+
+RULES = [
+    ("M5-0-4", "An implicit integral conversion shall not change the signedness of the underlying type."),
+    ("M6-4-1", "An if ( condition ) construct shall be followed by a compound statement."),
+    ("A7-1-1", "Constexpr or const specifiers shall be used for immutable data declaration."),
+    ("M0-1-9", "There shall be no dead code."),
+    ("A5-1-1", "Literal values shall not be used apart from type initialization."),
+    ("M16-0-4", "Function-like macros shall not be defined."),
+    ("A18-1-1", "C-style arrays shall not be used."),
+    ("M3-9-1", "The types used for an object shall be token-for-token identical in all declarations."),
+]
+LEVELS = ("Required", "Advisory", "Mandatory")
+
+
+def _function(rng: random.Random, index: int) -> list:
+    name = f"Process_{index}"
+    body = [f"int {name}(int value, const int* buffer, int size)", "{", "    int total = 0;"]
+    for step in range(rng.randint(3, 12)):
+        kind = rng.random()
+        if kind < 0.3:
+            body += [f"    if (value > {rng.randint(1, 255)})", f"        total += buffer[{step} % size];"]
+        elif kind < 0.5:
+            body += [f"    for (int i = 0; i < size; i++) {{", f"        total ^= buffer[i] << {step % 8};", "    }"]
+        elif kind < 0.7:
+            body.append(f"    // step {step}: accumulate scaled input")
+            body.append(f"    total += value * {rng.randint(2, 99)};")
+        elif kind < 0.85:
+            body += [f"    switch (value & {rng.randint(1, 15)}) {{", "    case 0:", "        total--;",
+                     "        break;", "    default:", "        total++;", "        break;", "    }"]
+        else:
+            body.append(f"    unsigned char flag_{step} = (unsigned char)(total & 0xFF);")
+            body.append(f"    total += flag_{step};")
+    body += ["    return total;", "}", ""]
+    return body
+
+
+def generate_cpp_lines(line_count: int, seed: int = 15) -> list:
+    """`line_count` lines of plausible embedded C++: includes, macros, a namespace of functions"""
+    rng = random.Random(seed)
+    lines = [
+        "#include <cstdint>",
+        "#include <cstring>",
+        '#include "Std_Types.h"',
+        "",
+        "#define MAX_VALUE(a, b) \\",
+        "    ((a) > (b) ? (a) : (b))",
+        "",
+        "namespace synthetic",
+        "{",
+        "static int g_buffer[64];",
+        "",
+    ]
+    index = 0
+    while len(lines) < line_count - 1:
+        lines += _function(rng, index)
+        index += 1
+    lines = lines[:line_count - 1]
+    lines.append("} // namespace synthetic")
+    return lines[:line_count]
+
+
+def write_cpp_file(path: str, line_count: int, seed: int = 15) -> list:
+    lines = generate_cpp_lines(line_count, seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return lines
+
+
+def generate_report_rows(target_file: str, target_lines: int, row_count: int, target_share: float = 0.1,
+                         seed: int = 15):
+    """
+    Rows of a MISRA report: `target_share` of them point into `target_file`
+    (lines 1..target_lines), the rest into other synthetic files.
+    """
+    rng = random.Random(seed)
+    other_files = max(1, row_count // 500)
+    for _ in range(row_count):
+        if rng.random() < target_share:
+            file_name, line = target_file, rng.randint(1, target_lines)
+        else:
+            file_name, line = f"module_{rng.randrange(other_files)}.cpp", rng.randint(1, 5000)
+        rule, message = RULES[rng.randrange(len(RULES))]
+        yield (
+            file_name,
+            f"/src/synthetic/{file_name}",
+            f"[Line {line}] {message}",
+            LEVELS[rng.randrange(len(LEVELS))],
+            rule,
+            "Open",
+        )
+
+
+def write_xlsx_report(path: str, rows) -> int:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(REPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def write_csv_report(path: str, rows) -> int:
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def pick_violations(lines: list, count: int, seed: int = 15) -> list:
+    """Violation dicts on non-blank lines of `lines`, in line order"""
+    rng = random.Random(seed)
+    candidates = [number for number, line in enumerate(lines, start=1) if line.strip()]
+    chosen = sorted(rng.sample(candidates, min(count, len(candidates))))
+    violations = []
+    for number in chosen:
+        rule, message = RULES[rng.randrange(len(RULES))]
+        violations.append({
+            'file': "synthetic.cpp",
+            'path': "/src/synthetic/synthetic.cpp",
+            'line': number,
+            'warning': message,
+            'level': "Required",
+            'misra': rule,
+        })
+    return violations
+
+
+def fix_response_text(lines: list, violations: list, context: int = 2, inserted_every: int = 4) -> str:
+    """
+    A Gemini-style answer for `violations`: one ```cpp block per violation
+    with numbered context lines, the violated line rewritten and, for every
+    `inserted_every`-th violation, an inserted `Na:` line.
+    """
+    blocks = []
+    for position, violation in enumerate(violations):
+        number = violation['line']
+        out = [f"Fix for {violation['misra']} at line {number}:", "```cpp"]
+        for lineno in range(max(1, number - context), min(len(lines), number + context) + 1):
+            code = lines[lineno - 1]
+            if lineno == number:
+                code = f"{code.rstrip()} // {violation['misra']} fixed"
+            out.append(f"{lineno}: {code}")
+            if lineno == number and inserted_every and position % inserted_every == 0:
+                out.append(f"{lineno}a:     // justification for {violation['misra']}")
+        out.append("```")
+        blocks.append("\n".join(out))
+    return "\n\n".join(blocks)
@@ -0,0 +1,103 @@
+# continuation.py
+from misra_chat_client import CONTINUE_COMMAND, send_continue, stream_message
+from fixed_response_code_snippet import extract_snippets_from_response
+
+CONTINUATION_MARKER = "--- CONTINUED ---"
+
+# Defaults for the automatic "next" loop; both can be overridden per request
+DEFAULT_MAX_TURNS = 20
+DEFAULT_TOKEN_BUDGET = 1000000
+
+
+def has_continuation_marker(text: str) -> bool:
+    return bool(text) and CONTINUATION_MARKER in text
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough output token estimate (~4 characters per token)"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def merge_snippets(base: dict, update: dict) -> dict:
+    """Merge a batch of snippets into the accumulated dict; later batches win"""
+    merged = dict(base)
+    merged.update(update)
+    return merged
+
+
+def drive_continuations(chat, first_response: str, max_turns: int = DEFAULT_MAX_TURNS,
+                        token_budget: int = DEFAULT_TOKEN_BUDGET, on_batch=None) -> dict:
+    """
+    Keeps sending "next" while Gemini ends its reply with `--- CONTINUED ---`,
+    accumulating the snippets of every batch. Stops when the model is done,
+    after `max_turns` responses or once `token_budget` estimated output tokens
+    have been generated. `on_batch(turn, snippets)` is called after each batch.
+    """
+    responses = []
+    snippets = {}
+    tokens = 0
+    response = first_response
+    stop_reason = "complete"
+
+    while True:
+        if response is None:
+            stop_reason = "blocked"
+            break
+
+        responses.append(response)
+        tokens += estimate_tokens(response)
+        snippets = merge_snippets(snippets, extract_snippets_from_response(response))
+        if on_batch is not None:
+            on_batch(len(responses), snippets)
+
+        if not has_continuation_marker(response):
+            stop_reason = "complete"
+            break
+        if len(responses) >= max_turns:
+            stop_reason = "max_turns"
+            break
+        if tokens >= token_budget:
+            stop_reason = "token_budget"
+            break
+
+        response = send_continue(chat)
+
+    return {
+        'responses': responses,
+        'snippets': snippets,
+        'turns': len(responses),
+        'tokens': tokens,
+        'complete': stop_reason == "complete",
+        'stopReason': stop_reason,
+    }
+
+
+def stream_with_continuations(chat, first_stream, max_turns: int = DEFAULT_MAX_TURNS,
+                              token_budget: int = DEFAULT_TOKEN_BUDGET):
+    """Streaming counterpart of drive_continuations; yields text chunks across all turns"""
+    stream = first_stream
+    turns = 0
+    tokens = 0
+    while True:
+        turn_text = []
+        for chunk in stream:
+            turn_text.append(chunk)
+            yield chunk
+        turns += 1
+        text = "".join(turn_text)
+        tokens += estimate_tokens(text)
+
+        if not has_continuation_marker(text) or turns >= max_turns or tokens >= token_budget:
+            return
+
+        # Keep batches on separate lines so a fence never spans two turns
+        yield "\n"
+        stream = stream_message(chat, CONTINUE_COMMAND)
+
+
+def send_with_continuations(chat, send_first, *args, max_turns: int = DEFAULT_MAX_TURNS,
+                            token_budget: int = DEFAULT_TOKEN_BUDGET, on_batch=None) -> dict:
+    """Send the first message with `send_first(chat, *args)` and drive the continuation loop"""
+    first_response = send_first(chat, *args)
+    return drive_continuations(chat, first_response, max_turns=max_turns,
+                               token_budget=token_budget, on_batch=on_batch)
@@ -1,6 +1,10 @@
 # denumbering.py
 import re
 
+from instrumentation import span
+
+LINE_NUMBER_PREFIX_RE = re.compile(r'^\d+[a-zA-Z]*:\s?')
+
 # def remove_line_numbers(input_file, output_file):
 #     """Remove line numbers from a numbered C++ file"""
 #     with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
@@ -11,10 +15,11 @@ import re
 
 def remove_line_numbers(input_file, output_file):
     """Remove line numbers from a numbered C++ file"""
-    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+    with span("denumbering"), open(input_file, 'r', encoding='utf-8') as infile, \
+            open(output_file, 'w', encoding='utf-8') as outfile:
         for line in infile:
             # Remove line numbers like 123:, 123a:, 45b:, etc.
-            new_line = re.sub(r'^\d+[a-zA-Z]*:\s?', '', line)
+            new_line = LINE_NUMBER_PREFIX_RE.sub('', line)
             # Preserve empty lines that were just line numbers
             if new_line.strip() == '':
                 outfile.write('\n')
@@ -1,32 +1,31 @@
 # excel_utils.py
-import pandas as pd
-import re
+from report_index import get_report_index
+from report_stream import iter_violations, count_violations_by_file, should_stream
+from instrumentation import span
 
-def extract_violations_for_file(excel_path: str, target_file: str) -> list:
+def extract_violations_for_file(excel_path: str, target_file: str, content_hash: str = None) -> list:
     """Extract violations for a specific file from Excel report"""
-    df = pd.read_excel(excel_path, engine="openpyxl", usecols="A:F")
+    with span("excel_parse"):
+        # CSV/JSON and very large workbooks are filtered while streaming to keep memory flat
+        if should_stream(excel_path):
+            return list(iter_violations(excel_path, target_file))
+        # Otherwise the workbook is parsed once per content hash and later lookups hit the cached index
+        return get_report_index(excel_path, content_hash).violations_for(target_file)
 
-    def parse_line_warning(text):
-        match = re.match(r"\[Line (\d+)\]\s*(.+)", str(text))
-        return (int(match.group(1)), match.group(2)) if match else (None, text)
+def list_report_files(excel_path: str, content_hash: str = None) -> list:
+    """Files covered by the report, with their violation counts"""
+    with span("excel_parse"):
+        if should_stream(excel_path):
+            return count_violations_by_file(excel_path)
+        return get_report_index(excel_path, content_hash).files()
 
-    df[['Line', 'Warning']] = df['Line and Warning'].apply(lambda x: pd.Series(parse_line_warning(x)))
-
-    filtered_df = df[df['File'] == target_file]
-
-    if filtered_df.empty:
-        return []
-
-    # Convert to list of dictionaries for JSON response
-    violations = []
-    for _, row in filtered_df.iterrows():
-        violations.append({
-            'file': row['File'],
-            'path': row['Path'],
-            'line': row['Line'],
-            'warning': row['Warning'],
-            'level': row['Level'],
-            'misra': row['Misra']
-        })
-
-    return violations
\ No newline at end of file
+def group_violations_by_file(excel_path: str, content_hash: str = None) -> dict:
+    """All violations of the report grouped by their `File` column, in one pass"""
+    with span("excel_parse"):
+        if should_stream(excel_path):
+            grouped = {}
+            for violation in iter_violations(excel_path):
+                grouped.setdefault(violation['file'], []).append(violation)
+            return grouped
+        index = get_report_index(excel_path, content_hash)
+        return {file_name: index.violations_for(file_name) for file_name in index.by_file}
@@ -0,0 +1,140 @@
+# fanout.py
+import re
+from collections import defaultdict
+
+from misra_chat_client import start_chat, send_file_intro, send_misra_violations
+from continuation import send_with_continuations
+from token_usage import MeteredChat
+
+FANOUT_MODES = ("rule", "lines")
+DEFAULT_FANOUT_WIDTH = 4
+DEFAULT_FANOUT_GROUPS = 8
+
+
+def violation_line(violation: dict):
+    """Reported line number of a violation as an int, or None if it has none"""
+    try:
+        return int(violation.get('line'))
+    except (TypeError, ValueError):
+        return None
+
+
+def base_line_number(lineno: str) -> int:
+    """`123a` -> 123"""
+    return int(re.match(r"(\d+)", lineno).group(1))
+
+
+def _pack_buckets(buckets: list, max_groups: int) -> list:
+    """Greedily pack ordered buckets of violations into at most `max_groups` groups"""
+    if len(buckets) <= max_groups:
+        return buckets
+    groups = [[] for _ in range(max_groups)]
+    # Largest first onto the least loaded group; ties resolved by index for determinism
+    for bucket in sorted(buckets, key=len, reverse=True):
+        target = min(range(max_groups), key=lambda i: (len(groups[i]), i))
+        groups[target].extend(bucket)
+    return [g for g in groups if g]
+
+
+def partition_violations(violations: list, mode: str = "rule", max_groups: int = DEFAULT_FANOUT_GROUPS) -> list:
+    """
+    Split violations into independent groups.
+    - "rule": one group per MISRA rule, packed down to `max_groups`.
+    - "lines": contiguous, non-overlapping line ranges of roughly equal size.
+    Returns a list of lists of violation dicts; the order is deterministic.
+    """
+    if mode not in FANOUT_MODES:
+        raise ValueError(f"Unknown fan-out mode: {mode}")
+    max_groups = max(1, max_groups)
+    if not violations:
+        return []
+
+    if mode == "rule":
+        by_rule = defaultdict(list)
+        for v in violations:
+            by_rule[str(v.get('misra'))].append(v)
+        buckets = [by_rule[rule] for rule in sorted(by_rule)]
+        return _pack_buckets(buckets, max_groups)
+
+    # "lines": never split violations reported on the same line across groups
+    ordered = sorted(violations, key=lambda v: (violation_line(v) is None, violation_line(v) or 0))
+    target_size = -(-len(ordered) // max_groups)
+    groups = [[]]
+    for v in ordered:
+        current = groups[-1]
+        if len(current) >= target_size and violation_line(current[-1]) != violation_line(v):
+            current = []
+            groups.append(current)
+        current.append(v)
+    return groups
+
+
+def merge_group_snippets(groups: list, group_snippets: list):
+    """
+    Merge the snippet dicts produced by each group.
+
+    Conflicts are resolved per base line number, so a line and the `a`, `b`, ...
+    lines inserted after it always come from the same group: the group with a
+    violation closest to that line wins, ties go to the lowest group index.
+    Returns (merged_snippets, conflicts).
+    """
+    # base line -> group index -> keys of that group for this base line
+    claims = defaultdict(dict)
+    for index, snippets in enumerate(group_snippets):
+        for lineno in snippets:
+            claims[base_line_number(lineno)].setdefault(index, []).append(lineno)
+
+    group_lines = [
+        [line for line in (violation_line(v) for v in group) if line is not None]
+        for group in groups
+    ]
+
+    def distance(index: int, base: int) -> int:
+        lines = group_lines[index]
+        return min(abs(line - base) for line in lines) if lines else float('inf')
+
+    merged = {}
+    conflicts = []
+    for base in sorted(claims):
+        candidates = claims[base]
+        winner = min(candidates, key=lambda index: (distance(index, base), index))
+        if len(candidates) > 1:
+            conflicts.append({
+                'line': base,
+                'groups': sorted(candidates),
+                'winner': winner
+            })
+        for lineno in candidates[winner]:
+            merged[lineno] = group_snippets[winner][lineno]
+
+    return merged, conflicts
+
+
+def fix_violation_group(settings: dict, numbered_content: str, violations_text: str,
+                        partial: bool = False, make_chat=None, validator=None, violation_lines=(),
+                        **limits) -> dict:
+    """
+    Fix one group on its own chat session: send the file (or its scope excerpt
+    when `partial`), send the group's violations and follow continuations.
+    `make_chat(settings)` builds the session (a plain start_chat by default).
+    With a SnippetValidator, invalid line keys are asked for again on the same
+    session before the snippets are returned. Blocking; run it on the LLM executor.
+    """
+    if make_chat is not None:
+        chat = MeteredChat(make_chat(settings))
+    else:
+        chat = MeteredChat(start_chat(
+            model_name=settings['model_name'],
+            temperature=settings['temperature'],
+            top_p=settings['top_p'],
+            max_tokens=settings['max_tokens'],
+            safety_settings=settings['safety_settings']
+        ))
+    if send_file_intro(chat, numbered_content, partial=partial) is None:
+        return {'responses': [], 'snippets': {}, 'turns': 0, 'tokens': 0,
+                'complete': False, 'stopReason': 'blocked', 'usage': chat.usage}
+    result = send_with_continuations(chat, send_misra_violations, violations_text, **limits)
+    if validator is not None and result['responses']:
+        result['snippets'], result['validation'] = validator.repair(chat, result['snippets'], violation_lines)
+    result['usage'] = chat.usage
+    return result
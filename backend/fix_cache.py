@@ -0,0 +1,196 @@
+# fix_cache.py
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from scope_index import ScopeIndex, NUMBERED_LINE_RE
+from fanout import violation_line, base_line_number
+
+# Lines around a violation hashed into its key when it is not inside a scope
+CONTEXT_RADIUS = 5
+DEFAULT_MAX_ENTRIES = 50000
+
+SETTINGS_KEYS = ("model_name", "temperature", "top_p", "max_tokens", "safety_settings")
+
+
+class FixCache:
+    """
+    Persistent SQLite cache of per-violation fixes with LRU eviction.
+    Values are snippet dicts whose keys are relative to the violation line
+    (`+0`, `+1a`, `-2`), so a hit can be replayed at a shifted position.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fixes ("
+            " key TEXT PRIMARY KEY,"
+            " snippets TEXT NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fixes_last_used ON fixes (last_used)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT snippets FROM fixes WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE fixes SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put_many(self, entries: dict):
+        """Store {key: relative_snippets} and evict least recently used entries over the cap"""
+        if not entries:
+            return
+        with self._lock:
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fixes (key, snippets, last_used) VALUES (?, ?, ?)",
+                [(key, json.dumps(snippets), now) for key, snippets in entries.items()]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM fixes WHERE key IN ("
+                    " SELECT key FROM fixes ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'maxEntries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM fixes")
+            self._conn.commit()
+
+
+def _context_text(scope_index: ScopeIndex, line: int):
+    """Unnumbered code the fix for `line` depends on, plus the line's offset in it"""
+    index = scope_index.index_of(line)
+    if index is None:
+        return None
+    scope = scope_index.scope_of(line)
+    if scope is not None:
+        start, end = scope['start'], scope['end']
+    else:
+        start = max(0, index - CONTEXT_RADIUS)
+        end = min(len(scope_index.lines) - 1, index + CONTEXT_RADIUS)
+    code = []
+    for raw in scope_index.lines[start:end + 1]:
+        match = NUMBERED_LINE_RE.match(raw.rstrip("\n"))
+        code.append(match.group(2) if match else raw.rstrip("\n"))
+    return "\n".join(code), index - start, (scope_index.numbers[start], scope_index.numbers[end])
+
+
+def violation_cache_key(context: str, offset: int, violation: dict, settings: dict) -> str:
+    payload = json.dumps({
+        'context': context,
+        'offset': offset,
+        'rule': str(violation.get('misra')),
+        'message': str(violation.get('warning')),
+        'settings': {k: settings.get(k) for k in SETTINGS_KEYS},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _relative_key(lineno: str, line: int) -> str:
+    suffix = re.sub(r"^\d+", "", lineno)
+    return f"{base_line_number(lineno) - line:+d}{suffix}"
+
+
+def _absolute_key(relative: str, line: int) -> str:
+    match = re.match(r"^([+-]\d+)(.*)$", relative)
+    return f"{line + int(match.group(1))}{match.group(2)}"
+
+
+def plan_cached_fixes(cache: FixCache, numbered_content: str, violations: list, settings: dict) -> dict:
+    """
+    Look every violation up in the cache. Returns the snippets served from the
+    cache, the violations that still have to go to the model and what is needed
+    to store the model's answer for those misses afterwards.
+    """
+    scope_index = ScopeIndex.from_numbered_text(numbered_content)
+    snippets = {}
+    misses = []
+    pending = []
+    hits = 0
+
+    for v in violations:
+        line = violation_line(v)
+        context = _context_text(scope_index, line) if line is not None else None
+        if context is None:
+            misses.append(v)
+            continue
+        text, offset, bounds = context
+        key = violation_cache_key(text, offset, v, settings)
+        cached = cache.get(key)
+        if cached is None:
+            misses.append(v)
+            pending.append({'key': key, 'line': line, 'bounds': bounds})
+            continue
+        hits += 1
+        for relative, code in cached.items():
+            snippets[_absolute_key(relative, line)] = code
+
+    total = len(violations)
+    return {
+        'snippets': snippets,
+        'misses': misses,
+        'pending': pending,
+        'stats': {
+            'hits': hits,
+            'misses': len(misses),
+            'hitRate': hits / total if total else 0.0,
+        }
+    }
+
+
+def store_fixes(cache: FixCache, plan: dict, snippets: dict):
+    """
+    Attribute each returned snippet line to the nearest missed violation whose
+    context contains it and cache the per-violation fixes.
+    """
+    pending = plan['pending']
+    if not pending or not snippets:
+        return
+    attributed = {i: {} for i in range(len(pending))}
+    for lineno, code in snippets.items():
+        base = base_line_number(lineno)
+        candidates = [i for i, p in enumerate(pending) if p['bounds'][0] <= base <= p['bounds'][1]]
+        if not candidates:
+            continue
+        nearest = min(abs(pending[i]['line'] - base) for i in candidates)
+        # Violations on the same line share the fix
+        for i in candidates:
+            if abs(pending[i]['line'] - base) == nearest:
+                attributed[i][_relative_key(lineno, pending[i]['line'])] = code
+    cache.put_many({pending[i]['key']: fixes for i, fixes in attributed.items() if fixes})
+
+
+def open_fix_cache(folder: str) -> FixCache:
+    max_entries = int(os.environ.get('FIX_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    return FixCache(os.path.join(folder, 'fix_cache.sqlite'), max_entries=max_entries)
@@ -2,30 +2,101 @@
 import re
 import json
 
+from instrumentation import get_logger, is_verbose, span
+
+logger = get_logger("snippets")
+
+SNIPPET_LINE_RE = re.compile(r"^(\d+[a-zA-Z]*):(.*)$")
+FENCE_OPEN_RE = re.compile(r"```(?:cpp|c\+\+)?\s*$")
+
 def extract_snippets_from_response(response_text):
     """
     Parses Gemini-style C++ response text and extracts line-numbered code,
     preserving backslashes and formatting. Returns a dictionary.
     """
-    # Match all ```cpp ... ``` blocks (non-greedy)
-    code_blocks = re.findall(r"```(?:cpp|c\+\+)?\s*\n(.*?)```", response_text, re.DOTALL)
-    
-    all_lines = {}
-
-    for block in code_blocks:
-        lines = block.strip().splitlines()
-        for line in lines:
-            match = re.match(r"^(\d+[a-zA-Z]*):(.*)$", line)
-            if match:
-                lineno = match.group(1).strip()
-                code = match.group(2).rstrip()  # Do NOT strip backslashes
-                all_lines[lineno] = code
-            else:
-                print(f"⚠️ Skipping: {line}")
-    
-    return all_lines
+    with span("snippet_extraction"):
+        # Match all ```cpp ... ``` blocks (non-greedy)
+        code_blocks = re.findall(r"```(?:cpp|c\+\+)?\s*\n(.*?)```", response_text, re.DOTALL)
+        
+        all_lines = {}
+        verbose = is_verbose()
+
+        for block in code_blocks:
+            lines = block.strip().splitlines()
+            for line in lines:
+                match = SNIPPET_LINE_RE.match(line)
+                if match:
+                    lineno = match.group(1).strip()
+                    code = match.group(2).rstrip()  # Do NOT strip backslashes
+                    all_lines[lineno] = code
+                elif verbose:
+                    logger.debug("Skipping: %s", line)
+        
+        return all_lines
 
 
 def save_snippets_to_json(snippets, filepath="temp_snippets.json"):
     with open(filepath, "w") as f:
-        json.dump(snippets, f, indent=2)
\ No newline at end of file
+        json.dump(snippets, f, indent=2)
+
+
+class SnippetStreamParser:
+    """
+    Incremental counterpart of extract_snippets_from_response for streamed responses.
+    Feed text chunks as they arrive; every completed `NNN[a-z]:` line inside a
+    ```cpp block is returned as soon as its newline has been received.
+    """
+
+    def __init__(self):
+        self.snippets = {}
+        self.blocks_closed = 0
+        self._buffer = ""
+        self._in_block = False
+        self._first_line = False
+
+    def feed(self, chunk: str) -> list:
+        """Consume a chunk and return the (lineno, code) pairs completed by it."""
+        self._buffer += chunk
+        completed = []
+        while True:
+            newline = self._buffer.find("\n")
+            if newline < 0:
+                break
+            line = self._buffer[:newline]
+            self._buffer = self._buffer[newline + 1:]
+            self._consume_line(line, completed)
+        return completed
+
+    def close(self) -> list:
+        """Flush a trailing line that was not terminated by a newline."""
+        completed = []
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            self._consume_line(line, completed)
+        return completed
+
+    def _consume_line(self, line: str, completed: list):
+        if not self._in_block:
+            fence = line.find("```")
+            if fence >= 0 and FENCE_OPEN_RE.match(line[fence:]):
+                self._in_block = True
+                self._first_line = True
+            return
+
+        fence = line.find("```")
+        if fence >= 0:
+            line = line[:fence]
+        if self._first_line:
+            # Mirrors block.strip() in the non-streaming parser
+            line = line.lstrip()
+            self._first_line = not line
+        if line.strip():
+            match = SNIPPET_LINE_RE.match(line)
+            if match:
+                lineno = match.group(1).strip()
+                code = match.group(2).rstrip()
+                self.snippets[lineno] = code
+                completed.append((lineno, code))
+        if fence >= 0:
+            self._in_block = False
+            self.blocks_closed += 1
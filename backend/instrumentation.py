@@ -0,0 +1,217 @@
+# instrumentation.py
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LOGGER_NAME = "misra"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (last is +Inf), sum, count]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+
+class Gauge:
+    """Read when scraped: `read()` returns a number or {label value: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read, label: str = None):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.label = label
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, dict):
+            for label_value, number in sorted(value.items(), key=lambda item: str(item[0])):
+                yield f"{self.name}{_format_labels(((self.label, str(label_value)),))} {_format_value(number)}"
+        elif value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name: str, documentation: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str = "") -> Counter:
+        return self._get(Counter, name, documentation)
+
+    def histogram(self, name: str, documentation: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def gauge(self, name: str, read, documentation: str = "", label: str = None) -> Gauge:
+        """(Re)register a gauge read from `read` at scrape time"""
+        with self._lock:
+            metric = self._metrics[name] = Gauge(name, documentation, read, label)
+            return metric
+
+    def inc(self, name: str, amount: float = 1, documentation: str = "", **labels):
+        counter = self.counter(name, documentation)
+        with self._lock:
+            counter.inc(amount, **labels)
+
+    def observe(self, name: str, value: float, documentation: str = "", **labels):
+        histogram = self.histogram(name, documentation)
+        with self._lock:
+            histogram.observe(value, **labels)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+            out = []
+            for metric in metrics:
+                try:
+                    samples = list(metric.samples())
+                except Exception as e:
+                    get_logger().warning("Metric %s could not be read: %s", metric.name, e)
+                    continue
+                if metric.documentation:
+                    out.append(f"# HELP {metric.name} {metric.documentation}")
+                out.append(f"# TYPE {metric.name} {metric.kind}")
+                out.extend(samples)
+        return "\n".join(out) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """
+    Time a pipeline stage into misra_stage_duration_seconds{stage=...};
+    failures also count in misra_stage_errors_total.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc("misra_stage_errors_total", documentation="Pipeline stages that raised", stage=stage, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("misra_stage_duration_seconds", elapsed,
+                        documentation="Duration of pipeline stages", stage=stage, **labels)
+        logger = get_logger()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s took %.1f ms", stage, elapsed * 1000)
+
+
+def record_tokens(prompt_tokens: int, output_tokens: int, model: str = None):
+    labels = {'model': model} if model else {}
+    if prompt_tokens:
+        metrics.inc("misra_llm_tokens_total", prompt_tokens, documentation="Tokens reported by the model",
+                    type="prompt", **labels)
+    if output_tokens:
+        metrics.inc("misra_llm_tokens_total", output_tokens, documentation="Tokens reported by the model",
+                    type="output", **labels)
+
+
+# === Logging ===
+_logging_lock = threading.Lock()
+_logging_ready = False
+
+
+def get_logger(name: str = None) -> logging.Logger:
+    """
+    The app's logger (or a child of it). Quiet by default; set MISRA_LOG_LEVEL
+    (e.g. DEBUG) or call set_verbose() to see the pipeline's debug output.
+    """
+    global _logging_ready
+    logger = logging.getLogger(LOGGER_NAME)
+    if not _logging_ready:
+        with _logging_lock:
+            if not _logging_ready:
+                handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(os.environ.get('MISRA_LOG_LEVEL', 'INFO').upper())
+                logger.propagate = False
+                _logging_ready = True
+    return logger.getChild(name) if name else logger
+
+
+def set_verbose(verbose: bool):
+    get_logger().setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+def is_verbose() -> bool:
+    return get_logger().isEnabledFor(logging.DEBUG)
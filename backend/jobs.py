@@ -0,0 +1,261 @@
+# jobs.py
+import asyncio
+import copy
+import itertools
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+MAX_FINISHED_JOBS = 1000
+
+
+class JobCancelled(Exception):
+    """Raised from progress callbacks to stop a job between LLM turns"""
+
+
+class Job:
+    """One submitted operation: its status, per-stage timings, partial and final results."""
+
+    def __init__(self, kind: str, params: dict, priority: int = 0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = []
+        self.partial = {}
+        # `partial` is updated from LLM executor threads while status polls read it on the loop
+        self._partial_lock = threading.Lock()
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.task = None
+        # Set by a scheduler with a shared store: publish changes, read cancels from other workers
+        self.on_change = None
+        self.cancel_flag = None
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a named stage of the job"""
+        entry = {'name': name, 'status': "running", 'seconds': None}
+        self.stages.append(entry)
+        self.changed()
+        started = time.monotonic()
+        try:
+            yield entry
+            entry['status'] = "done"
+        except BaseException:
+            entry['status'] = "cancelled" if self.cancel_requested else "failed"
+            raise
+        finally:
+            entry['seconds'] = time.monotonic() - started
+            self.changed()
+
+    def add_partial(self, snippets: dict):
+        """Record one finished LLM batch and its snippets (safe from any thread)"""
+        with self._partial_lock:
+            self.partial['batches'] = self.partial.get('batches', 0) + 1
+            self.partial.setdefault('snippets', {}).update(snippets)
+        self.changed()
+
+    def check_cancelled(self):
+        if not self.cancel_requested and self.cancel_flag is not None and self.cancel_flag():
+            # Cancelled through another worker
+            self.cancel_requested = True
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        with self._partial_lock:
+            partial = copy.deepcopy(self.partial)
+        return {
+            'jobId': self.id,
+            'kind': self.kind,
+            'projectId': self.params.get('projectId'),
+            'priority': self.priority,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'stages': [dict(stage) for stage in self.stages],
+            'partial': partial,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobScheduler:
+    """
+    Runs submitted jobs on a fixed number of workers, highest priority first
+    (FIFO within a priority). Handlers are `async def handler(job) -> result`.
+    With a shared `store` (a session_store backend) every job's state is
+    published there, so any worker can report it, and a cancel received by
+    another worker stops the job at its next cancellation check.
+    """
+
+    NAMESPACE = "job"
+
+    def __init__(self, max_concurrent: int = 4, store=None):
+        self.max_concurrent = max_concurrent
+        self.store = store
+        self.jobs = {}
+        self._handlers = {}
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()
+
+    def register(self, kind: str, handler):
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self) -> list:
+        return sorted(self._handlers)
+
+    def start(self):
+        # Lazily bound to the running loop, like the LLM executor's semaphore
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+
+    async def shutdown(self):
+        for job in self.jobs.values():
+            if not job.finished:
+                self.cancel(job.id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, kind: str, params: dict, priority: int = 0) -> Job:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        job = Job(kind, params, priority)
+        self.jobs[job.id] = job
+        if self.store is not None:
+            self.store.put(self.NAMESPACE, job.id, job.to_dict())
+            job.on_change = self._publish
+            job.cancel_flag = lambda: self._cancel_flag(job.id)
+        self._queue.put_nowait((-priority, next(self._sequence), job.id))
+        self._prune()
+        return job
+
+    def _publish(self, job: Job):
+        # A merge keeps the cancelRequested flag other workers may have set
+        self.store.merge(self.NAMESPACE, job.id, job.to_dict())
+
+    def _cancel_flag(self, job_id: str) -> bool:
+        record = self.store.get(self.NAMESPACE, job_id)
+        return bool(record and record[0].get('cancelRequested'))
+
+    def get(self, job_id: str):
+        """The job's state from this worker, or as last published by the worker running it; None if unknown"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is None:
+            return None
+        record = self.store.get(self.NAMESPACE, job_id)
+        return record[0] if record is not None else None
+
+    def list(self, project_id: str = None) -> list:
+        """Jobs of every worker sharing the store (or of this one), optionally for one project"""
+        states = [job.to_dict() for job in self.jobs.values()]
+        if self.store is not None:
+            for job_id in self.store.keys(self.NAMESPACE):
+                if job_id not in self.jobs:
+                    record = self.store.get(self.NAMESPACE, job_id)
+                    if record is not None:
+                        states.append(record[0])
+        return [state for state in states if project_id is None or state.get('projectId') == project_id]
+
+    def cancel(self, job_id: str):
+        """Cancel a job; returns its state, None if unknown"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            state = self.get(job_id)
+            if state is not None and state['status'] not in ("succeeded", "failed", "cancelled"):
+                # Running on another worker: it picks the flag up at its next check
+                state = self.store.merge(self.NAMESPACE, job_id, {'cancelRequested': True})
+                state = state[0] if state is not None else None
+            return state
+        if job.finished:
+            return job.to_dict()
+        job.cancel_requested = True
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            job.changed()
+        elif job.task is not None:
+            job.task.cancel()
+        return job.to_dict()
+
+    def stats(self) -> dict:
+        counts = {state: 0 for state in JOB_STATES}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return {
+            'maxConcurrent': self.max_concurrent,
+            'queueDepth': self._queue.qsize() if self._queue is not None else 0,
+            'jobs': counts,
+        }
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        if len(finished) <= MAX_FINISHED_JOBS:
+            return
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:len(finished) - MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+            if self.store is not None:
+                self.store.delete(self.NAMESPACE, job.id)
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            try:
+                job.check_cancelled()
+            except JobCancelled:
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                job.changed()
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            job.changed()
+            job.task = asyncio.create_task(self._handlers[job.kind](job))
+            try:
+                job.result = await job.task
+                job.status = "succeeded"
+            except (asyncio.CancelledError, JobCancelled):
+                if not job.cancel_requested:
+                    # The worker itself is being cancelled (shutdown)
+                    job.status = "cancelled"
+                    job.finished_at = time.time()
+                    raise
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, 'detail', None) or str(e)
+            finally:
+                if job.finished_at is None:
+                    job.finished_at = time.time()
+                job.task = None
+                job.changed()
@@ -0,0 +1,223 @@
+# llm_executor.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+
+from instrumentation import get_logger
+
+logger = get_logger("executor")
+
+# How often a call waiting for another worker's project lease retries
+LEASE_POLL_SECONDS = 0.25
+
+
+class LLMExecutor:
+    """
+    Runs blocking Gemini calls on a managed thread pool so the event loop stays free.
+    At most `max_in_flight` calls run at once across all projects, and calls for the
+    same project are serialized so one chat session is never driven concurrently.
+    With `leases` (session_store.ProjectLeases) the serialization spans every
+    worker sharing the store: a call also holds the project's lease while it runs.
+    """
+
+    def __init__(self, max_in_flight: int = 8, leases=None):
+        self.max_in_flight = max_in_flight
+        self.leases = leases
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm")
+        self._slots = None
+        self._project_locks = {}
+        self._project_waiters = {}
+        # Projects marked busy for a whole multi-call operation (fan-out)
+        self._held = {}
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+
+    def _acquire_project(self, project_id: str) -> asyncio.Lock:
+        lock = self._project_locks.get(project_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._project_locks[project_id] = lock
+        self._project_waiters[project_id] = self._project_waiters.get(project_id, 0) + 1
+        return lock
+
+    def _release_project(self, project_id: str):
+        remaining = self._project_waiters.get(project_id, 1) - 1
+        if remaining <= 0:
+            # Drop idle locks so finished projects do not accumulate
+            self._project_waiters.pop(project_id, None)
+            self._project_locks.pop(project_id, None)
+        else:
+            self._project_waiters[project_id] = remaining
+
+    async def _renew(self, project_id: str):
+        while True:
+            await asyncio.sleep(self.leases.ttl / 3)
+            if not await asyncio.to_thread(self.leases.renew, project_id):
+                logger.warning("Lost the lease on %s to another worker", project_id)
+
+    @asynccontextmanager
+    async def _leased(self, project_id: str):
+        """Hold the project's cross-worker lease, renewed in the background, for the block"""
+        if self.leases is None:
+            yield
+            return
+        while not await asyncio.to_thread(self.leases.acquire, project_id):
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+        renewer = asyncio.ensure_future(self._renew(project_id))
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            await asyncio.to_thread(self.leases.release, project_id)
+
+    async def run(self, project_id: str, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the pool, serialized per project and bounded globally."""
+        loop = asyncio.get_running_loop()
+        lock = self._acquire_project(project_id)
+        queued_at = time.monotonic()
+        self._waiting += 1
+        waiting = True
+        try:
+            async with lock, self._leased(project_id):
+                async with self._semaphore():
+                    waited = time.monotonic() - queued_at
+                    self._waiting -= 1
+                    waiting = False
+                    self._total_wait_seconds += waited
+                    self._max_wait_seconds = max(self._max_wait_seconds, waited)
+                    self._in_flight += 1
+                    started_at = time.monotonic()
+                    future = loop.run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+                    try:
+                        result = await asyncio.shield(future)
+                    except asyncio.CancelledError:
+                        # The worker thread cannot be interrupted; keep the project locked
+                        # until it finishes so the chat is never driven concurrently.
+                        try:
+                            await future
+                        except Exception:
+                            pass
+                        raise
+                    except Exception:
+                        self._failed += 1
+                        raise
+                    else:
+                        self._completed += 1
+                        return result
+                    finally:
+                        self._in_flight -= 1
+                        self._total_run_seconds += time.monotonic() - started_at
+        finally:
+            if waiting:
+                self._waiting -= 1
+            self._release_project(project_id)
+
+    async def stream(self, project_id: str, fn, *args, **kwargs):
+        """
+        Iterate the blocking generator `fn(*args, **kwargs)` on the pool and yield its
+        items as they are produced. The project stays locked until the generator is
+        exhausted or the consumer stops reading.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        finished = object()
+
+        def pump():
+            iterator = fn(*args, **kwargs)
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                # Run the generator's cleanup here, while the project is still locked
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        task = asyncio.ensure_future(self.run(project_id, pump))
+        getter = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done and (task.cancelled() or task.exception() is not None):
+                    # The call was cancelled or failed before queueing anything else; surface that
+                    getter.cancel()
+                    task.result()
+                # Items are queued before the call completes, so this never blocks for long
+                item = await getter
+                if item is finished:
+                    break
+                yield item
+            await task
+        finally:
+            stop.set()
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not task.done():
+                # The consumer stopped reading: a queued call is dropped, a running one
+                # ends at its next item and the project is released once its thread returns
+                task.cancel()
+                await asyncio.wait({task})
+            if not task.cancelled():
+                task.exception()
+
+    @contextmanager
+    def hold(self, project_id: str):
+        """Keep `project_id` busy for the whole block, also between the calls made under sub-keys"""
+        self._held[project_id] = self._held.get(project_id, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._held[project_id] - 1
+            if remaining:
+                self._held[project_id] = remaining
+            else:
+                del self._held[project_id]
+
+    def is_busy(self, project_id: str) -> bool:
+        """True while a call for the project, or one of its `project#...` sub-keys (fan-out groups), is running or queued"""
+        if project_id in self._project_locks or project_id in self._held:
+            return True
+        prefix = project_id + "#"
+        if any(key.startswith(prefix) for key in list(self._project_locks)):
+            return True
+        # Calls running on other workers
+        return self.leases is not None and self.leases.held(project_id)
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and call counters."""
+        finished = self._completed + self._failed
+        return {
+            'maxInFlight': self.max_in_flight,
+            'inFlight': self._in_flight,
+            'queued': self._waiting,
+            'activeProjects': len(self._project_locks),
+            'projectQueueDepths': {
+                project_id: count for project_id, count in self._project_waiters.items()
+            },
+            'completed': self._completed,
+            'failed': self._failed,
+            'avgWaitSeconds': self._total_wait_seconds / finished if finished else 0.0,
+            'maxWaitSeconds': self._max_wait_seconds,
+            'avgRunSeconds': self._total_run_seconds / finished if finished else 0.0,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
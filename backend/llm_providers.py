@@ -0,0 +1,351 @@
+# llm_providers.py
+import os
+import re
+import random
+import threading
+import time
+
+from instrumentation import get_logger
+from model_registry import ModelRegistry, DEFAULT_CACHED_MODELS
+
+logger = get_logger("llm")
+
+# Numbered code lines, as add_line_numbers writes them and the model answers them
+NUMBERED_LINE_RE = re.compile(r"^(\d+[a-zA-Z]*):(.*)$", re.MULTILINE)
+VIOLATION_RE = re.compile(r"^Line:\s*(\d+)\s*\nRule:\s*(.*)$", re.MULTILINE)
+# Compact encoding (violation_clustering): a `Rule:` row followed by `Lines: 12, 14, ...` rows
+RULE_RE = re.compile(r"^Rule:\s*(.*)$")
+LINES_RE = re.compile(r"^Lines:\s*([\d,\s]+)$")
+# Same strings as misra_chat_client/continuation use
+INTRO_ACK = "FILE RECEIVED. READY FOR VIOLATIONS."
+VIOLATIONS_HEADER = "Here is the list of violations to fix"
+CONTINUE_COMMAND = "next"
+CONTINUATION_MARKER = "--- CONTINUED ---"
+
+DEFAULT_VERTEX_PROJECT = "rock-range-464908-g5"
+DEFAULT_VERTEX_LOCATION = "global"
+
+
+def _cached_models() -> int:
+    return int(os.environ.get('MODEL_CACHE_SIZE', DEFAULT_CACHED_MODELS))
+
+
+class VertexProvider:
+    """Gemini on Vertex AI. vertexai is imported and initialised on first use."""
+
+    name = "vertex"
+
+    def __init__(self, project: str = None, location: str = None):
+        self.project = project or os.environ.get('VERTEX_PROJECT') or os.environ.get('GOOGLE_CLOUD_PROJECT') or DEFAULT_VERTEX_PROJECT
+        self.location = location or os.environ.get('VERTEX_LOCATION', DEFAULT_VERTEX_LOCATION)
+        self._initialized = False
+        self._lock = threading.Lock()
+        self.models = ModelRegistry(self._build_model, _cached_models())
+
+    def init(self):
+        with self._lock:
+            if self._initialized:
+                return
+            import vertexai
+            vertexai.init(project=self.project, location=self.location)
+            self._initialized = True
+
+    def prewarm(self, profiles: list) -> list:
+        """Import and initialise vertexai and build the models for `profiles` ahead of the first prompt"""
+        self.init()
+        return self.models.prewarm(profiles)
+
+    def _build_model(self, model_name, temperature, top_p, max_tokens, safety_settings):
+        self.init()
+        from vertexai.generative_models import (
+            GenerativeModel, GenerationConfig, SafetySetting, HarmCategory, HarmBlockThreshold
+        )
+
+        # Setup generation config with provided settings
+        generation_config = GenerationConfig(
+            temperature=temperature,
+            top_p=top_p,
+            max_output_tokens=max_tokens,
+            seed=15,
+        )
+
+        # Default filtering when safety settings are on, none otherwise (original behavior)
+        threshold = HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE if safety_settings else HarmBlockThreshold.BLOCK_NONE
+        safety_config = [
+            SafetySetting(category=category, threshold=threshold)
+            for category in (
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                HarmCategory.HARM_CATEGORY_HARASSMENT,
+            )
+        ]
+
+        # Initialize model with configs
+        model = GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_config,
+        )
+        logger.debug("Built %s model", model_name)
+        return model
+
+    def start_chat(self, model_name, temperature, top_p, max_tokens, safety_settings, history=None):
+        model = self.models.get({
+            'model_name': model_name, 'temperature': temperature, 'top_p': top_p,
+            'max_tokens': max_tokens, 'safety_settings': safety_settings,
+        })
+        logger.debug("Starting %s chat", model_name)
+
+        # Resume a stored conversation ([{'role', 'text'}], see export_chat_history)
+        if history:
+            from vertexai.generative_models import Content, Part
+            return model.start_chat(history=[
+                Content(role=turn['role'], parts=[Part.from_text(turn['text'])]) for turn in history
+            ])
+        return model.start_chat()
+
+
+# === Offline fake ===
+
+class ServiceUnavailable(Exception):
+    """Injected transient failure; the name matches what resilience retries"""
+
+    code = 503
+
+
+class _Part:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Content:
+    def __init__(self, role: str, text: str):
+        self.role = role
+        self.parts = [_Part(text)]
+
+
+class _UsageMetadata:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int = 0, output_tokens: int = 0):
+        self.text = text
+        self.usage_metadata = _UsageMetadata(prompt_tokens, output_tokens)
+
+
+def _tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _violation_rules(violations_text: str) -> dict:
+    """{line: [rules]} from either violations encoding"""
+    rules = {}
+    for match in VIOLATION_RE.finditer(violations_text):
+        rules.setdefault(int(match.group(1)), []).append(match.group(2).strip())
+    rule = None
+    for row in violations_text.splitlines():
+        row = row.strip()
+        match = RULE_RE.match(row)
+        if match:
+            rule = match.group(1).strip()
+            continue
+        match = LINES_RE.match(row)
+        if match and rule is not None:
+            for number in match.group(1).split(','):
+                if number.strip():
+                    rules.setdefault(int(number), []).append(rule)
+    return rules
+
+
+class FakeChat:
+    """
+    Deterministic stand-in for a Gemini chat. Everything it answers is
+    derived from the history, so a chat rebuilt from a stored history
+    continues exactly where the original left off:
+    the file intro is acknowledged, a violations prompt is answered with one
+    numbered snippet per violated line (plus context lines), paged with
+    `--- CONTINUED ---`, and "next" returns the following page.
+    """
+
+    def __init__(self, provider: "FakeProvider", model_name: str, history: list = None):
+        self.provider = provider
+        self.model_name = model_name
+        self.turns = list(history or [])
+
+    @property
+    def history(self) -> list:
+        return [_Content(turn['role'], turn['text']) for turn in self.turns]
+
+    def _file_lines(self) -> dict:
+        lines = {}
+        for turn in self.turns:
+            if turn['role'] == 'user' and VIOLATIONS_HEADER not in turn['text']:
+                for match in NUMBERED_LINE_RE.finditer(turn['text']):
+                    lines[match.group(1)] = match.group(2)
+        return lines
+
+    def _fix_page(self, violations_text: str, page: int) -> str:
+        lines = self._file_lines()
+        rules = _violation_rules(violations_text)
+        numbers = sorted(rules)
+        per_page = self.provider.snippets_per_turn
+        chunk = numbers[page * per_page:(page + 1) * per_page]
+        if not chunk:
+            return "All requested fixed snippets have been provided."
+
+        context = self.provider.context_lines
+        out = ["```cpp"]
+        emitted = set()
+        for number in chunk:
+            for lineno in range(number - context, number + context + 1):
+                key = str(lineno)
+                if key not in lines or lineno in emitted:
+                    continue
+                emitted.add(lineno)
+                content = lines[key]
+                if lineno in rules:
+                    content = f"{content.rstrip()} /* MISRA {', '.join(rules[lineno])} */"
+                out.append(f"{key}:{content}")
+        out.append("```")
+        if (page + 1) * per_page < len(numbers):
+            out.append(CONTINUATION_MARKER)
+        return "\n".join(out)
+
+    def _reply(self, message: str) -> str:
+        if message.strip() == CONTINUE_COMMAND:
+            # Page = number of "next" turns since the last violations prompt
+            page = 0
+            for turn in reversed(self.turns):
+                if turn['role'] != 'user':
+                    continue
+                if VIOLATIONS_HEADER in turn['text']:
+                    return self._fix_page(turn['text'], page + 1)
+                if turn['text'].strip() == CONTINUE_COMMAND:
+                    page += 1
+            return "There is nothing to continue."
+        if VIOLATIONS_HEADER in message:
+            return self._fix_page(message, 0)
+        if NUMBERED_LINE_RE.search(message):
+            return INTRO_ACK
+        return f"[{self.model_name}] {message[:200]}"
+
+    def send_message(self, message: str, stream: bool = False, **kwargs):
+        provider = self.provider
+        provider.maybe_fail()
+        text = self._reply(message)
+        prompt_tokens = _tokens(message) + sum(_tokens(turn['text']) for turn in self.turns)
+        output_tokens = _tokens(text)
+        if stream:
+            return self._stream(message, text, prompt_tokens, output_tokens)
+        time.sleep(provider.latency + provider.token_latency * output_tokens)
+        self.turns += [{'role': 'user', 'text': message}, {'role': 'model', 'text': text}]
+        return FakeResponse(text, prompt_tokens, output_tokens)
+
+    def _stream(self, message: str, text: str, prompt_tokens: int, output_tokens: int):
+        provider = self.provider
+        time.sleep(provider.latency)
+        size = provider.chunk_chars
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        for index, piece in enumerate(pieces):
+            time.sleep(provider.token_latency * _tokens(piece))
+            last = index == len(pieces) - 1
+            yield FakeResponse(piece, prompt_tokens if last else 0, output_tokens if last else 0)
+        self.turns += [{'role': 'user', 'text': message}, {'role': 'model', 'text': text}]
+
+
+class FakeModel:
+    def __init__(self, provider: "FakeProvider", model_name: str):
+        self.provider = provider
+        self.model_name = model_name
+
+    def start_chat(self, history: list = None) -> FakeChat:
+        return FakeChat(self.provider, self.model_name, history)
+
+
+class FakeProvider:
+    """
+    Offline provider for load tests and benchmarks (MISRA_LLM_PROVIDER=fake).
+    `latency` is paid once per call, `token_latency` per output token;
+    `failure_rate` injects ServiceUnavailable errors.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.05, token_latency: float = 0.0, snippets_per_turn: int = 20,
+                 context_lines: int = 1, chunk_chars: int = 256, failure_rate: float = 0.0, seed: int = 15):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.snippets_per_turn = max(1, snippets_per_turn)
+        self.context_lines = context_lines
+        self.chunk_chars = max(1, chunk_chars)
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = ModelRegistry(
+            lambda model_name, **settings: FakeModel(self, model_name), _cached_models()
+        )
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        return cls(
+            latency=float(os.environ.get('FAKE_LLM_LATENCY', '0.05')),
+            token_latency=float(os.environ.get('FAKE_LLM_TOKEN_LATENCY', '0')),
+            snippets_per_turn=int(os.environ.get('FAKE_LLM_SNIPPETS_PER_TURN', '20')),
+            context_lines=int(os.environ.get('FAKE_LLM_CONTEXT_LINES', '1')),
+            failure_rate=float(os.environ.get('FAKE_LLM_FAILURE_RATE', '0')),
+            seed=int(os.environ.get('FAKE_LLM_SEED', '15')),
+        )
+
+    def init(self):
+        pass
+
+    def prewarm(self, profiles: list) -> list:
+        return self.models.prewarm(profiles)
+
+    def maybe_fail(self):
+        if self.failure_rate <= 0:
+            return
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise ServiceUnavailable("Injected fake provider failure")
+
+    def start_chat(self, model_name, temperature, top_p, max_tokens, safety_settings, history=None):
+        model = self.models.get({
+            'model_name': model_name, 'temperature': temperature, 'top_p': top_p,
+            'max_tokens': max_tokens, 'safety_settings': safety_settings,
+        })
+        return model.start_chat(history)
+
+
+PROVIDERS = {
+    "vertex": VertexProvider,
+    "fake": FakeProvider.from_env,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """The provider chosen by MISRA_LLM_PROVIDER (vertex by default), created once"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            name = os.environ.get('MISRA_LLM_PROVIDER', 'vertex').lower()
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown MISRA_LLM_PROVIDER {name!r}; expected one of {sorted(PROVIDERS)}")
+            _provider = PROVIDERS[name]()
+        return _provider
+
+
+def set_provider(provider):
+    """Swap the provider in-process (benchmarks, scripted runs)"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
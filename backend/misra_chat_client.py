@@ -1,13 +1,20 @@
 # misra_chat_client.py
-import vertexai
-from vertexai.generative_models import GenerativeModel, ChatSession, GenerationConfig, SafetySetting, HarmCategory, HarmBlockThreshold
-
-# === Step 0: Init Vertex AI ===
-def init_vertex_ai():
-    vertexai.init(
-        project="rock-range-464908-g5",
-        location="global"
-    )
+from llm_providers import get_provider
+from instrumentation import get_logger
+
+logger = get_logger("chat")
+
+# === Step 0: Init the LLM provider (MISRA_LLM_PROVIDER=vertex|fake) ===
+def init_llm_provider():
+    get_provider().init()
+
+def prewarm_models(profiles: list) -> list:
+    """Set up the provider and the model objects for these settings profiles ahead of use"""
+    return get_provider().prewarm(profiles)
+
+def model_registry_stats() -> dict:
+    provider = get_provider()
+    return {'provider': provider.name, **provider.models.stats()}
 
 # === Step 1: Load Numbered C++ File ===
 def load_cpp_file(file_path: str) -> str:
@@ -20,47 +27,29 @@ def start_chat(
     temperature=0.5,
     top_p=0.95,
     max_tokens=65535,
-    safety_settings=False
-) -> ChatSession:
-    # Setup generation config with provided settings
-    generation_config = GenerationConfig(
+    safety_settings=False,
+    history=None
+):
+    """A chat on the configured provider, resumed from `history` ([{'role', 'text'}]) if given"""
+    return get_provider().start_chat(
+        model_name=model_name,
         temperature=temperature,
         top_p=top_p,
-        max_output_tokens=max_tokens,
-        seed=15,
+        max_tokens=max_tokens,
+        safety_settings=safety_settings,
+        history=history
     )
 
-    # Setup safety settings based on user preference
-    if safety_settings:
-        # Enable default safety filtering
-        safety_config = [
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE),
-        ]
-    else:
-        # Disable safety filtering (original behavior)
-        safety_config = [
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-        ]
-
-    # Initialize model with configs
-    model = GenerativeModel(
-        model_name=model_name,
-        generation_config=generation_config,
-        safety_settings=safety_config,
-    )
-    print("************************")
-    print(model_name)
-
-    return model.start_chat()
+def export_chat_history(chat) -> list:
+    """Provider-neutral copy of the chat history that start_chat(history=...) can resume from"""
+    history = []
+    for content in getattr(chat, 'history', None) or []:
+        text = "".join(getattr(part, 'text', '') or '' for part in content.parts)
+        history.append({'role': content.role, 'text': text})
+    return history
 
 # === Step 3: Send first prompt with file ===
-def send_file_intro(chat: ChatSession, numbered_cpp: str):
+def send_file_intro(chat, numbered_cpp: str, partial: bool = False):
     intro_prompt = (
         "You are an expert C++ developer specializing in MISRA C++ compliance for AUTOSAR embedded systems. "
         "I am providing you with the complete content of a C++ source file. Each line of the file is prefixed with "
@@ -68,34 +57,57 @@ def send_file_intro(chat: ChatSession, numbered_cpp: str):
         "Do not start fixing anything yet. Just confirm its reception and readiness for the next input, by saying: "
         "'FILE RECEIVED. READY FOR VIOLATIONS.'"
     )
+    if partial:
+        intro_prompt = (
+            "You are an expert C++ developer specializing in MISRA C++ compliance for AUTOSAR embedded systems. "
+            "I am providing you with an excerpt of a C++ source file: its global declarations (includes, macros, types, "
+            "declarations) and only the functions and blocks that contain the violations you will be asked to fix. "
+            "Each line is prefixed with its original line number followed by a colon; gaps in the numbering are code "
+            "that was left out because it is not relevant. Always keep the original line numbers in your answers. "
+            "Please acknowledge that you have received and processed this excerpt. "
+            "Do not start fixing anything yet. Just confirm its reception and readiness for the next input, by saying: "
+            "'FILE RECEIVED. READY FOR VIOLATIONS.'"
+        )
 
     try:
         # Send system + file content
         #chat.send_message(intro_prompt)
         combined_message = intro_prompt + "\n\n" + numbered_cpp
         resp = chat.send_message(combined_message)
-        print("\n=== Gemini ===", flush=True)
         
         # Handle blocked responses
         if resp is None:
-            print("Response was blocked by safety filters")
+            logger.warning("File intro response was blocked by safety filters")
             return None
         
         # Check if response has text
         if hasattr(resp, 'text') and resp.text:
-            print(resp.text)
+            logger.debug("=== Gemini ===\n%s", resp.text)
             return resp.text
         else:
-            print("Response was empty or blocked")
+            logger.warning("File intro response was empty or blocked")
             return None
             
     except Exception as e:
-        print(f"Error in send_file_intro: {str(e)}")
+        logger.error("Error in send_file_intro: %s", e)
         return None
 
 # === Step 4: Send list of violations to fix ===
-def send_misra_violations(chat: ChatSession, violations_text: str) -> str:
-    second_prompt = (
+def format_violations_text(violations: list) -> str:
+    """Format violation dicts into the text block sent to Gemini"""
+    violations_text = []
+    for v in violations:
+        violations_text.append(
+            f"File: {v['file']}\n"
+            f"Path: {v['path']}\n"
+            f"Line: {v['line']}\n"
+            f"Rule: {v['misra']}\n"
+            f"Message: {v['warning']}\n"
+        )
+    return "\n".join(violations_text)
+
+def build_violations_prompt(violations_text: str) -> str:
+    return (
         """
             Thank you for confirming. The C++ file content you received previously is the current state of the file, which may have already undergone some fixes.
 
@@ -139,7 +151,56 @@ def send_misra_violations(chat: ChatSession, violations_text: str) -> str:
         + violations_text
     )
 
+def send_misra_violations(chat, violations_text: str) -> str:
+    second_prompt = build_violations_prompt(violations_text)
+
     resp = chat.send_message(second_prompt)
-    print("\n=== Gemini Fixes ===")
-    print(resp.text)
+    text = resp.text
+    logger.debug("=== Gemini Fixes ===\n%s", text)
+    return text
+
+
+# === Step 4a: Ask again for snippets that could not be applied ===
+def build_correction_prompt(issues_text: str) -> str:
+    return (
+        "Some lines of your previous answer could not be applied to the file:\n\n"
+        + issues_text
+        + "\n\nPlease resend corrected fixed snippets covering only these lines and the violations they belong to. "
+        "Use the original line numbers of the file; lines inserted after line N must be numbered Na, Nb, Nc, ... "
+        "without skipping letters. Keep the same ```cpp format and do not repeat snippets that were correct."
+    )
+
+def send_snippet_corrections(chat, issues_text: str) -> str:
+    resp = chat.send_message(build_correction_prompt(issues_text))
+    text = resp.text
+    logger.debug("=== Gemini Corrections ===\n%s", text)
+    return text
+
+
+# === Step 4b: Stream the fixes as they are generated ===
+def stream_message(chat, message: str):
+    """Yields response text chunks as Gemini produces them."""
+    for chunk in chat.send_message(message, stream=True):
+        # Blocked chunks raise ValueError on .text, let it propagate to the caller
+        text = chunk.text
+        if text:
+            yield text
+
+def stream_misra_violations(chat, violations_text: str):
+    yield from stream_message(chat, build_violations_prompt(violations_text))
+
+# === Step 5: Ask for the next batch after "--- CONTINUED ---" ===
+CONTINUE_COMMAND = "next"
+
+def send_continue(chat) -> str:
+    resp = chat.send_message(CONTINUE_COMMAND)
+    text = resp.text
+    logger.debug("=== Gemini Fixes (continued) ===\n%s", text)
+    return text
+
+# === Free-form chat follow-up ===
+def send_chat_message(chat, message: str):
+    resp = chat.send_message(message)
+    if resp is None:
+        return None
     return resp.text
@@ -0,0 +1,87 @@
+# model_registry.py
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import metrics, get_logger
+
+logger = get_logger("models")
+
+# The ModelSettings fields a model object is built from, in key order
+PROFILE_FIELDS = ('model_name', 'temperature', 'top_p', 'max_tokens', 'safety_settings')
+DEFAULT_CACHED_MODELS = 16
+
+
+def profile_key(settings: dict) -> tuple:
+    return tuple(settings.get(field) for field in PROFILE_FIELDS)
+
+
+class ModelRegistry:
+    """
+    Model objects memoized per settings profile, so generation config, safety
+    settings and the model itself are built once per profile instead of on
+    every chat. `build(**profile)` runs outside the registry lock, under a
+    per-profile lock, so concurrent first prompts never build the same model twice.
+    """
+
+    def __init__(self, build, max_entries: int = DEFAULT_CACHED_MODELS):
+        self._build = build
+        self.max_entries = max_entries
+        self._models = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+
+    def get(self, settings: dict):
+        key = profile_key(settings)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                model = self._models.get(key)
+                if model is not None:
+                    self.hits += 1
+                    return model
+            started = time.perf_counter()
+            model = self._build(**dict(zip(PROFILE_FIELDS, key)))
+            elapsed = time.perf_counter() - started
+            metrics.observe("misra_model_build_seconds", elapsed, documentation="Time to set up a model object")
+            with self._lock:
+                self.misses += 1
+                self.build_seconds += elapsed
+                self._building.pop(key, None)
+                self._models[key] = model
+                while len(self._models) > self.max_entries:
+                    self._models.popitem(last=False)
+            return model
+
+    def prewarm(self, profiles: list) -> list:
+        """Build every profile not built yet; returns the keys now ready"""
+        ready = []
+        for settings in profiles:
+            try:
+                self.get(settings)
+                ready.append(profile_key(settings))
+            except Exception as e:
+                logger.warning("Could not prewarm %s: %s", settings.get('model_name'), e)
+        return ready
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'profiles': [dict(zip(PROFILE_FIELDS, key)) for key in self._models],
+                'hits': self.hits,
+                'misses': self.misses,
+                'buildSeconds': self.build_seconds,
+            }
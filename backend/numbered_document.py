@@ -0,0 +1,287 @@
+# numbered_document.py
+import bisect
+import re
+import threading
+from collections import OrderedDict
+
+LINE_KEY_RE = re.compile(r"^(\d+)([a-zA-Z]*)$")
+# Same prefix remove_line_numbers strips: the numbering's "N:" plus one whitespace character
+CLEAN_PREFIX_RE = re.compile(r"^\s?")
+
+DEFAULT_CACHED_DOCUMENTS = 32
+
+
+def split_line_key(lineno: str):
+    """'123b' -> (123, 'b'), the order merge_fixed_snippets_into_file sorts keys in"""
+    match = LINE_KEY_RE.match(lineno)
+    if match is None:
+        raise ValueError(f"Invalid line key: {lineno!r}")
+    return int(match.group(1)), match.group(2)
+
+
+def clean_line(content: str) -> str:
+    """The source text of a numbered line's content, as remove_line_numbers writes it"""
+    text = CLEAN_PREFIX_RE.sub("", content, count=1)
+    return "" if text.strip() == "" else text
+
+
+class NumberedDocument:
+    """
+    A source file as a line table: the original lines are keys 1..n and
+    snippet overlays replace them or insert suffixed keys (`123a`, `123b`, ...)
+    in the same order merge_fixed_snippets_into_file produces. Keys outside
+    the base lines are kept in small sorted per-line lists, so adding one is
+    a binary search; rendering copies the untouched runs of base lines and
+    never re-sorts the file.
+    """
+
+    def __init__(self, source_lines: list):
+        # Content after "N:" exactly as add_line_numbers writes it
+        self.base = [f" {line}" for line in source_lines]
+        self.overlay = {}
+        self._suffixes = {}
+        self._outside = []
+        self._touched = []
+        # Rendered base lines, built on first use
+        self._numbered_base = None
+        self._clean_base = None
+        # Revision of the patch history the overlay reflects
+        self.revision = None
+
+    @classmethod
+    def from_source_text(cls, text: str) -> "NumberedDocument":
+        # Split on "\n" only, like iterating over the file in add_line_numbers
+        lines = text.split("\n")
+        if lines and lines[-1] == "":
+            lines.pop()
+        return cls(lines)
+
+    @classmethod
+    def from_file(cls, path: str) -> "NumberedDocument":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls([line.rstrip("\n") for line in f])
+
+    def __len__(self):
+        return len(self.base)
+
+    def size_chars(self) -> int:
+        """Characters held: base lines, overlay and the rendered base caches"""
+        base = sum(len(line) for line in self.base)
+        cached = (base if self._numbered_base is not None else 0) + (base if self._clean_base is not None else 0)
+        return base + cached + sum(len(content) for content in self.overlay.values())
+
+    def _index(self, lineno: str):
+        number, suffix = split_line_key(lineno)
+        position = bisect.bisect_left(self._touched, number)
+        if position == len(self._touched) or self._touched[position] != number:
+            self._touched.insert(position, number)
+        if suffix == "" and 1 <= number <= len(self.base):
+            return
+        suffixes = self._suffixes.get(number)
+        if suffixes is None:
+            suffixes = self._suffixes[number] = []
+            if not 1 <= number <= len(self.base):
+                bisect.insort(self._outside, number)
+        position = bisect.bisect_left(suffixes, suffix)
+        if position == len(suffixes) or suffixes[position] != suffix:
+            suffixes.insert(position, suffix)
+
+    def apply(self, snippets: dict):
+        """Lay `snippets` ({line key: content}) over the document, later calls winning"""
+        for lineno, content in snippets.items():
+            if lineno not in self.overlay:
+                self._index(lineno)
+            self.overlay[lineno] = content
+
+    def discard(self, lineno: str):
+        """Drop one key from the overlay; a base line falls back to its original content"""
+        if lineno not in self.overlay:
+            return
+        del self.overlay[lineno]
+        number, suffix = split_line_key(lineno)
+        in_base = 1 <= number <= len(self.base)
+        suffixes = self._suffixes.get(number)
+        if not (suffix == "" and in_base) and suffixes is not None:
+            position = bisect.bisect_left(suffixes, suffix)
+            if position < len(suffixes) and suffixes[position] == suffix:
+                del suffixes[position]
+            if not suffixes:
+                del self._suffixes[number]
+                if not in_base:
+                    self._outside.remove(number)
+        if number not in self._suffixes and not (in_base and str(number) in self.overlay):
+            position = bisect.bisect_left(self._touched, number)
+            if position < len(self._touched) and self._touched[position] == number:
+                del self._touched[position]
+
+    def update(self, changes: dict):
+        """Apply {line key: content, or None to drop the key}, touching only those keys"""
+        for lineno, content in changes.items():
+            if content is None:
+                self.discard(lineno)
+            else:
+                self.apply({lineno: content})
+
+    def with_overlay(self, snippets: dict) -> "NumberedDocument":
+        """Another view of the same base lines (sharing their rendered caches) with `snippets` laid over"""
+        view = NumberedDocument.__new__(NumberedDocument)
+        view.base = self.base
+        view._numbered_base = self._numbered_base
+        view._clean_base = self._clean_base
+        view.revision = None
+        view.set_overlay(snippets)
+        return view
+
+    def set_overlay(self, snippets: dict):
+        """Replace the whole overlay"""
+        self.overlay = {}
+        self._suffixes = {}
+        self._outside = []
+        self._touched = []
+        self.apply(snippets)
+
+    def get(self, lineno: str):
+        if lineno in self.overlay:
+            return self.overlay[lineno]
+        number, suffix = split_line_key(lineno)
+        if suffix == "" and 1 <= number <= len(self.base):
+            return self.base[number - 1]
+        return None
+
+    def _extra_keys(self, number: int):
+        return [f"{number}{suffix}" for suffix in self._suffixes.get(number, ())]
+
+    def keys(self):
+        """Every line key in document order"""
+        split = bisect.bisect_left(self._outside, 1)
+        for number in self._outside[:split]:
+            yield from self._extra_keys(number)
+        for number in range(1, len(self.base) + 1):
+            yield str(number)
+            if number in self._suffixes:
+                yield from self._extra_keys(number)
+        for number in self._outside[split:]:
+            yield from self._extra_keys(number)
+
+    def inserted_keys(self) -> list:
+        """(line number, keys placed after it) for every line with inserted keys, in document order"""
+        return [(number, self._extra_keys(number)) for number in self._touched if number in self._suffixes]
+
+    def items(self):
+        overlay = self.overlay
+        base = self.base
+        for lineno in self.keys():
+            if lineno in overlay:
+                yield lineno, overlay[lineno]
+            else:
+                yield lineno, base[int(lineno) - 1]
+
+    def _render_lines(self, base_view: list, convert) -> list:
+        """Untouched runs are sliced out of `base_view`; overlay lines go through `convert`"""
+        overlay = self.overlay
+        n = len(self.base)
+        out = []
+        position = 0
+        for number in self._touched:
+            if number > n and position < n:
+                out.extend(base_view[position:])
+                position = n
+            if 1 <= number <= n:
+                out.extend(base_view[position:number - 1])
+                lineno = str(number)
+                out.append(convert(lineno, overlay[lineno]) if lineno in overlay else base_view[number - 1])
+                position = number
+            for lineno in self._extra_keys(number):
+                out.append(convert(lineno, overlay[lineno]))
+        out.extend(base_view[position:])
+        return out
+
+    def numbered_lines(self) -> list:
+        if self._numbered_base is None:
+            self._numbered_base = [f"{i}:{content}" for i, content in enumerate(self.base, start=1)]
+        return self._render_lines(self._numbered_base, lambda lineno, content: f"{lineno}:{content}")
+
+    def clean_lines(self) -> list:
+        return self._render_lines(self.original_clean_lines(), lambda lineno, content: clean_line(content))
+
+    def original_clean_lines(self) -> list:
+        if self._clean_base is None:
+            self._clean_base = [clean_line(content) for content in self.base]
+        return self._clean_base
+
+    def render_numbered(self) -> str:
+        """The merged numbered file merge_fixed_snippets_into_file would write"""
+        lines = self.numbered_lines()
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def render_clean(self) -> str:
+        """The fixed source remove_line_numbers would write for the merged file"""
+        lines = self.clean_lines()
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def changed_regions(self):
+        """
+        The overlay's effect on the clean source, one region per touched base
+        line: {'start': 0-based index of the first original line replaced,
+        'old': original lines, 'new': fixed lines, 'keys': their line keys}.
+        Only the touched lines are visited.
+        """
+        clean_base = self.original_clean_lines()
+        n = len(self.base)
+        for number in self._touched:
+            keys = self._extra_keys(number)
+            if 1 <= number <= n:
+                keys.insert(0, str(number))
+                old = [clean_base[number - 1]]
+                start = number - 1
+            else:
+                old = []
+                start = 0 if number < 1 else n
+            new = [clean_line(self.overlay[lineno]) if lineno in self.overlay else clean_base[number - 1]
+                   for lineno in keys]
+            if old and new and old[0] == new[0]:
+                # Unchanged line followed by insertions
+                old, new, keys, start = [], new[1:], keys[1:], start + 1
+            if old != new:
+                yield {'start': start, 'old': old, 'new': new, 'keys': keys}
+
+
+class DocumentCache:
+    """In-process LRU of documents; a miss rebuilds the document with `loader()`."""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHED_DOCUMENTS):
+        self.max_entries = max_entries
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader) -> NumberedDocument:
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+        document = loader()
+        self.put(key, document)
+        return document
+
+    def put(self, key: str, document: NumberedDocument):
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_entries:
+                self._documents.popitem(last=False)
+
+    def peek(self, key: str):
+        """The cached document, without loading it on a miss"""
+        with self._lock:
+            return self._documents.get(key)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._documents.pop(key, None)
+
+    def sizes(self) -> dict:
+        """{key: characters held by the cached document}"""
+        with self._lock:
+            cached = list(self._documents.items())
+        return {key: document.size_chars() for key, document in cached}
@@ -0,0 +1,170 @@
+# patch_history.py
+import time
+
+MAX_CACHED_SNAPSHOTS = 8
+
+
+class PatchHistory:
+    """
+    A project's fixes as a stack of patch layers, one per LLM exchange.
+    The effective snippet overlay is every accepted layer merged bottom-up
+    (upper layers win). It is maintained incrementally: a change to one
+    layer only recomputes that layer's line keys and reports them as
+    {line key: new content, or None when the key drops out of the overlay}.
+    """
+
+    def __init__(self, layers: list = None, undone: list = None, revision: int = 0, next_id: int = 1):
+        self.layers = layers or []
+        self.undone = undone or []
+        self.revision = revision
+        self.next_id = next_id
+        self._effective = {}
+        self._snapshots = {}
+        self._recompute({lineno for layer in self.layers for lineno in layer['snippets']})
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PatchHistory":
+        return cls(
+            layers=data.get('layers', []),
+            undone=data.get('undone', []),
+            revision=data.get('revision', 0),
+            next_id=data.get('nextId', 1)
+        )
+
+    @classmethod
+    def from_snippets(cls, snippets: dict) -> "PatchHistory":
+        """History for snippets saved before layers existed: one layer holding all of them"""
+        history = cls()
+        if snippets:
+            history.push("imported", snippets)
+        return history
+
+    def to_dict(self) -> dict:
+        return {
+            'layers': self.layers,
+            'undone': self.undone,
+            'revision': self.revision,
+            'nextId': self.next_id,
+        }
+
+    def effective(self) -> dict:
+        return dict(self._effective)
+
+    def _position(self, layer_id: int) -> int:
+        for position, layer in enumerate(self.layers):
+            if layer['id'] == layer_id:
+                return position
+        raise KeyError(layer_id)
+
+    def layer(self, layer_id: int) -> dict:
+        return self.layers[self._position(layer_id)]
+
+    def _value_of(self, lineno: str):
+        for layer in reversed(self.layers):
+            if layer['accepted'] and lineno in layer['snippets']:
+                return layer['snippets'][lineno]
+        return None
+
+    def _recompute(self, keys) -> dict:
+        changes = {}
+        for lineno in keys:
+            value = self._value_of(lineno)
+            if value is None:
+                if lineno in self._effective:
+                    del self._effective[lineno]
+                    changes[lineno] = None
+            elif self._effective.get(lineno) != value:
+                self._effective[lineno] = value
+                changes[lineno] = value
+        return changes
+
+    def _changed(self, position: int, keys) -> dict:
+        """Bookkeeping after layer `position` changed: bump the revision, drop stale snapshots"""
+        self.revision += 1
+        for index in [index for index in self._snapshots if index >= position]:
+            del self._snapshots[index]
+        return self._recompute(keys)
+
+    def push(self, source: str, snippets: dict) -> tuple:
+        """Add a layer on top; returns (layer, changes). Clears the redo stack."""
+        layer = {
+            'id': self.next_id,
+            'source': source,
+            'createdAt': time.time(),
+            'accepted': True,
+            'snippets': dict(snippets),
+        }
+        self.next_id += 1
+        self.layers.append(layer)
+        self.undone = []
+        return layer, self._changed(len(self.layers) - 1, layer['snippets'])
+
+    def replace_snippets(self, layer_id: int, snippets: dict) -> dict:
+        """Swap a layer's snippets (e.g. while its response is still streaming)"""
+        position = self._position(layer_id)
+        layer = self.layers[position]
+        keys = set(layer['snippets']) | set(snippets)
+        layer['snippets'] = dict(snippets)
+        return self._changed(position, keys)
+
+    def set_accepted(self, layer_id: int, accepted: bool) -> dict:
+        position = self._position(layer_id)
+        layer = self.layers[position]
+        if layer['accepted'] == accepted:
+            return {}
+        layer['accepted'] = accepted
+        return self._changed(position, layer['snippets'])
+
+    def undo(self) -> dict:
+        """Remove the top layer (it can be redone until another layer is pushed)"""
+        if not self.layers:
+            return {}
+        layer = self.layers.pop()
+        self.undone.append(layer)
+        return self._changed(len(self.layers), layer['snippets'])
+
+    def redo(self) -> dict:
+        if not self.undone:
+            return {}
+        layer = self.undone.pop()
+        self.layers.append(layer)
+        return self._changed(len(self.layers) - 1, layer['snippets'])
+
+    def snapshot(self, layer_id: int) -> dict:
+        """
+        The overlay as of `layer_id`: every accepted layer up to and including it.
+        A rejected `layer_id` is left out like any other rejected layer.
+        Built from the nearest cached snapshot underneath, then cached itself.
+        """
+        position = self._position(layer_id)
+        if position in self._snapshots:
+            return dict(self._snapshots[position])
+        below = [index for index in self._snapshots if index < position]
+        start = max(below) if below else -1
+        overlay = dict(self._snapshots[start]) if start >= 0 else {}
+        for layer in self.layers[start + 1:position + 1]:
+            if layer['accepted']:
+                overlay.update(layer['snippets'])
+        self._snapshots[position] = overlay
+        while len(self._snapshots) > MAX_CACHED_SNAPSHOTS:
+            # Oldest first; the one just built is last
+            del self._snapshots[next(iter(self._snapshots))]
+        return dict(overlay)
+
+    def summary(self) -> dict:
+        return {
+            'revision': self.revision,
+            'layers': [
+                {
+                    'layerId': layer['id'],
+                    'source': layer['source'],
+                    'createdAt': layer['createdAt'],
+                    'accepted': layer['accepted'],
+                    'lines': len(layer['snippets']),
+                }
+                for layer in self.layers
+            ],
+            'canUndo': bool(self.layers),
+            'canRedo': bool(self.undone),
+            'effectiveLines': len(self._effective),
+        }
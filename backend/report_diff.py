@@ -0,0 +1,134 @@
+# report_diff.py
+from bisect import bisect_right
+
+from numbered_document import clean_line, split_line_key
+from fanout import violation_line
+
+DIFF_STATUSES = ("resolved", "persisting", "new", "moved")
+
+
+def normalize_code(content) -> str:
+    """Code of a line with the numbering space and whitespace differences removed"""
+    return " ".join(clean_line(content).split()) if content is not None else ""
+
+
+class LineShift:
+    """
+    Maps line positions in the fixed file back to the document's line keys.
+    Only the blocks of inserted keys (`123a`, `123b`, ...) are indexed, so
+    building it costs the number of insertions, not the size of the file.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.line_count = len(document)
+        self._starts = []
+        self._blocks = []
+        # Inserted lines up to and including each block
+        self._inserted = []
+        inserted = 0
+        for number, keys in document.inserted_keys():
+            # Keys after line `number` follow it; keys beyond the file follow its last line
+            start = min(number, self.line_count) + inserted + 1
+            self._starts.append(start)
+            self._blocks.append(keys)
+            inserted += len(keys)
+            self._inserted.append(inserted)
+
+    def key_at(self, position: int):
+        """Line key of the fixed file's line `position` (1-based), None past the end"""
+        if position is None or position < 1:
+            return None
+        index = bisect_right(self._starts, position) - 1
+        inserted = 0
+        if index >= 0:
+            offset = position - self._starts[index]
+            keys = self._blocks[index]
+            if offset < len(keys):
+                return keys[offset]
+            inserted = self._inserted[index]
+        number = position - inserted
+        return str(number) if 1 <= number <= self.line_count else None
+
+
+def _rule(violation: dict) -> str:
+    return str(violation.get('misra') or "").strip()
+
+
+def _join_key(violation: dict, code: str) -> tuple:
+    return (str(violation.get('file') or "").strip(), _rule(violation), code)
+
+
+def diff_violations(old: list, new: list, document) -> dict:
+    """
+    Hash-join the violations of the previous report (lines of the document's
+    original numbering) with a report taken on the fixed file (lines of the
+    fixed file) on (file, rule, normalized code line):
+    - persisting: still reported on the same line, once line shifts from
+      inserted lines are followed, or on the same line key after that line was edited;
+    - moved: the same code and rule, now on another line;
+    - new: no previous violation on that code or line;
+    - resolved: previous violations no longer reported.
+    Reported lines are translated back to the document's numbering (`line`;
+    `reportedLine` keeps the report's value) and each violation carries its
+    `lineKey` and `codeKey` for the next diff. `queue` holds the new and persisting ones.
+    """
+    shift = LineShift(document)
+
+    by_code = {}
+    by_key = {}
+    for index, violation in enumerate(old):
+        line = violation_line(violation)
+        code = violation.get('codeKey')
+        if code is None:
+            code = normalize_code(document.base[line - 1]) if line is not None and 1 <= line <= len(document) else ""
+        # join key -> previous line -> indexes into `old`
+        by_code.setdefault(_join_key(violation, code), {}).setdefault(line, []).append(index)
+        key = violation.get('lineKey') or (str(line) if line is not None else None)
+        if key is not None:
+            by_key.setdefault(_join_key(violation, key), []).append(index)
+
+    matched = set()
+    entries = []
+    unmatched = []
+    for violation in new:
+        reported = violation_line(violation)
+        key = shift.key_at(reported)
+        line = split_line_key(key)[0] if key is not None else reported
+        code = normalize_code(document.get(key)) if key is not None else ""
+        entry = dict(violation, line=line, reportedLine=reported, lineKey=key, codeKey=code, status="new")
+        entries.append(entry)
+
+        by_line = by_code.get(_join_key(violation, code))
+        if not by_line:
+            unmatched.append(entry)
+            continue
+        # Prefer the previous violation on the same line; any other match means the code moved
+        previous_line = line if line in by_line else next(iter(by_line))
+        indexes = by_line[previous_line]
+        matched.add(indexes.pop(0))
+        if not indexes:
+            del by_line[previous_line]
+        if previous_line == line:
+            entry['status'] = "persisting"
+        else:
+            entry['status'] = "moved"
+            entry['previousLine'] = previous_line
+
+    # A violation still reported on a line the fix rewrote persists under the new code
+    for entry in unmatched:
+        if entry['lineKey'] is None:
+            continue
+        for index in by_key.get(_join_key(entry, entry['lineKey']), ()):
+            if index not in matched:
+                matched.add(index)
+                entry['status'] = "persisting"
+                break
+
+    result = {status: [entry for entry in entries if entry['status'] == status] for status in DIFF_STATUSES}
+    result['resolved'] = [dict(violation, status="resolved") for index, violation in enumerate(old) if index not in matched]
+    result['queue'] = result['new'] + result['persisting']
+    result['current'] = result['new'] + result['persisting'] + result['moved']
+    result['counts'] = {status: len(result[status]) for status in DIFF_STATUSES}
+    result['counts']['queued'] = len(result['queue'])
+    return result
@@ -0,0 +1,159 @@
+# report_index.py
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+LINE_WARNING_RE = r"^\[Line (\d+)\]\s*(.+)"
+
+# Parsed reports kept in memory, most recently used last
+MAX_CACHED_REPORTS = int(os.environ.get('REPORT_INDEX_CACHE_SIZE', '8'))
+REPORT_INDEX_DIR = os.environ.get('REPORT_INDEX_DIR', os.path.join('uploads', 'report_index'))
+
+_indexes = OrderedDict()
+# Guards `_indexes` and `_building`; never held while a report is parsed
+_lock = threading.Lock()
+# content hash -> [lock, threads using it]: one parse per report, different reports in parallel
+_building = {}
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _clean(value, isna):
+    """NaN/NA -> None so the records are JSON safe"""
+    return None if isna(value) else value
+
+
+class ReportIndex:
+    """A MISRA report parsed once and grouped by `File` for fast per-file lookups."""
+
+    def __init__(self, content_hash: str, by_file: dict):
+        self.content_hash = content_hash
+        self.by_file = by_file
+
+    @classmethod
+    def from_dataframe(cls, df: "pd.DataFrame", content_hash: str = "") -> "ReportIndex":
+        # pandas is only imported when a report is actually parsed, keeping startup fast
+        import pandas as pd
+        # Vectorized "[Line N] warning" parsing; unparsable cells keep their text as the warning
+        raw = df['Line and Warning']
+        parsed = raw.astype(str).str.extract(LINE_WARNING_RE)
+        lines = pd.to_numeric(parsed[0], errors='coerce').astype('Int64')
+        warnings = parsed[1].where(parsed[1].notna(), raw)
+
+        frame = pd.DataFrame({
+            'file': df['File'],
+            'path': df['Path'],
+            'line': lines,
+            'warning': warnings,
+            'level': df['Level'],
+            'misra': df['Misra'],
+        })
+        records = [
+            {key: _clean(value, pd.isna) for key, value in record.items()}
+            for record in frame.astype(object).to_dict('records')
+        ]
+        for record in records:
+            if record['line'] is not None:
+                record['line'] = int(record['line'])
+
+        by_file = {}
+        for file_name, positions in frame.groupby('file', sort=False).indices.items():
+            by_file[file_name] = [records[i] for i in positions]
+        return cls(content_hash, by_file)
+
+    @classmethod
+    def from_excel(cls, excel_path: str, content_hash: str = "") -> "ReportIndex":
+        import pandas as pd
+        df = pd.read_excel(excel_path, engine="openpyxl", usecols="A:F")
+        return cls.from_dataframe(df, content_hash)
+
+    def violations_for(self, target_file: str) -> list:
+        # Copies, so callers can edit them without touching the cached index
+        return [dict(v) for v in self.by_file.get(target_file, [])]
+
+    def files(self) -> list:
+        return [
+            {'file': file_name, 'violations': len(violations)}
+            for file_name, violations in sorted(self.by_file.items(), key=lambda item: str(item[0]))
+        ]
+
+
+def _remember(content_hash: str, index: ReportIndex):
+    _indexes[content_hash] = index
+    _indexes.move_to_end(content_hash)
+    while len(_indexes) > MAX_CACHED_REPORTS:
+        _indexes.popitem(last=False)
+
+
+@contextmanager
+def _hash_lock(content_hash: str):
+    with _lock:
+        entry = _building.setdefault(content_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _building[content_hash]
+
+
+def _cached(content_hash: str):
+    with _lock:
+        index = _indexes.get(content_hash)
+        if index is not None:
+            _indexes.move_to_end(content_hash)
+        return index
+
+
+def discard_report_index(content_hash: str):
+    """Forget a report's index, in memory and on disk (its blob was deleted)"""
+    with _lock:
+        _indexes.pop(content_hash, None)
+        pickle_path = os.path.join(REPORT_INDEX_DIR, f"{content_hash}.pkl")
+        if os.path.exists(pickle_path):
+            os.remove(pickle_path)
+
+
+def get_report_index(excel_path: str, content_hash: str = None) -> ReportIndex:
+    """
+    Index of the report at `excel_path`, keyed by its content hash. Served from
+    memory, then from the on-disk pickle, and only parsed when neither has it.
+    """
+    content_hash = content_hash or file_sha256(excel_path)
+    index = _cached(content_hash)
+    if index is not None:
+        return index
+
+    with _hash_lock(content_hash):
+        # Built by another thread while this one waited
+        index = _cached(content_hash)
+        if index is not None:
+            return index
+
+        pickle_path = os.path.join(REPORT_INDEX_DIR, f"{content_hash}.pkl")
+        if os.path.exists(pickle_path):
+            with open(pickle_path, 'rb') as f:
+                index = pickle.load(f)
+        else:
+            index = ReportIndex.from_excel(excel_path, content_hash)
+            os.makedirs(REPORT_INDEX_DIR, exist_ok=True)
+            tmp_path = f"{pickle_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, pickle_path)
+
+        with _lock:
+            _remember(content_hash, index)
+        return index
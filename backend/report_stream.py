@@ -0,0 +1,165 @@
+# report_stream.py
+import csv
+import json
+import os
+import re
+from collections import Counter
+
+LINE_WARNING_RE = re.compile(r"^\[Line (\d+)\]\s*(.+)")
+SPACES_RE = re.compile(r"\s*")
+
+STREAMING_EXTENSIONS = ('.csv', '.json', '.jsonl')
+
+# xlsx reports above this size are streamed; smaller ones are loaded whole into a
+# DataFrame once per content hash (the report index), so their memory use is not flat
+STREAMING_THRESHOLD_BYTES = int(os.environ.get('REPORT_STREAMING_THRESHOLD', str(50 * 1024 * 1024)))
+
+JSON_CHUNK_SIZE = 64 * 1024
+# An array item still undecodable with this much text after its start is malformed, not cut off
+JSON_MAX_ITEM_CHARS = JSON_CHUNK_SIZE
+
+
+def _iter_xlsx_rows(path: str):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        # Same columns as usecols="A:F" in the DataFrame reader
+        columns = [str(name) if name is not None else "" for name in header[:6]]
+        for values in rows:
+            yield dict(zip(columns, values[:6]))
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(path: str):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            # Empty CSV cells mean "no value", like empty Excel cells
+            yield {key: (value if value != "" else None) for key, value in row.items()}
+
+
+def _iter_json_array(f):
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # Everything before `index` is consumed; the buffer is only trimmed when more is read
+    index = 0
+    started = False
+    while True:
+        index = SPACES_RE.match(buffer, index).end()
+        if index < len(buffer):
+            char = buffer[index]
+            if not started:
+                if char != "[":
+                    raise ValueError("Truncated or malformed JSON report")
+                index += 1
+                started = True
+                continue
+            if char == ",":
+                index += 1
+                continue
+            if char == "]":
+                return
+            try:
+                item, index = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError as e:
+                if len(buffer) - index > JSON_MAX_ITEM_CHARS:
+                    # Reading on would only pull the rest of the file into memory
+                    raise ValueError(f"Malformed JSON report: {e.msg}")
+            else:
+                yield item
+                continue
+
+        more = f.read(JSON_CHUNK_SIZE)
+        if not more:
+            # The closing "]" returns above, so the file ended early
+            raise ValueError("Truncated or malformed JSON report")
+        buffer = buffer[index:] + more
+        index = 0
+
+
+def _iter_json_rows(path: str):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == "[":
+            f.seek(0)
+            yield from _iter_json_array(f)
+            return
+        # JSON Lines: one record per line
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_report_rows(path: str):
+    """Raw report rows (dicts keyed by column name) for xlsx, CSV, JSON array or JSON Lines reports"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return _iter_csv_rows(path)
+    if extension in ('.json', '.jsonl'):
+        return _iter_json_rows(path)
+    return _iter_xlsx_rows(path)
+
+
+def parse_violation(row: dict) -> dict:
+    """Turn a raw report row into the violation dict returned by the API"""
+    if 'Line and Warning' in row:
+        text = row['Line and Warning']
+        match = LINE_WARNING_RE.match(str(text))
+        line, warning = (int(match.group(1)), match.group(2)) if match else (None, text)
+        return {
+            'file': row.get('File'),
+            'path': row.get('Path'),
+            'line': line,
+            'warning': warning,
+            'level': row.get('Level'),
+            'misra': row.get('Misra')
+        }
+    # Already parsed records (e.g. a JSON export of this API's own output)
+    line = row.get('line')
+    return {
+        'file': row.get('file'),
+        'path': row.get('path'),
+        'line': int(line) if line not in (None, "") else None,
+        'warning': row.get('warning'),
+        'level': row.get('level'),
+        'misra': row.get('misra')
+    }
+
+
+def _row_file(row: dict):
+    return row.get('File', row.get('file'))
+
+
+def iter_violations(path: str, target_file: str = None):
+    """Stream violation dicts, optionally only those for `target_file`; memory use stays flat"""
+    for row in iter_report_rows(path):
+        if target_file is not None and _row_file(row) != target_file:
+            continue
+        yield parse_violation(row)
+
+
+def count_violations_by_file(path: str) -> list:
+    counts = Counter(_row_file(row) for row in iter_report_rows(path))
+    return [
+        {'file': file_name, 'violations': count}
+        for file_name, count in sorted(counts.items(), key=lambda item: str(item[0]))
+    ]
+
+
+def should_stream(path: str) -> bool:
+    """CSV/JSON reports are always streamed; xlsx only when it is too big for the in-memory index"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in STREAMING_EXTENSIONS:
+        return True
+    if extension == '.xlsx':
+        return os.path.getsize(path) > STREAMING_THRESHOLD_BYTES
+    return False
@@ -0,0 +1,303 @@
+# resilience.py
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+
+from misra_chat_client import export_chat_history
+from instrumentation import metrics, span
+
+# Transient Vertex/HTTP failures, matched by name so no google.api_core import is needed
+RETRYABLE_ERROR_NAMES = {
+    "ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "BadGateway", "Aborted", "RetryError",
+}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+LATENCY_WINDOW = 200
+# A model's p95 is only trusted after this many calls
+MIN_LATENCY_SAMPLES = 5
+# Attempts given up on at their deadline keep an attempt thread until they return;
+# no new attempt starts while this many are still running
+MAX_ABANDONED_ATTEMPTS = int(os.environ.get('LLM_MAX_ABANDONED_ATTEMPTS', '16'))
+
+
+class AttemptPoolSaturated(Exception):
+    """Too many abandoned attempts are still holding attempt threads"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError, AttemptPoolSaturated)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return getattr(error, 'code', None) in RETRYABLE_STATUS_CODES
+
+
+def _env_float(name: str, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return float(value)
+
+
+class ResiliencePolicy:
+    """Deadlines, retries, hedging and the model fallback chain for LLM calls."""
+
+    def __init__(self, call_timeout: float = 300.0, max_retries: int = 3, backoff_base: float = 1.0,
+                 backoff_max: float = 30.0, hedge_after: float = None, fallback_models: list = None,
+                 p95_budget: float = None):
+        self.call_timeout = call_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.fallback_models = fallback_models or []
+        self.p95_budget = p95_budget
+
+    @classmethod
+    def from_env(cls) -> "ResiliencePolicy":
+        fallback = os.environ.get('LLM_FALLBACK_MODELS', 'gemini-2.5-flash')
+        return cls(
+            call_timeout=_env_float('LLM_CALL_TIMEOUT', 300.0),
+            max_retries=int(_env_float('LLM_MAX_RETRIES', 3)),
+            backoff_base=_env_float('LLM_BACKOFF_BASE', 1.0),
+            backoff_max=_env_float('LLM_BACKOFF_MAX', 30.0),
+            hedge_after=_env_float('LLM_HEDGE_AFTER', None),
+            fallback_models=[name.strip() for name in fallback.split(',') if name.strip()],
+            p95_budget=_env_float('LLM_P95_BUDGET', None),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def to_dict(self) -> dict:
+        return {
+            'callTimeout': self.call_timeout,
+            'maxRetries': self.max_retries,
+            'backoffBase': self.backoff_base,
+            'backoffMax': self.backoff_max,
+            'hedgeAfter': self.hedge_after,
+            'fallbackModels': self.fallback_models,
+            'p95Budget': self.p95_budget,
+        }
+
+
+class LatencyTracker:
+    """Recent call latencies and outcome counters per model"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latencies = {}
+        self._counters = {}
+
+    def _count(self, model: str, name: str):
+        counters = self._counters.setdefault(model, {})
+        counters[name] = counters.get(name, 0) + 1
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self._window)).append(seconds)
+            self._count(model, 'succeeded')
+        metrics.observe("misra_llm_attempt_seconds", seconds,
+                        documentation="Latency of successful LLM attempts", model=model)
+
+    def count(self, model: str, name: str):
+        with self._lock:
+            self._count(model, name)
+        metrics.inc("misra_llm_events_total", documentation="LLM retries, hedges, timeouts and fallbacks",
+                    model=model, event=name)
+
+    def p95(self, model: str):
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = set(self._latencies) | set(self._counters)
+            counters = {model: dict(self._counters.get(model, {})) for model in models}
+        return {model: {'p95Seconds': self.p95(model), **counters[model]} for model in sorted(models)}
+
+
+# Attempts run here so a stuck call can be abandoned at its deadline
+_attempt_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('LLM_ATTEMPT_THREADS', '32')),
+    thread_name_prefix="llm-attempt"
+)
+
+
+class AbandonedAttempts:
+    """Attempts nobody waits for any more (timed out, or a losing hedge) that are still running"""
+
+    def __init__(self, limit: int = MAX_ABANDONED_ATTEMPTS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.running = 0
+        self.total = 0
+
+    def add(self, future):
+        if future.cancel():
+            # Never started: nothing is left running
+            return
+        with self._lock:
+            self.running += 1
+            self.total += 1
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        with self._lock:
+            self.running -= 1
+
+    def submit(self, fn, *args):
+        """Start `fn(*args)` on the attempt pool unless too many abandoned attempts hold it"""
+        if self.running >= self.limit:
+            raise AttemptPoolSaturated(f"{self.running} abandoned LLM attempts are still running")
+        return _attempt_pool.submit(fn, *args)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'running': self.running, 'total': self.total, 'limit': self.limit}
+
+
+abandoned_attempts = AbandonedAttempts()
+
+
+class ResilientChat:
+    """
+    Chat whose every send runs on a fresh provider chat rebuilt from the
+    conversation so far. A timed-out, hedged or failed attempt therefore
+    never touches the real history: only the attempt that wins is adopted.
+    Transient errors are retried with backoff, then the next model in the
+    fallback chain is tried; a model whose p95 latency is over budget is
+    skipped while a faster one is available.
+    """
+
+    def __init__(self, settings: dict, history: list, chat_factory, policy: ResiliencePolicy,
+                 tracker: LatencyTracker):
+        self.settings = dict(settings)
+        self.turns = list(history or [])
+        self._chat_factory = chat_factory
+        self.policy = policy
+        self.tracker = tracker
+        self.last_model = None
+
+    def export_history(self) -> list:
+        return list(self.turns)
+
+    def _models(self) -> list:
+        chain = [self.settings['model_name']]
+        chain += [model for model in self.policy.fallback_models if model not in chain]
+        budget = self.policy.p95_budget
+        if budget is None:
+            return chain
+        # Start at the first model within its latency budget (untried models count as within)
+        for start, model in enumerate(chain):
+            p95 = self.tracker.p95(model)
+            if p95 is None or p95 <= budget:
+                return chain[start:]
+        fastest = min(range(len(chain)), key=lambda index: self.tracker.p95(chain[index]))
+        return chain[fastest:]
+
+    def _attempt(self, model: str, send):
+        settings = dict(self.settings, model_name=model)
+        chat = self._chat_factory(settings, self.turns)
+        started = time.monotonic()
+        result = send(chat)
+        return chat, result, time.monotonic() - started
+
+    def _run_once(self, model: str, send, hedge: bool):
+        """One attempt under the call deadline, plus a hedge if it is slow"""
+        deadline = time.monotonic() + self.policy.call_timeout
+        futures = [abandoned_attempts.submit(self._attempt, model, send)]
+        hedge_after = self.policy.hedge_after if hedge else None
+        if hedge_after is not None and hedge_after < self.policy.call_timeout:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                self.tracker.count(model, 'hedged')
+                futures.append(abandoned_attempts.submit(self._attempt, model, send))
+
+        error = None
+        pending = list(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            done, _ = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    for loser in pending:
+                        abandoned_attempts.add(loser)
+                    return future.result()
+                error = future.exception()
+        for future in pending:
+            abandoned_attempts.add(future)
+        if error is not None and not pending:
+            raise error
+        self.tracker.count(model, 'timedOut')
+        raise TimeoutError(f"{model} did not answer within {self.policy.call_timeout}s")
+
+    def _call(self, send, hedge: bool = True):
+        last_error = None
+        for model in self._models():
+            for attempt in range(self.policy.max_retries + 1):
+                try:
+                    chat, result, seconds = self._run_once(model, send, hedge)
+                except Exception as e:
+                    if not is_retryable(e):
+                        self.tracker.count(model, 'failed')
+                        raise
+                    last_error = e
+                    self.tracker.count(model, 'retried')
+                    if attempt < self.policy.max_retries:
+                        time.sleep(self.policy.backoff(attempt))
+                    continue
+                self.tracker.record(model, seconds)
+                if model != self.settings['model_name']:
+                    self.tracker.count(model, 'fallback')
+                self.last_model = model
+                return chat, result
+        raise last_error
+
+    def send_message(self, message, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(message, **kwargs)
+        with span("llm_call"):
+            chat, response = self._call(lambda chat: chat.send_message(message, **kwargs))
+        self.turns = export_chat_history(chat)
+        return response
+
+    def _stream(self, message, **kwargs):
+        def open_stream(chat):
+            # Only the wait for the first chunk is retried; once text flows it cannot be replayed
+            started = time.monotonic()
+            iterator = iter(chat.send_message(message, stream=True, **kwargs))
+            return started, iterator, next(iterator, None)
+
+        with span("llm_call", streamed="true"):
+            chat, (started, iterator, first) = self._call(open_stream, hedge=False)
+            if first is not None:
+                yield first
+                # The rest of the response must arrive within the same call deadline
+                deadline = started + self.policy.call_timeout
+                while True:
+                    future = abandoned_attempts.submit(next, iterator, None)
+                    try:
+                        chunk = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                    except FutureTimeout:
+                        abandoned_attempts.add(future)
+                        self.tracker.count(self.last_model, 'timedOut')
+                        raise TimeoutError(
+                            f"{self.last_model} stream stalled past the {self.policy.call_timeout}s deadline"
+                        )
+                    if chunk is None:
+                        break
+                    yield chunk
+        self.turns = export_chat_history(chat)
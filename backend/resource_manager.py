@@ -0,0 +1,326 @@
+# resource_manager.py
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+from instrumentation import metrics, get_logger
+
+logger = get_logger("resources")
+
+# Session fields naming files that belong to one project (uploaded blobs are shared and collected separately)
+PROJECT_FILE_KEYS = ('numbered_file', 'fixed_file', 'snippet_file')
+RECENT_EVICTIONS = 200
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def path_size(path: str) -> int:
+    """Bytes used by a file, or by everything below a folder"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResourcePolicy:
+    """Project TTL, memory/disk budgets and sweep timing; 0 disables a limit."""
+
+    def __init__(self, ttl: float = 86400.0, memory_budget: int = 512 * 1024 * 1024,
+                 disk_budget: int = 10 * 1024 * 1024 * 1024, sweep_interval: float = 300.0,
+                 blob_grace: float = 3600.0):
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.sweep_interval = sweep_interval
+        self.blob_grace = blob_grace
+
+    @classmethod
+    def from_env(cls) -> "ResourcePolicy":
+        return cls(
+            ttl=_env_float('PROJECT_TTL_SECONDS', 86400.0),
+            memory_budget=int(_env_float('MEMORY_BUDGET_BYTES', 512 * 1024 * 1024)),
+            disk_budget=int(_env_float('DISK_BUDGET_BYTES', 10 * 1024 * 1024 * 1024)),
+            sweep_interval=_env_float('SWEEP_INTERVAL_SECONDS', 300.0),
+            blob_grace=_env_float('BLOB_GRACE_SECONDS', 3600.0),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'ttlSeconds': self.ttl,
+            'memoryBudgetBytes': self.memory_budget,
+            'diskBudgetBytes': self.disk_budget,
+            'sweepIntervalSeconds': self.sweep_interval,
+            'blobGraceSeconds': self.blob_grace,
+        }
+
+
+class ResourceManager:
+    """
+    Bounds what projects leave behind on a long-running worker:
+    - a project unused for `ttl` seconds is deleted: session, stored chat,
+      cached document and patch history, and its files under the upload folder;
+    - above the memory budget, the in-process copies of the least recently
+      used projects are released (they reload from the session store on demand);
+    - above the disk budget, whole projects are evicted, least recently used first;
+    - uploaded blobs no project refers to are deleted once older than `blob_grace`.
+    Pinned projects and projects with an LLM call running or queued are never touched.
+    Memory use is estimated from the characters held, not measured.
+    """
+
+    def __init__(self, policy: ResourcePolicy, sessions, chats, documents, patch_histories: dict,
+                 blob_store, upload_folder: str, is_busy=None, references=None, on_blob_removed=None):
+        self.policy = policy
+        self.sessions = sessions
+        self.chats = chats
+        self.documents = documents
+        self.patch_histories = patch_histories
+        self.blob_store = blob_store
+        self.upload_folder = os.path.abspath(upload_folder)
+        self._is_busy = is_busy
+        # Extra blob paths in use outside project sessions (batch projects)
+        self._references = references
+        self._on_blob_removed = on_blob_removed
+        # Callables run on every sweep: collector(ttl) -> list of eviction entries
+        self.collectors = []
+        self.evictions = deque(maxlen=RECENT_EVICTIONS)
+        self.last_sweep = None
+        self.disk_bytes = None
+        self._access = {}
+        self._sweep_lock = threading.Lock()
+        self._task = None
+        sessions.on_access = self.touch
+
+    # === Access tracking ===
+
+    def touch(self, project_id: str):
+        self._access[project_id] = time.time()
+
+    def last_access(self, project_id: str, updated: dict) -> float:
+        """Latest of this worker's last read and any worker's last write"""
+        return max(self._access.get(project_id, 0.0), updated.get(project_id, 0.0))
+
+    def _by_age(self, updated: dict) -> list:
+        """(project id, last access), least recently used first"""
+        return sorted(
+            ((project_id, self.last_access(project_id, updated)) for project_id in updated),
+            key=lambda item: item[1]
+        )
+
+    def is_protected(self, project_id: str) -> bool:
+        if self._is_busy is not None and self._is_busy(project_id):
+            return True
+        session = self.sessions.peek(project_id)
+        return bool(session and session.get('pinned'))
+
+    def pin(self, project_id: str, pinned: bool = True):
+        self.sessions[project_id]['pinned'] = pinned
+
+    # === Release and eviction ===
+
+    def memory_usage(self) -> dict:
+        """{project id: approximate characters held in this process}"""
+        usage = {}
+
+        def add(project_id, size):
+            usage[project_id] = usage.get(project_id, 0) + size
+
+        for project_id, session in self.sessions.local_items():
+            add(project_id, len(json.dumps(session, default=str)))
+        for project_id, size in self.chats.local_sizes().items():
+            add(project_id, size)
+        for project_id, size in self.documents.sizes().items():
+            add(project_id, size)
+        for project_id, history in list(self.patch_histories.items()):
+            add(project_id, len(json.dumps(history.to_dict())))
+        return usage
+
+    def release(self, project_id: str):
+        """Drop the project's in-process state; nothing stored is deleted"""
+        self.sessions.release(project_id)
+        self.chats.release(project_id)
+        self.documents.discard(project_id)
+        self.patch_histories.pop(project_id, None)
+
+    def _remove_file(self, path: str) -> int:
+        # Only files under the upload folder are ever deleted
+        if not path or not os.path.abspath(path).startswith(self.upload_folder + os.sep):
+            return 0
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def evict(self, project_id: str, reason: str = "manual") -> dict:
+        """Delete a project and everything it owns; returns the eviction entry"""
+        session = self.sessions.peek(project_id) or {}
+        freed = sum(self._remove_file(session.get(key)) for key in PROJECT_FILE_KEYS)
+        self.chats.discard(project_id)
+        if project_id in self.sessions:
+            del self.sessions[project_id]
+        self.release(project_id)
+        self._access.pop(project_id, None)
+        return self.record_eviction(project_id, reason, freed)
+
+    def record_eviction(self, project_id: str, reason: str, bytes_freed: int = 0, kind: str = "project") -> dict:
+        entry = {'kind': kind, 'id': project_id, 'reason': reason, 'bytesFreed': bytes_freed, 'at': time.time()}
+        self.evictions.append(entry)
+        metrics.inc("misra_evictions_total", documentation="Projects and batches evicted", kind=kind, reason=reason)
+        logger.info("Evicted %s %s (%s, %d bytes freed)", kind, project_id, reason, bytes_freed)
+        return entry
+
+    # === Blobs and disk ===
+
+    def referenced_blobs(self) -> set:
+        paths = set()
+        for project_id in list(self.sessions):
+            session = self.sessions.peek(project_id) or {}
+            paths.update(os.path.abspath(session[key]) for key in ('cpp_file', 'excel_file') if session.get(key))
+        if self._references is not None:
+            paths.update(os.path.abspath(path) for path in self._references() if path)
+        return paths
+
+    def collect_blobs(self) -> tuple:
+        """Delete unreferenced blobs past the grace period; returns (count, bytes freed)"""
+        referenced = self.referenced_blobs()
+        cutoff = time.time() - self.policy.blob_grace
+        removed = 0
+        freed = 0
+        for path, _, mtime in list(self.blob_store.blobs()):
+            if mtime > cutoff or os.path.abspath(path) in referenced:
+                continue
+            freed += self.blob_store.remove(path)
+            removed += 1
+            if self._on_blob_removed is not None:
+                self._on_blob_removed(os.path.splitext(os.path.basename(path))[0])
+        if removed:
+            metrics.inc("misra_blobs_collected_total", removed, documentation="Unreferenced upload blobs deleted")
+        return removed, freed
+
+    def disk_usage(self) -> int:
+        self.disk_bytes = path_size(self.upload_folder)
+        return self.disk_bytes
+
+    # === Sweeping ===
+
+    def sweep(self) -> dict:
+        """One pass of TTL expiry, memory release, blob collection and disk eviction"""
+        with self._sweep_lock:
+            started = time.time()
+            evicted = []
+            released = []
+            policy = self.policy
+
+            updated = self.sessions.updated()
+            for project_id in [key for key in self._access if key not in updated]:
+                self._access.pop(project_id, None)
+
+            if policy.ttl > 0:
+                for project_id, last in self._by_age(updated):
+                    if started - last < policy.ttl:
+                        break
+                    if not self.is_protected(project_id):
+                        evicted.append(self.evict(project_id, "ttl"))
+            for collector in self.collectors:
+                evicted.extend(collector(policy.ttl))
+
+            usage = self.memory_usage()
+            memory = sum(usage.values())
+            if policy.memory_budget > 0 and memory > policy.memory_budget:
+                updated = self.sessions.updated()
+                for project_id in sorted(usage, key=lambda key: self.last_access(key, updated)):
+                    if memory <= policy.memory_budget:
+                        break
+                    if self.is_protected(project_id):
+                        continue
+                    self.release(project_id)
+                    memory -= usage[project_id]
+                    released.append({'projectId': project_id, 'bytes': usage[project_id]})
+
+            blobs_removed, blob_bytes = self.collect_blobs()
+            disk = self.disk_usage()
+            if policy.disk_budget > 0 and disk > policy.disk_budget:
+                for project_id, _ in self._by_age(self.sessions.updated()):
+                    if disk <= policy.disk_budget:
+                        break
+                    if self.is_protected(project_id):
+                        continue
+                    entry = self.evict(project_id, "disk")
+                    evicted.append(entry)
+                    disk -= entry['bytesFreed']
+                count, freed = self.collect_blobs()
+                blobs_removed += count
+                blob_bytes += freed
+                disk = self.disk_usage()
+                if disk > policy.disk_budget:
+                    logger.warning("Upload folder uses %d bytes, over the %d byte budget", disk, policy.disk_budget)
+
+            self.last_sweep = {
+                'at': started,
+                'seconds': time.time() - started,
+                'evicted': evicted,
+                'released': released,
+                'blobsRemoved': blobs_removed,
+                'blobBytesFreed': blob_bytes,
+                'memoryBytes': memory,
+                'diskBytes': disk,
+            }
+            return self.last_sweep
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.policy.sweep_interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception:
+                logger.exception("Resource sweep failed")
+
+    def start(self):
+        """Start the background sweeper (needs a running event loop)"""
+        if self._task is None and self.policy.sweep_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'policy': self.policy.to_dict(),
+            'projects': len(self.sessions),
+            'residentProjects': len(self.sessions.local_items()),
+            'memoryBytes': sum(self.memory_usage().values()),
+            'diskBytes': self.disk_bytes,
+            'blobs': self.blob_store.stats(),
+            'lastSweep': self.last_sweep,
+            'recentEvictions': list(self.evictions),
+        }
+
+
+def remove_folder(path: str) -> int:
+    """Delete a folder tree; returns the bytes freed"""
+    if not os.path.isdir(path):
+        return 0
+    size = path_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    return size
@@ -1,4 +1,4 @@
-from misra_chat_client import init_vertex_ai, load_cpp_file, start_chat, send_file_intro, send_misra_violations
+from misra_chat_client import init_llm_provider, load_cpp_file, start_chat, send_file_intro, send_misra_violations
 from excel_utils import extract_violations_for_file
 
 
@@ -8,7 +8,7 @@ target_file = "safemondoor.cpp"
 
 if __name__ == "__main__":
     # Step 0: Setup
-    init_vertex_ai()
+    init_llm_provider()
 
     # Step 1: Load numbered file
     cpp_file = "numbered_safemondoor.cpp"
@@ -0,0 +1,235 @@
+# scope_index.py
+import re
+
+NUMBERED_LINE_RE = re.compile(r"^(\d+)[a-zA-Z]*:\s?(.*)$", re.DOTALL)
+IDENTIFIER_RE = re.compile(r"([A-Za-z_~][\w:~]*)\s*\($")
+TYPE_RE = re.compile(r"\b(struct|class|union|enum)\b\s*([A-Za-z_]\w*)?")
+# String literal contents are dropped while scanning, so `extern "C"` reads as `extern ""`
+NAMESPACE_RE = re.compile(r'^(?:inline\s+)?namespace\b|^extern\s*""')
+
+CONTEXT_MODES = ("full", "scopes")
+
+# Scopes whose bodies are only sent when they contain a violation
+BODY_KINDS = ("function", "data", "block")
+
+
+def _classify(header: str):
+    """Guess what a `{` at global level opens from the text before it"""
+    header = " ".join(header.split())
+    if NAMESPACE_RE.search(header):
+        return "namespace", header
+    if "=" in header and "operator" not in header:
+        declarator = header.split("=", 1)[0]
+        if "(" not in declarator:
+            words = declarator.split("[", 1)[0].split()
+            return "data", words[-1] if words else ""
+    if ")" not in header:
+        type_match = TYPE_RE.search(header)
+        if type_match:
+            return "type", type_match.group(2) or type_match.group(1)
+        return "block", ""
+    name_match = IDENTIFIER_RE.search(header[:header.find("(") + 1])
+    return "function", name_match.group(1) if name_match else ""
+
+
+class ScopeIndex:
+    """
+    Maps every line of a numbered C/C++ file (as written by numbering.add_line_numbers)
+    to its enclosing function, type, data initializer or macro block.
+
+    The scanner is comment, string and preprocessor aware and runs in a single pass.
+    Of every `#if`/`#elif`/`#else` chain only the first branch's braces are counted.
+    Namespaces and `extern "C"` blocks are transparent: their contents count as global.
+    """
+
+    def __init__(self, numbered_lines: list):
+        self.lines = numbered_lines
+        self.numbers = []
+        self.scopes = []
+        self._owner = []
+        self._scan()
+
+    @classmethod
+    def from_numbered_text(cls, numbered_text: str) -> "ScopeIndex":
+        return cls(numbered_text.splitlines(keepends=True))
+
+    def _scan(self):
+        stack = []
+        conditionals = []
+        header = ""
+        pending_start = None
+        awaiting_semicolon = None
+        in_block_comment = False
+        pp_continuation = None
+        last_number = 0
+
+        def at_global_level():
+            return all(entry['kind'] == "namespace" for entry in stack)
+
+        for index, raw in enumerate(self.lines):
+            match = NUMBERED_LINE_RE.match(raw.rstrip("\n"))
+            if match:
+                last_number = int(match.group(1))
+                code = match.group(2)
+            else:
+                code = raw.rstrip("\n")
+            self.numbers.append(last_number)
+            self._owner.append(None)
+
+            stripped = code.strip()
+
+            # Preprocessor lines (and their backslash continuations) never open scopes
+            if pp_continuation is not None or (not in_block_comment and stripped.startswith("#")):
+                if pp_continuation is None:
+                    words = stripped[1:].split()
+                    directive = words[0] if words else ""
+                    if directive.startswith("if"):
+                        # Only the first branch's braces count: later branches restart from
+                        # the state at `#if` and the first branch's state is restored at `#endif`
+                        conditionals.append({'start': index, 'entry': (list(stack), header, pending_start),
+                                             'first': None})
+                    elif directive in ("elif", "else") and conditionals:
+                        frame = conditionals[-1]
+                        if frame['first'] is None:
+                            frame['first'] = (list(stack), header, pending_start)
+                        saved_stack, header, pending_start = frame['entry']
+                        stack[:] = saved_stack
+                    elif directive == "endif" and conditionals:
+                        frame = conditionals.pop()
+                        if frame['first'] is not None:
+                            saved_stack, header, pending_start = frame['first']
+                            stack[:] = saved_stack
+                        self.scopes.append({'kind': "conditional", 'name': "",
+                                            'start': frame['start'], 'end': index})
+                    pp_continuation = {
+                        'macro': directive == "define",
+                        'name': words[1].split("(")[0] if len(words) > 1 else "",
+                        'start': index
+                    }
+                if not stripped.endswith("\\"):
+                    if pp_continuation['macro'] and pp_continuation['start'] != index:
+                        self.scopes.append({'kind': "macro", 'name': pp_continuation['name'],
+                                            'start': pp_continuation['start'], 'end': index})
+                    pp_continuation = None
+                continue
+
+            i = 0
+            length = len(code)
+            while i < length:
+                ch = code[i]
+                if in_block_comment:
+                    end = code.find("*/", i)
+                    if end < 0:
+                        i = length
+                        break
+                    in_block_comment = False
+                    i = end + 2
+                    continue
+                if code.startswith("//", i):
+                    if pending_start is None and at_global_level():
+                        pending_start = index
+                    break
+                if code.startswith("/*", i):
+                    if pending_start is None and at_global_level():
+                        pending_start = index
+                    in_block_comment = True
+                    i += 2
+                    continue
+                if ch == '"' or ch == "'":
+                    # Skip string and character literals, honouring escapes
+                    j = i + 1
+                    while j < length and code[j] != ch:
+                        j += 2 if code[j] == "\\" else 1
+                    if at_global_level():
+                        header += ch + ch
+                    i = j + 1
+                    continue
+
+                if not ch.isspace() and pending_start is None and at_global_level():
+                    pending_start = index
+
+                if ch == "{":
+                    if at_global_level():
+                        kind, name = _classify(header)
+                        start = pending_start if pending_start is not None else index
+                        stack.append({'kind': kind, 'name': name, 'start': start})
+                        header = ""
+                        pending_start = None
+                    else:
+                        stack.append({'kind': "inner"})
+                elif ch == "}":
+                    entry = stack.pop() if stack else {'kind': "inner"}
+                    if entry['kind'] not in ("inner", "namespace") and at_global_level():
+                        scope = {'kind': entry['kind'], 'name': entry['name'],
+                                 'start': entry['start'], 'end': index}
+                        self.scopes.append(scope)
+                        awaiting_semicolon = scope if entry['kind'] in ("type", "data") else None
+                    if at_global_level():
+                        header = ""
+                        pending_start = None
+                elif ch == ";":
+                    if at_global_level():
+                        if awaiting_semicolon is not None:
+                            awaiting_semicolon['end'] = index
+                            awaiting_semicolon = None
+                        header = ""
+                        pending_start = None
+                elif at_global_level():
+                    header += ch
+                i += 1
+
+            if at_global_level():
+                header += " "
+
+        # Unterminated scopes (truncated files) run to the end of the file
+        for entry in stack:
+            if entry['kind'] not in ("inner", "namespace"):
+                self.scopes.append({'kind': entry['kind'], 'name': entry['name'],
+                                    'start': entry['start'], 'end': len(self.lines) - 1})
+
+        self.scopes.sort(key=lambda scope: (scope['start'], -scope['end']))
+        for scope in self.scopes:
+            if scope['kind'] != "conditional":
+                for index in range(scope['start'], scope['end'] + 1):
+                    if self._owner[index] is None:
+                        self._owner[index] = scope
+
+    def scope_of(self, line_number: int):
+        """Enclosing function/type/data/macro scope of an original line number, or None if global"""
+        index = self.index_of(line_number)
+        return self._owner[index] if index is not None else None
+
+    def index_of(self, line_number: int):
+        # add_line_numbers output is dense, so line N usually sits at index N - 1
+        guess = line_number - 1
+        if 0 <= guess < len(self.numbers) and self.numbers[guess] == line_number:
+            return guess
+        for index, number in enumerate(self.numbers):
+            if number == line_number:
+                return index
+        return None
+
+    def global_lines(self) -> list:
+        """Indexes of lines outside any function body or data initializer"""
+        return [i for i, owner in enumerate(self._owner)
+                if owner is None or owner['kind'] not in BODY_KINDS]
+
+    def slice_for_lines(self, violation_lines) -> str:
+        """
+        Numbered text holding the global declarations plus every scope that contains
+        one of `violation_lines`. Lines keep their original number prefixes.
+        """
+        keep = [False] * len(self.lines)
+        for index in self.global_lines():
+            keep[index] = True
+        for line_number in violation_lines:
+            index = self.index_of(line_number)
+            if index is None:
+                continue
+            owner = self._owner[index]
+            if owner is None:
+                keep[index] = True
+                continue
+            for i in range(owner['start'], owner['end'] + 1):
+                keep[i] = True
+        return "".join(line for line, kept in zip(self.lines, keep) if kept)
@@ -0,0 +1,546 @@
+# session_store.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+SESSION_BACKENDS = ("sqlite", "memory")
+DEFAULT_LOCAL_CHATS = 64
+# A worker that dies holding a project lease blocks it for at most this long
+DEFAULT_LEASE_SECONDS = 60.0
+
+
+class MemoryBackend:
+    """Records kept in this process only (single worker, lost on restart)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            record = self._records.get((namespace, key))
+        if record is None:
+            return None
+        return json.loads(record[0]), record[1]
+
+    def version(self, namespace: str, key: str):
+        with self._lock:
+            record = self._records.get((namespace, key))
+        return record[1] if record is not None else None
+
+    def put(self, namespace: str, key: str, data) -> int:
+        payload = json.dumps(data)
+        with self._lock:
+            previous = self._records.get((namespace, key))
+            version = previous[1] + 1 if previous is not None else 1
+            self._records[(namespace, key)] = (payload, version, time.time())
+        return version
+
+    def merge(self, namespace: str, key: str, changes: dict, removed=()) -> tuple:
+        """
+        Set `changes` and drop `removed` top-level keys of a dict record;
+        returns (data, version), or None if the record was deleted
+        """
+        with self._lock:
+            previous = self._records.get((namespace, key))
+            if previous is None:
+                return None
+            data = json.loads(previous[0])
+            data.update(changes)
+            for name in removed:
+                data.pop(name, None)
+            version = previous[1] + 1
+            self._records[(namespace, key)] = (json.dumps(data), version, time.time())
+        return data, version
+
+    def claim(self, namespace: str, key: str, holder: str, ttl: float) -> bool:
+        """Take or renew the lease `key` for `holder` unless another holder's lease is still live"""
+        now = time.time()
+        with self._lock:
+            record = self._records.get((namespace, key))
+            if record is not None:
+                lease = json.loads(record[0])
+                if lease['holder'] != holder and lease['expires'] > now:
+                    return False
+            version = record[1] + 1 if record is not None else 1
+            self._records[(namespace, key)] = (json.dumps({'holder': holder, 'expires': now + ttl}), version, now)
+        return True
+
+    def release(self, namespace: str, key: str, holder: str):
+        """Drop the lease `key` if `holder` still has it"""
+        with self._lock:
+            record = self._records.get((namespace, key))
+            if record is not None and json.loads(record[0])['holder'] == holder:
+                del self._records[(namespace, key)]
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._records.pop((namespace, key), None)
+
+    def keys(self, namespace: str) -> list:
+        with self._lock:
+            return [key for ns, key in self._records if ns == namespace]
+
+    def updated(self, namespace: str) -> dict:
+        """{key: time of its last write}"""
+        with self._lock:
+            return {key: record[2] for (ns, key), record in self._records.items() if ns == namespace}
+
+
+class SQLiteBackend:
+    """
+    Records in a SQLite file shared by every uvicorn worker on the host.
+    Each write bumps the record's version so workers can tell when their
+    local copy is stale.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, version FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def version(self, namespace: str, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, namespace: str, key: str, data) -> int:
+        payload = json.dumps(data)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO records (namespace, key, data, version, updated_at) VALUES (?, ?, ?, 1, ?)"
+                " ON CONFLICT (namespace, key) DO UPDATE SET"
+                " data = excluded.data, version = records.version + 1, updated_at = excluded.updated_at",
+                (namespace, key, payload, time.time())
+            )
+            version = self._conn.execute(
+                "SELECT version FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()[0]
+            self._conn.commit()
+        return version
+
+    def merge(self, namespace: str, key: str, changes: dict, removed=()) -> tuple:
+        """
+        Set `changes` and drop `removed` top-level keys of a dict record in one
+        write transaction, so workers updating different keys never lose each
+        other's writes. Returns (data, version), or None if the record was deleted.
+        """
+        with self._lock:
+            try:
+                # Take the write lock before reading, so no other worker writes in between
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute(
+                    "SELECT data, version FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is None:
+                    self._conn.rollback()
+                    return None
+                data = json.loads(row[0])
+                data.update(changes)
+                for name in removed:
+                    data.pop(name, None)
+                version = row[1] + 1
+                self._conn.execute(
+                    "UPDATE records SET data = ?, version = ?, updated_at = ? WHERE namespace = ? AND key = ?",
+                    (json.dumps(data), version, time.time(), namespace, key)
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return data, version
+
+    def claim(self, namespace: str, key: str, holder: str, ttl: float) -> bool:
+        """
+        Take or renew the lease `key` for `holder` unless another holder's lease
+        is still live. One write transaction, so two workers never both win.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute(
+                    "SELECT data FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is not None:
+                    lease = json.loads(row[0])
+                    if lease['holder'] != holder and lease['expires'] > now:
+                        self._conn.rollback()
+                        return False
+                self._conn.execute(
+                    "INSERT INTO records (namespace, key, data, version, updated_at) VALUES (?, ?, ?, 1, ?)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET"
+                    " data = excluded.data, version = records.version + 1, updated_at = excluded.updated_at",
+                    (namespace, key, json.dumps({'holder': holder, 'expires': now + ttl}), now)
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return True
+
+    def release(self, namespace: str, key: str, holder: str):
+        """Drop the lease `key` if `holder` still has it"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM records WHERE namespace = ? AND key = ? AND json_extract(data, '$.holder') = ?",
+                (namespace, key, holder)
+            )
+            self._conn.commit()
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM records WHERE namespace = ? AND key = ?", (namespace, key))
+            self._conn.commit()
+
+    def keys(self, namespace: str) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM records WHERE namespace = ?", (namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def updated(self, namespace: str) -> dict:
+        """{key: time of its last write}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, updated_at FROM records WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return {key: updated_at for key, updated_at in rows}
+
+
+class ProjectSession(dict):
+    """
+    A project's session dict. Top-level assignments are written through to the
+    store as per-key merges, so only the changed keys are written and keys set by
+    other workers meanwhile are kept. Inside `batch()` they are written once, on exit.
+    """
+
+    def __init__(self, owner: "ProjectSessions", project_id: str, data: dict):
+        super().__init__(data)
+        self._owner = owner
+        self._project_id = project_id
+        self._changed = set()
+        self._removed = set()
+        self._batch_depth = 0
+
+    def _mark(self, changed=(), removed=()):
+        self._changed.update(changed)
+        self._changed.difference_update(removed)
+        self._removed.difference_update(changed)
+        self._removed.update(removed)
+        if self._batch_depth == 0:
+            self._save()
+
+    def _save(self):
+        if not self._changed and not self._removed:
+            return
+        changes = {key: self[key] for key in self._changed}
+        removed = list(self._removed)
+        self._changed = set()
+        self._removed = set()
+        self._owner._merge(self._project_id, self, changes, removed)
+
+    @contextmanager
+    def batch(self):
+        """Write every assignment made inside the block as one merge"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._save()
+
+    def _refresh(self, data: dict):
+        """Adopt the merged record, keeping changes made since (nested batches)"""
+        pending = {key: self[key] for key in self._changed}
+        super().clear()
+        super().update(data)
+        super().update(pending)
+        for key in self._removed:
+            super().pop(key, None)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._mark(changed=(key,))
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._mark(removed=(key,))
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        self._mark(changed=changes)
+
+    def pop(self, key, *default):
+        present = key in self
+        value = super().pop(key, *default)
+        if present:
+            self._mark(removed=(key,))
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class ProjectSessions(MutableMapping):
+    """
+    Drop-in replacement for the `sessions` dict. Values are JSON-serializable
+    project dicts; a worker re-reads a project only when another worker
+    changed it since it was last seen here.
+    """
+
+    NAMESPACE = "project"
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._local = {}
+        self._lock = threading.Lock()
+        # Called with the project id on every read or write (access tracking)
+        self.on_access = None
+
+    def _merge(self, project_id: str, session: ProjectSession, changes: dict, removed: list):
+        merged = self.backend.merge(self.NAMESPACE, project_id, changes, removed)
+        if merged is None:
+            # Deleted meanwhile (evicted or by another worker): nothing to write to
+            return
+        data, version = merged
+        session._refresh(data)
+        with self._lock:
+            local = self._local.get(project_id)
+            if local is not None and local[1] is session:
+                self._local[project_id] = (version, session)
+
+    def __getitem__(self, project_id):
+        version = self.backend.version(self.NAMESPACE, project_id)
+        if version is None:
+            raise KeyError(project_id)
+        if self.on_access is not None:
+            self.on_access(project_id)
+        with self._lock:
+            local = self._local.get(project_id)
+        if local is not None and local[0] == version:
+            return local[1]
+        record = self.backend.get(self.NAMESPACE, project_id)
+        if record is None:
+            raise KeyError(project_id)
+        data, version = record
+        session = ProjectSession(self, project_id, data)
+        with self._lock:
+            self._local[project_id] = (version, session)
+        return session
+
+    def __setitem__(self, project_id, data):
+        version = self.backend.put(self.NAMESPACE, project_id, dict(data))
+        if self.on_access is not None:
+            self.on_access(project_id)
+        with self._lock:
+            self._local[project_id] = (version, ProjectSession(self, project_id, data))
+
+    def __delitem__(self, project_id):
+        if project_id not in self:
+            raise KeyError(project_id)
+        self.backend.delete(self.NAMESPACE, project_id)
+        with self._lock:
+            self._local.pop(project_id, None)
+
+    def __contains__(self, project_id):
+        return self.backend.version(self.NAMESPACE, project_id) is not None
+
+    def __iter__(self):
+        return iter(self.backend.keys(self.NAMESPACE))
+
+    def __len__(self):
+        return len(self.backend.keys(self.NAMESPACE))
+
+    def peek(self, project_id: str):
+        """The stored project as a plain dict (None if missing), without counting as an access"""
+        record = self.backend.get(self.NAMESPACE, project_id)
+        return record[0] if record is not None else None
+
+    def updated(self) -> dict:
+        """{project id: time of its last write on any worker}"""
+        return self.backend.updated(self.NAMESPACE)
+
+    def local_items(self) -> list:
+        """(project id, session) pairs cached in this process"""
+        with self._lock:
+            return [(project_id, local[1]) for project_id, local in self._local.items()]
+
+    def release(self, project_id: str):
+        """Drop the local copy; the stored project is untouched"""
+        with self._lock:
+            self._local.pop(project_id, None)
+
+
+class ProjectLeases:
+    """
+    Cross-worker mutual exclusion per project, as expiring leases in the shared
+    store. A holder renews its lease while it works; a crashed worker's lease
+    lapses after `ttl` seconds and the project can be taken over.
+    """
+
+    NAMESPACE = "lease"
+
+    def __init__(self, backend, ttl: float = DEFAULT_LEASE_SECONDS, holder: str = None):
+        self.backend = backend
+        self.ttl = ttl
+        # Unique per process, so a restarted worker never inherits a stale lease
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self, key: str) -> bool:
+        return self.backend.claim(self.NAMESPACE, key, self.holder, self.ttl)
+
+    def renew(self, key: str) -> bool:
+        return self.backend.claim(self.NAMESPACE, key, self.holder, self.ttl)
+
+    def release(self, key: str):
+        self.backend.release(self.NAMESPACE, key, self.holder)
+
+    def held(self, key: str) -> bool:
+        """True while any worker holds a live lease on `key` or on a `key#...` sub-key"""
+        now = time.time()
+        prefix = key + "#"
+        for name in self.backend.keys(self.NAMESPACE):
+            if name != key and not name.startswith(prefix):
+                continue
+            record = self.backend.get(self.NAMESPACE, name)
+            if record is not None and record[0]['expires'] > now:
+                return True
+        return False
+
+
+class ChatRegistry:
+    """
+    Replacement for the `chat_sessions` dict. The store holds each project's
+    model settings and provider-neutral history ([{'role', 'text'}]);
+    `factory(settings, history)` rebuilds a chat from them on any worker and
+    `export(chat)` serializes one. Only the `max_local` most recently used
+    chat objects are kept alive in this process.
+    """
+
+    NAMESPACE = "chat"
+
+    def __init__(self, backend, factory, export, max_local: int = DEFAULT_LOCAL_CHATS):
+        self.backend = backend
+        self.factory = factory
+        self.export = export
+        self.max_local = max_local
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, project_id):
+        return self.backend.version(self.NAMESPACE, project_id) is not None
+
+    def __getitem__(self, project_id):
+        version = self.backend.version(self.NAMESPACE, project_id)
+        if version is None:
+            raise KeyError(project_id)
+        with self._lock:
+            local = self._local.get(project_id)
+            if local is not None and local[0] == version:
+                self._local.move_to_end(project_id)
+                return local[2]
+        record = self.backend.get(self.NAMESPACE, project_id)
+        if record is None:
+            raise KeyError(project_id)
+        data, version = record
+        # Stale or never seen here: rebuild from the stored history
+        chat = self.factory(data['settings'], data['history'])
+        self._remember(project_id, version, data['settings'], chat)
+        return chat
+
+    def put(self, project_id: str, chat, settings: dict):
+        """Register a new chat for the project, replacing any previous one"""
+        version = self.backend.put(self.NAMESPACE, project_id, {
+            'settings': dict(settings),
+            'history': self.export(chat)
+        })
+        self._remember(project_id, version, dict(settings), chat)
+
+    def persist(self, project_id: str):
+        """Write the local chat's history back to the store after a turn"""
+        with self._lock:
+            local = self._local.get(project_id)
+        if local is None:
+            return
+        _, settings, chat = local
+        version = self.backend.put(self.NAMESPACE, project_id, {
+            'settings': settings,
+            'history': self.export(chat)
+        })
+        self._remember(project_id, version, settings, chat)
+
+    def discard(self, project_id: str):
+        self.backend.delete(self.NAMESPACE, project_id)
+        with self._lock:
+            self._local.pop(project_id, None)
+
+    def release(self, project_id: str):
+        """Drop the live chat object; it is rebuilt from the store when needed again"""
+        with self._lock:
+            self._local.pop(project_id, None)
+
+    def local_sizes(self) -> dict:
+        """{project id: characters of history held by its live chat}"""
+        with self._lock:
+            chats = [(project_id, local[2]) for project_id, local in self._local.items()]
+        return {project_id: sum(len(turn['text']) for turn in self.export(chat)) for project_id, chat in chats}
+
+    def stats(self) -> dict:
+        with self._lock:
+            local = len(self._local)
+        return {
+            'stored': len(self.backend.keys(self.NAMESPACE)),
+            'local': local,
+            'maxLocal': self.max_local,
+        }
+
+    def _remember(self, project_id: str, version: int, settings: dict, chat):
+        with self._lock:
+            self._local[project_id] = (version, settings, chat)
+            self._local.move_to_end(project_id)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
+
+
+def open_session_backend(folder: str):
+    """Backend chosen by SESSION_STORE ("sqlite" by default, or "memory")"""
+    kind = os.environ.get('SESSION_STORE', 'sqlite').lower()
+    if kind not in SESSION_BACKENDS:
+        raise ValueError(f"SESSION_STORE must be one of {', '.join(SESSION_BACKENDS)}")
+    if kind == "memory":
+        return MemoryBackend()
+    path = os.environ.get('SESSION_STORE_PATH', os.path.join(folder, 'sessions.sqlite'))
+    return SQLiteBackend(path)
@@ -0,0 +1,147 @@
+# snippet_validator.py
+import os
+import string
+
+from misra_chat_client import send_snippet_corrections
+from fixed_response_code_snippet import extract_snippets_from_response
+from numbered_document import LINE_KEY_RE
+from instrumentation import metrics, get_logger
+
+logger = get_logger("validator")
+
+# Edits further than this many lines from every violation of the batch are flagged
+SNIPPET_MAX_DISTANCE = int(os.environ.get('SNIPPET_MAX_DISTANCE', '30'))
+# Correction turns spent on rejected keys before they are dropped
+SNIPPET_REPAIR_ROUNDS = int(os.environ.get('SNIPPET_REPAIR_ROUNDS', '1'))
+
+LETTERS = string.ascii_lowercase
+
+
+class SnippetValidator:
+    """
+    Checks model snippets against the document's line keys and the violation
+    lines before they are merged, in time linear in the file and snippet sizes:
+    - invalid_key: the key is not `N` or `N` plus letters;
+    - unknown_line: N is not a line of the file;
+    - suffix_gap: `Nc` without `Nb` (in the answer or the document), and so on;
+    - far_edit: the line is more than `max_distance` lines from every violation.
+    The first three are rejected and asked for again; far edits are only flagged,
+    since a fix can legitimately touch a shared declaration.
+    """
+
+    def __init__(self, line_count: int, document=None, max_distance: int = SNIPPET_MAX_DISTANCE,
+                 rounds: int = SNIPPET_REPAIR_ROUNDS):
+        self.line_count = line_count
+        self.document = document
+        self.max_distance = max_distance
+        self.rounds = rounds
+
+    def _near(self, violation_lines) -> bytearray:
+        """near[n] is 1 when line n is within max_distance of a violation (difference array)"""
+        size = self.line_count + 2
+        delta = [0] * (size + 1)
+        for line in violation_lines:
+            start = max(1, line - self.max_distance)
+            end = min(self.line_count, line + self.max_distance)
+            if start <= end:
+                delta[start] += 1
+                delta[end + 1] -= 1
+        near = bytearray(size)
+        running = 0
+        for number in range(size):
+            running += delta[number]
+            near[number] = 1 if running > 0 else 0
+        return near
+
+    def _exists(self, key: str, answer: dict) -> bool:
+        if key in answer:
+            return True
+        return self.document is not None and self.document.get(key) is not None
+
+    def check(self, snippets: dict, violation_lines) -> dict:
+        """{'accepted': {key: content}, 'rejected': {key: reason}, 'flagged': {key: reason}}"""
+        violation_lines = [line for line in violation_lines if line is not None]
+        near = self._near(violation_lines) if violation_lines and self.max_distance is not None else None
+        accepted = {}
+        rejected = {}
+        flagged = {}
+        for key, content in snippets.items():
+            match = LINE_KEY_RE.match(key)
+            if match is None:
+                rejected[key] = "invalid_key"
+                continue
+            number = int(match.group(1))
+            suffix = match.group(2)
+            if not 1 <= number <= self.line_count:
+                rejected[key] = "unknown_line"
+                continue
+            if len(suffix) == 1 and suffix in LETTERS and suffix != "a":
+                previous = f"{number}{LETTERS[LETTERS.index(suffix) - 1]}"
+                if not self._exists(previous, snippets):
+                    rejected[key] = "suffix_gap"
+                    continue
+            if near is not None and not near[number]:
+                flagged[key] = "far_edit"
+            accepted[key] = content
+        return {'accepted': accepted, 'rejected': rejected, 'flagged': flagged}
+
+    def describe(self, rejected: dict) -> str:
+        """One line per rejected key, for the correction prompt"""
+        explanations = {
+            'invalid_key': "is not a valid line number",
+            'unknown_line': f"does not exist (the file has {self.line_count} lines)",
+            'suffix_gap': "skips a letter: inserted lines must be numbered a, b, c, ... in order",
+        }
+        return "\n".join(f"- `{key}:` {explanations[reason]}" for key, reason in rejected.items())
+
+    def repair(self, chat, snippets: dict, violation_lines) -> tuple:
+        """
+        Validate `snippets`; ask `chat` again for the rejected keys only, up to
+        `rounds` times. Returns (snippets to merge, report).
+        """
+        violation_lines = list(violation_lines)
+        result = self.check(snippets, violation_lines)
+        accepted = result['accepted']
+        flagged = dict(result['flagged'])
+        rejected = result['rejected']
+        first_rejected = dict(rejected)
+        turns = 0
+        while rejected and turns < self.rounds:
+            turns += 1
+            logger.debug("Asking again for %d rejected snippet lines", len(rejected))
+            response = send_snippet_corrections(chat, self.describe(rejected))
+            if response is None:
+                break
+            corrections = extract_snippets_from_response(response)
+            # Corrections are checked together with what was already accepted (suffix order)
+            retry = self.check({**accepted, **corrections}, violation_lines)
+            accepted = retry['accepted']
+            flagged.update(retry['flagged'])
+            rejected = {key: reason for key, reason in retry['rejected'].items() if key in corrections}
+
+        for reason in first_rejected.values():
+            metrics.inc("misra_snippets_rejected_total", documentation="Snippet lines rejected before merge",
+                        reason=reason)
+        for reason in flagged.values():
+            metrics.inc("misra_snippets_flagged_total", documentation="Snippet lines flagged before merge",
+                        reason=reason)
+        if rejected:
+            logger.warning("Dropped %d snippet lines still invalid after %d correction turns", len(rejected), turns)
+        return accepted, {
+            'rejected': first_rejected,
+            'flagged': flagged,
+            'dropped': rejected,
+            'correctionTurns': turns,
+        }
+
+
+def merge_reports(reports) -> dict:
+    """Combine the reports of several batches or groups"""
+    total = {'rejected': {}, 'flagged': {}, 'dropped': {}, 'correctionTurns': 0}
+    for report in reports:
+        if not report:
+            continue
+        for field in ('rejected', 'flagged', 'dropped'):
+            total[field].update(report[field])
+        total['correctionTurns'] += report['correctionTurns']
+    return total
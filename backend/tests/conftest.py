@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# Backend modules import each other by bare name, as when uvicorn runs from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
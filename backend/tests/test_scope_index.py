@@ -0,0 +1,46 @@
+# test_scope_index.py
+from scope_index import ScopeIndex
+
+
+def numbered(source: str) -> str:
+    return "".join(f"{number}: {line}\n" for number, line in enumerate(source.splitlines(), 1))
+
+
+def scopes(source: str, kind: str = "function") -> dict:
+    index = ScopeIndex.from_numbered_text(numbered(source))
+    return {scope['name']: (scope['start'] + 1, scope['end'] + 1) for scope in index.scopes if scope['kind'] == kind}
+
+
+def test_braces_in_else_branch_are_not_counted_twice():
+    source = """namespace n {
+void f(int x) {
+#if A
+    if (x) {
+#else
+    if (!x) {
+#endif
+        x++;
+    }
+}
+void g(void) {
+}
+}
+"""
+    assert scopes(source) == {'f': (2, 10), 'g': (11, 12)}
+
+
+def test_function_header_in_each_branch():
+    source = """#if defined(WITH_ARG)
+void f(int a) {
+#else
+void f(void) {
+#endif
+    run();
+}
+void g(void) {
+}
+"""
+    functions = scopes(source)
+    assert functions['f'][1] == 7
+    assert functions['g'] == (8, 9)
+    assert scopes(source, "conditional") == {'': (1, 5)}
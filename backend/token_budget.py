@@ -0,0 +1,201 @@
+# token_budget.py
+import math
+import threading
+
+from misra_chat_client import send_misra_violations, build_violations_prompt
+from continuation import send_with_continuations, merge_snippets, DEFAULT_MAX_TURNS, DEFAULT_TOKEN_BUDGET
+from scope_index import NUMBERED_LINE_RE
+from fanout import violation_line
+from token_usage import MeteredChat, USAGE_KEYS, add_usage
+from violation_clustering import format_violations_prompt
+from snippet_validator import merge_reports
+
+CHARS_PER_TOKEN = 4.0
+# Lines around a violation the fixed snippet is expected to repeat
+OUTPUT_CONTEXT_RADIUS = 3
+# Fence, explanation and the violation's own header in the answer
+PER_VIOLATION_OVERHEAD_TOKENS = 40
+# Batches are planned to fill at most this share of the model's output limit
+OUTPUT_SAFETY_FACTOR = 0.75
+# Weight of the newest observation in the estimate correction (EWMA)
+CALIBRATION_WEIGHT = 0.2
+
+
+class TokenEstimator:
+    """
+    Estimates the output a list of violations will produce from the code
+    around them, corrected by the observed actual/estimated output ratio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.output_ratio = 1.0
+        self.samples = 0
+        self.estimated_total = 0
+        self.actual_total = 0
+
+    def prompt_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+    def raw_output_tokens(self, context_chars: int, violations: int) -> int:
+        """Uncorrected estimate, the quantity the correction ratio applies to"""
+        return math.ceil(context_chars / CHARS_PER_TOKEN + PER_VIOLATION_OVERHEAD_TOKENS * violations)
+
+    def output_tokens(self, context_chars: int, violations: int) -> int:
+        return math.ceil(self.raw_output_tokens(context_chars, violations) * self.output_ratio)
+
+    def observe(self, raw_estimate: int, estimated: int, actual: int):
+        """Fold one batch's actual output tokens into the correction ratio"""
+        if raw_estimate <= 0 or actual <= 0:
+            return
+        with self._lock:
+            ratio = actual / raw_estimate
+            if self.samples == 0:
+                self.output_ratio = ratio
+            else:
+                self.output_ratio += CALIBRATION_WEIGHT * (ratio - self.output_ratio)
+            self.samples += 1
+            self.estimated_total += estimated
+            self.actual_total += actual
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'outputRatio': self.output_ratio,
+                'samples': self.samples,
+                'estimatedOutputTokens': self.estimated_total,
+                'actualOutputTokens': self.actual_total,
+            }
+
+
+def _line_lengths(numbered_content: str) -> dict:
+    """Base line number -> length of its numbered line (inserted `a`, `b` lines add to their base)"""
+    lengths = {}
+    for raw in numbered_content.splitlines():
+        match = NUMBERED_LINE_RE.match(raw)
+        if match:
+            number = int(match.group(1))
+            lengths[number] = lengths.get(number, 0) + len(raw) + 1
+    return lengths
+
+
+def plan_violation_batches(estimator: TokenEstimator, numbered_content: str, violations: list,
+                           output_limit: int, safety: float = OUTPUT_SAFETY_FACTOR) -> list:
+    """
+    Split violations, in line order, into batches whose estimated answer fits
+    `output_limit * safety` tokens (one batch when `output_limit` is None).
+    Violations of one line stay together and overlapping context is only
+    counted once per batch. Returns
+    [{'violations', 'estimatedOutputTokens', 'estimatedPromptTokens'}].
+    """
+    lengths = _line_lengths(numbered_content)
+    limit = max(1, int(output_limit * safety)) if output_limit is not None else None
+    ordered = sorted(violations, key=lambda v: (violation_line(v) is None, violation_line(v) or 0))
+
+    # Violations reported on the same line are planned as one unit
+    units = []
+    for v in ordered:
+        line = violation_line(v)
+        if units and line is not None and violation_line(units[-1][0]) == line:
+            units[-1].append(v)
+        else:
+            units.append([v])
+
+    batches = []
+    current, covered, chars = [], set(), 0
+    for unit in units:
+        line = violation_line(unit[0])
+        window = set(range(line - OUTPUT_CONTEXT_RADIUS, line + OUTPUT_CONTEXT_RADIUS + 1)) if line is not None else set()
+        new_lines = window - covered
+        added_chars = sum(lengths.get(number, 0) for number in new_lines)
+        estimate = estimator.output_tokens(chars + added_chars, len(current) + len(unit))
+        if current and limit is not None and estimate > limit:
+            batches.append(_batch(estimator, current, chars))
+            current, covered, chars = [], set(), 0
+            new_lines = window
+            added_chars = sum(lengths.get(number, 0) for number in new_lines)
+        current.extend(unit)
+        covered |= new_lines
+        chars += added_chars
+    if current:
+        batches.append(_batch(estimator, current, chars))
+    return batches
+
+
+def _batch(estimator: TokenEstimator, violations: list, context_chars: int) -> dict:
+    return {
+        'violations': violations,
+        'estimatedOutputTokens': estimator.output_tokens(context_chars, len(violations)),
+        'rawOutputTokens': estimator.raw_output_tokens(context_chars, len(violations)),
+        'estimatedPromptTokens': estimator.prompt_tokens(build_violations_prompt(format_violations_prompt(violations))),
+    }
+
+
+def send_batched(chat, estimator: TokenEstimator, batches: list, max_turns: int = DEFAULT_MAX_TURNS,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, on_batch=None, validator=None) -> dict:
+    """
+    Send each planned batch on the same chat, following continuations if a
+    batch still overflows, and merge the results like drive_continuations.
+    Each batch's actual output recalibrates the estimator; with a
+    SnippetValidator, a batch's invalid line keys are asked for again first.
+    """
+    responses = []
+    snippets = {}
+    turns = 0
+    tokens = 0
+    usage = {key: 0 for key in USAGE_KEYS}
+    stop_reason = "complete"
+    summaries = []
+    reports = []
+
+    for batch in batches:
+        metered = MeteredChat(chat)
+        done_turns, done_snippets = turns, snippets
+
+        def batch_progress(turn, batch_snippets):
+            if on_batch is not None:
+                on_batch(done_turns + turn, merge_snippets(done_snippets, batch_snippets))
+
+        result = send_with_continuations(
+            metered, send_misra_violations, format_violations_prompt(batch['violations']),
+            max_turns=max_turns, token_budget=max(1, token_budget - tokens), on_batch=batch_progress
+        )
+        # Output of the batch itself, before any correction turn, calibrates the estimator
+        output_tokens = metered.usage['outputTokens']
+        if validator is not None and result['responses']:
+            lines = [line for line in (violation_line(v) for v in batch['violations']) if line is not None]
+            result['snippets'], report = validator.repair(metered, result['snippets'], lines)
+            reports.append(report)
+        responses.extend(result['responses'])
+        snippets = merge_snippets(snippets, result['snippets'])
+        turns += result['turns']
+        tokens += result['tokens']
+        usage = add_usage(usage, metered.usage)
+        usage['estimatedOutputTokens'] += batch['estimatedOutputTokens']
+
+        # Only complete answers say how big the batch really was
+        if result['complete'] and result['responses']:
+            estimator.observe(batch['rawOutputTokens'], batch['estimatedOutputTokens'], output_tokens)
+        summaries.append({
+            'violations': len(batch['violations']),
+            'estimatedOutputTokens': batch['estimatedOutputTokens'],
+            'outputTokens': output_tokens,
+            'turns': result['turns'],
+            'stopReason': result['stopReason'],
+        })
+        if not result['complete']:
+            stop_reason = result['stopReason']
+            if stop_reason != "max_turns":
+                break
+
+    return {
+        'responses': responses,
+        'snippets': snippets,
+        'turns': turns,
+        'tokens': tokens,
+        'complete': stop_reason == "complete",
+        'stopReason': stop_reason,
+        'batches': summaries,
+        'usage': usage,
+        'validation': merge_reports(reports) if validator is not None else None,
+    }
@@ -0,0 +1,70 @@
+# token_usage.py
+from continuation import estimate_tokens
+from instrumentation import record_tokens
+
+USAGE_KEYS = ("calls", "promptTokens", "outputTokens", "estimatedOutputTokens", "unmeteredCalls")
+
+
+def _response_text(response) -> str:
+    try:
+        return response.text or ""
+    except Exception:
+        # Blocked responses raise on .text
+        return ""
+
+
+def _usage_counts(response):
+    """(prompt tokens, output tokens) reported by the model, or None"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return (getattr(usage, 'prompt_token_count', 0) or 0,
+            getattr(usage, 'candidates_token_count', 0) or 0)
+
+
+class MeteredChat:
+    """Chat proxy that adds up the tokens of every send_message (streamed or not)"""
+
+    def __init__(self, chat):
+        self._chat = chat
+        self.usage = {key: 0 for key in USAGE_KEYS}
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+    def _record(self, message: str, counts, text: str):
+        self.usage['calls'] += 1
+        if counts is None:
+            # No usage metadata: fall back to the character estimate
+            self.usage['unmeteredCalls'] += 1
+            counts = (estimate_tokens(message), estimate_tokens(text))
+        self.usage['promptTokens'] += counts[0]
+        self.usage['outputTokens'] += counts[1]
+        record_tokens(counts[0], counts[1])
+
+    def send_message(self, message, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(message, **kwargs)
+        response = self._chat.send_message(message, **kwargs)
+        self._record(message, _usage_counts(response) if response is not None else None,
+                     _response_text(response) if response is not None else "")
+        return response
+
+    def _stream(self, message, **kwargs):
+        counts = None
+        text = []
+        try:
+            for chunk in self._chat.send_message(message, stream=True, **kwargs):
+                # The last chunk carries the totals
+                counts = _usage_counts(chunk) or counts
+                text.append(_response_text(chunk))
+                yield chunk
+        finally:
+            self._record(message, counts, "".join(text))
+
+
+def add_usage(total: dict, usage: dict) -> dict:
+    merged = dict(total or {})
+    for key in USAGE_KEYS:
+        merged[key] = merged.get(key, 0) + (usage or {}).get(key, 0)
+    return merged
@@ -0,0 +1,179 @@
+# unified_diff.py
+import re
+
+from numbered_document import NumberedDocument, clean_line
+
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+INSERT_SUFFIXES = "abcdefghijklmnopqrstuvwxy"
+
+
+class PatchError(ValueError):
+    """The patch is malformed or does not match the original source"""
+
+
+def _range(start: int, length: int) -> str:
+    # Same conventions as difflib/GNU diff: an empty range names the line before it
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def _hunk(base: list, group: list, delta: int, context: int) -> dict:
+    first, last = group[0], group[-1]
+    old_start = max(0, first['start'] - context)
+    old_end = min(len(base), last['start'] + len(last['old']) + context)
+    lines = []
+    position = old_start
+    for region in group:
+        lines.extend(f" {line}" for line in base[position:region['start']])
+        lines.extend(f"-{line}" for line in region['old'])
+        lines.extend(f"+{line}" for line in region['new'])
+        position = region['start'] + len(region['old'])
+    lines.extend(f" {line}" for line in base[position:old_end])
+
+    old_length = old_end - old_start
+    new_length = old_length + sum(len(r['new']) - len(r['old']) for r in group)
+    new_start = old_start + delta
+    return {
+        'oldStart': old_start + 1,
+        'oldLines': old_length,
+        'newStart': new_start + 1,
+        'newLines': new_length,
+        'keys': [lineno for region in group for lineno in region['keys']],
+        'header': f"@@ -{_range(old_start, old_length)} +{_range(new_start, new_length)} @@",
+        'lines': lines,
+    }
+
+
+def iter_hunks(document: NumberedDocument, context: int = 3):
+    """
+    Unified-diff hunks from the original source to the document's fixed
+    source. Built straight from the overlay's changed regions, so the cost
+    follows the number of changes rather than the size of the file.
+    """
+    base = document.original_clean_lines()
+    group = []
+    delta = 0
+    for region in document.changed_regions():
+        if group:
+            previous = group[-1]
+            if region['start'] - (previous['start'] + len(previous['old'])) > 2 * context:
+                yield _hunk(base, group, delta, context)
+                delta += sum(len(r['new']) - len(r['old']) for r in group)
+                group = []
+        group.append(region)
+    if group:
+        yield _hunk(base, group, delta, context)
+
+
+def format_hunk(hunk: dict) -> str:
+    return "".join(f"{line}\n" for line in [hunk['header']] + hunk['lines'])
+
+
+def iter_unified_diff(document: NumberedDocument, fromfile: str, tofile: str, context: int = 3):
+    """The whole-file diff as text chunks (headers, then one chunk per hunk); nothing when unchanged"""
+    started = False
+    for hunk in iter_hunks(document, context):
+        if not started:
+            yield f"--- {fromfile}\n+++ {tofile}\n"
+            started = True
+        yield format_hunk(hunk)
+
+
+def parse_unified_diff(text: str) -> list:
+    """Hunks of a single-file unified diff as {'oldStart', 'oldLines', 'lines': [(tag, text)]}"""
+    hunks = []
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        match = HUNK_HEADER_RE.match(lines[index])
+        index += 1
+        if match is None:
+            # ---/+++ headers, "diff --git", "index ..." and other preamble
+            continue
+        old_remaining = int(match.group(2)) if match.group(2) is not None else 1
+        new_remaining = int(match.group(4)) if match.group(4) is not None else 1
+        hunk = {'oldStart': int(match.group(1)), 'oldLines': old_remaining, 'lines': []}
+        while old_remaining > 0 or new_remaining > 0:
+            if index >= len(lines):
+                raise PatchError(f"Truncated hunk starting at old line {hunk['oldStart']}")
+            line = lines[index]
+            index += 1
+            if line.startswith("\\"):
+                # "\ No newline at end of file"
+                continue
+            tag, body = (line[:1] or " "), line[1:]
+            if tag == " ":
+                old_remaining -= 1
+                new_remaining -= 1
+            elif tag == "-":
+                old_remaining -= 1
+            elif tag == "+":
+                new_remaining -= 1
+            else:
+                raise PatchError(f"Unexpected line in hunk: {line!r}")
+            hunk['lines'].append((tag, body))
+        hunks.append(hunk)
+    if not hunks:
+        raise PatchError("No hunks found in the patch")
+    return hunks
+
+
+def insert_suffix(position: int) -> str:
+    """a, b, ..., y, za, zb, ... : suffixes that keep sorting after each other"""
+    repeat, index = divmod(position, len(INSERT_SUFFIXES))
+    return "z" * repeat + INSERT_SUFFIXES[index]
+
+
+def patch_to_snippets(document: NumberedDocument, patch_text: str) -> dict:
+    """
+    Translate a unified diff against the original source into numbered
+    snippets: replaced lines keep their number, added lines get suffixed
+    keys after the line before them. The numbered format cannot drop a line,
+    so removed lines become empty lines.
+    """
+    base = document.original_clean_lines()
+    snippets = {}
+
+    for hunk in parse_unified_diff(patch_text):
+        # Number of the last original line consumed
+        consumed = hunk['oldStart'] - 1 if hunk['oldLines'] else hunk['oldStart']
+        removed = []
+        anchor = consumed
+        inserted = {}
+
+        def take_original(text: str) -> int:
+            number = consumed + 1
+            if number > len(base) or base[number - 1] != clean_line(f" {text}"):
+                raise PatchError(f"Patch does not match the original source at line {number}")
+            return number
+
+        def flush_removed():
+            while removed:
+                snippets[str(removed.pop(0))] = ""
+
+        for tag, text in hunk['lines']:
+            if tag == " ":
+                flush_removed()
+                consumed = take_original(text)
+                anchor = consumed
+            elif tag == "-":
+                consumed = take_original(text)
+                removed.append(consumed)
+                anchor = consumed
+            elif removed:
+                snippets[str(removed.pop(0))] = f" {text}"
+            else:
+                count = inserted.get(anchor, 0)
+                inserted[anchor] = count + 1
+                snippets[f"{anchor}{insert_suffix(count)}"] = f" {text}"
+        flush_removed()
+
+    return snippets
+
+
+def blanked_lines(snippets: dict) -> list:
+    """Keys of lines a patch removed, which patch_to_snippets turns into empty lines"""
+    return [lineno for lineno, text in snippets.items() if text == ""]
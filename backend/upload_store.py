@@ -0,0 +1,121 @@
+# upload_store.py
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+
+# Uploads are copied to disk in chunks of this size instead of being read whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Upload size limits (bytes) per kind, overridable with MAX_<KIND>_UPLOAD_BYTES
+DEFAULT_UPLOAD_LIMITS = {
+    'source': 50 * 1024 * 1024,
+    'report': 1024 * 1024 * 1024,
+    'archive': 2 * 1024 * 1024 * 1024,
+}
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeded its size limit; nothing was stored"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds the limit of {limit} bytes")
+        self.limit = limit
+
+
+def upload_limit(kind: str) -> int:
+    value = os.environ.get(f"MAX_{kind.upper()}_UPLOAD_BYTES")
+    return int(value) if value else DEFAULT_UPLOAD_LIMITS[kind]
+
+
+def _append(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+class BlobStore:
+    """
+    Content-addressed upload storage: root/ab/<sha256><ext>. Uploads stream
+    through a temporary file while being hashed, so memory stays flat and an
+    upload identical to an existing blob is dropped instead of stored again.
+    The extension is kept because readers pick the report format from it.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._tmp = os.path.join(root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path_for(self, content_hash: str, extension: str = "") -> str:
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}{extension}")
+
+    async def save(self, file, filename: str, max_bytes: int = None) -> dict:
+        """
+        Stream an UploadFile into the store. Returns
+        {'hash', 'path', 'size', 'deduplicated'}; raises UploadTooLarge.
+        """
+        extension = os.path.splitext(filename or "")[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self._tmp, uuid.uuid4().hex)
+        try:
+            buffer = await asyncio.to_thread(open, tmp_path, "wb")
+            try:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise UploadTooLarge(max_bytes)
+                    # Hashing and writing a chunk would block the event loop
+                    await asyncio.to_thread(_append, buffer, digest, chunk)
+            finally:
+                await asyncio.to_thread(buffer.close)
+            return await asyncio.to_thread(self._commit, tmp_path, digest.hexdigest(), extension, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path: str, content_hash: str, extension: str, size: int) -> dict:
+        path = self.path_for(content_hash, extension)
+        with self._lock:
+            deduplicated = os.path.exists(path)
+            if deduplicated:
+                # Fresh mtime: the garbage collector leaves recently uploaded blobs alone
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Blobs are never written in place; readers can hold them open safely
+                os.replace(tmp_path, path)
+        return {'hash': content_hash, 'path': path, 'size': size, 'deduplicated': deduplicated}
+
+    def remove(self, path: str) -> int:
+        """Delete a blob; returns the bytes freed"""
+        with self._lock:
+            if not os.path.exists(path):
+                return 0
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+
+    def blobs(self):
+        """(path, size, mtime) of every stored blob"""
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if prefix == "tmp" or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                yield path, stat.st_size, stat.st_mtime
+
+    def stats(self) -> dict:
+        count = 0
+        total = 0
+        for _, size, _ in self.blobs():
+            count += 1
+            total += size
+        return {'blobs': count, 'bytes': total}
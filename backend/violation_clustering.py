@@ -0,0 +1,163 @@
+# violation_clustering.py
+import os
+from collections import Counter
+
+from misra_chat_client import format_violations_text
+from fanout import violation_line, base_line_number
+
+# Occurrences of one rule at most this many lines apart share a `Lines:` row
+CLUSTER_LINE_GAP = int(os.environ.get('VIOLATION_CLUSTER_GAP', '20'))
+# compact: one block per rule with its line numbers; verbose: the original five lines per violation
+VIOLATION_PROMPT_FORMAT = os.environ.get('VIOLATION_PROMPT_FORMAT', 'compact').lower()
+
+COMPACT_HEADER = (
+    "Violations are grouped by rule: each rule and its message are given once, followed by the line "
+    "numbers where it is reported (one `Lines:` row per group of nearby lines). Every listed line needs a fix. "
+    "`Line N:` notes give a different message for that line."
+)
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def violation_key(violation: dict) -> tuple:
+    """Identity of a reported violation: the same rule and message reported twice on a line is one violation"""
+    return (
+        _text(violation.get('file')), _text(violation.get('path')), violation_line(violation),
+        _text(violation.get('misra')), _text(violation.get('warning')),
+    )
+
+
+def dedupe_violations(violations: list) -> tuple:
+    """
+    Collapse exact duplicates. Returns (unique violations in first-seen order,
+    position in the unique list of every original violation).
+    """
+    unique = []
+    seen = {}
+    positions = []
+    for violation in violations:
+        key = violation_key(violation)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(violation)
+        positions.append(seen[key])
+    return unique, positions
+
+
+def cluster_violations(violations: list, line_gap: int = CLUSTER_LINE_GAP) -> list:
+    """
+    Group violations by file and rule, then split each group where consecutive
+    lines are more than `line_gap` apart. Returns clusters in file, rule and line order:
+    [{'file', 'path', 'misra', 'message', 'lines', 'notes', 'members'}] where
+    `message` is the rule's most common message, `notes` maps lines reported with
+    another message to it, and `members` are indexes into `violations`.
+    """
+    by_rule = {}
+    for index, violation in enumerate(violations):
+        key = (_text(violation.get('file')), _text(violation.get('path')), _text(violation.get('misra')))
+        by_rule.setdefault(key, []).append(index)
+
+    clusters = []
+    for (file_name, path, misra), members in by_rule.items():
+        message = Counter(_text(violations[i].get('warning')) for i in members).most_common(1)[0][0]
+        ordered = sorted(members, key=lambda i: (violation_line(violations[i]) is None, violation_line(violations[i]) or 0))
+        current = None
+        previous = None
+        for index in ordered:
+            line = violation_line(violations[index])
+            if current is None or (line is None) != (previous is None) or (line is not None and line - previous > line_gap):
+                current = {'file': file_name, 'path': path, 'misra': misra, 'message': message,
+                           'lines': [], 'notes': {}, 'members': []}
+                clusters.append(current)
+            current['members'].append(index)
+            if line is not None and line not in current['lines']:
+                current['lines'].append(line)
+            warning = _text(violations[index].get('warning'))
+            if warning != message:
+                current['notes'].setdefault(line, []).append(warning)
+            previous = line
+
+    # Files in report order, rules by their first line, so each rule's message is printed once
+    file_order = {}
+    rule_start = {}
+    for cluster in clusters:
+        file_order.setdefault((cluster['file'], cluster['path']), len(file_order))
+        rule = (cluster['file'], cluster['path'], cluster['misra'])
+        first = cluster['lines'][0] if cluster['lines'] else float('inf')
+        rule_start[rule] = min(rule_start.get(rule, first), first)
+    clusters.sort(key=lambda c: (
+        file_order[(c['file'], c['path'])], rule_start[(c['file'], c['path'], c['misra'])], c['misra'],
+        c['lines'][0] if c['lines'] else float('inf')
+    ))
+    return clusters
+
+
+def format_clustered_violations(violations: list, line_gap: int = CLUSTER_LINE_GAP) -> str:
+    """Compact prompt text: per file, each rule's message once, then the lines it is reported on"""
+    unique, _ = dedupe_violations(violations)
+    clusters = cluster_violations(unique, line_gap)
+
+    out = [COMPACT_HEADER]
+    current_file = None
+    current_rule = None
+    for cluster in clusters:
+        if (cluster['file'], cluster['path']) != current_file:
+            current_file = (cluster['file'], cluster['path'])
+            current_rule = None
+            out += ["", f"File: {cluster['file']}", f"Path: {cluster['path']}"]
+        if cluster['misra'] != current_rule:
+            current_rule = cluster['misra']
+            out += ["", f"Rule: {cluster['misra']}", f"Message: {cluster['message']}"]
+        if cluster['lines']:
+            out.append("Lines: " + ", ".join(str(line) for line in cluster['lines']))
+        else:
+            out.append("Lines: not reported")
+        for line, messages in cluster['notes'].items():
+            for message in dict.fromkeys(messages):
+                out.append(f"Line {line if line is not None else '?'}: {message}")
+    return "\n".join(out) + "\n"
+
+
+def format_violations_prompt(violations: list) -> str:
+    """The violations block of the fix prompt, in the configured VIOLATION_PROMPT_FORMAT"""
+    if VIOLATION_PROMPT_FORMAT == 'verbose':
+        return format_violations_text(violations)
+    return format_clustered_violations(violations)
+
+
+def violation_stats(violations: list, unique: list) -> dict:
+    """How much deduplication and the compact encoding shrink the violations block"""
+    clusters = cluster_violations(unique)
+    return {
+        'violations': len(violations),
+        'unique': len(unique),
+        'duplicates': len(violations) - len(unique),
+        'rules': len({(c['file'], c['path'], c['misra']) for c in clusters}),
+        'clusters': len(clusters),
+        'format': VIOLATION_PROMPT_FORMAT,
+        'verboseChars': len(format_violations_text(violations)),
+        'promptChars': len(format_violations_prompt(unique)),
+    }
+
+
+def map_results(violations: list, positions: list, snippets: dict) -> list:
+    """
+    One entry per original violation, in request order: whether the answer
+    has a snippet for its line, and which earlier violation it duplicates.
+    """
+    answered = {base_line_number(lineno) for lineno in snippets}
+    first = {}
+    results = []
+    for index, (violation, position) in enumerate(zip(violations, positions)):
+        line = violation_line(violation)
+        results.append({
+            'index': index,
+            'line': line,
+            'misra': violation.get('misra'),
+            'addressed': line is not None and line in answered,
+            'duplicateOf': first.get(position),
+        })
+        first.setdefault(position, index)
+    return results